@@ -0,0 +1,357 @@
+import numpy as np
+
+# Границы ценовых диапазонов для распределения по категориям
+PRICE_BUCKETS = ["До 100", "100-500", "500-1000", "1000-5000", "Более 5000"]
+PRICE_BOUNDS = np.array([100, 500, 1000, 5000])
+
+# Минимум товаров с каждой стороны для сравнения категории
+MIN_COMPARE_SAMPLES = 3
+
+
+def encode(values):
+    """
+    Словарное кодирование: (коды, уникальные значения в порядке первого появления).
+    """
+    index = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int32, count=len(values))
+    return codes, list(index)
+
+
+class PriceTable:
+    """
+    Колоночное представление товаров для аналитики:
+    категория и сайт — целочисленные коды, цена — массив NumPy.
+    """
+
+    def __init__(self, category, site, price, categories, sites):
+        self.category = category
+        self.site = site
+        self.price = price
+        self.categories = categories
+        self.sites = sites
+
+    @classmethod
+    def from_products(cls, products):
+        category, categories = encode([p.get("category", "Без категории") for p in products])
+        # Отсутствующий сайт кодируется как None: отчёты подставляют своё значение
+        site, sites = encode([p.get("site_name") for p in products])
+        raw = [p.get("price", 0) for p in products]
+        prices = np.array([v if isinstance(v, (int, float)) and not isinstance(v, bool) else 0 for v in raw])
+        if prices.dtype.kind not in "if":
+            prices = prices.astype(np.int64)
+        return cls(category, site, prices, categories, sites)
+
+    def __len__(self):
+        return len(self.price)
+
+    def priced(self):
+        """Маска товаров с положительной ценой"""
+        return self.price > 0
+
+
+def first_occurrence(keys, n_groups):
+    """Индекс первого появления каждого кода (-1, если кода нет)"""
+    first = np.full(n_groups, -1, dtype=np.int64)
+    # При повторяющихся индексах побеждает последняя запись — идём с конца
+    first[keys[::-1]] = np.arange(len(keys) - 1, -1, -1)
+    return first
+
+
+def group_stats(keys, prices, n_groups, percentiles=(10, 50, 90)):
+    """
+    Статистика по группам за один проход по отсортированным данным.
+    keys — код группы для каждой цены (0..n_groups-1).
+    Возвращает dict массивов длины n_groups: count, sum, min, max, mean
+    и p<q> для каждого процентиля (линейная интерполяция, как np.percentile).
+    """
+    if percentiles:
+        # Для процентилей цены нужны отсортированными внутри группы
+        order = np.lexsort((prices, keys))
+    else:
+        order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    prices = prices[order]
+
+    count = np.bincount(keys, minlength=n_groups)
+    starts = np.cumsum(count) - count
+    present = count > 0
+
+    result = {
+        "count": count,
+        "sum": np.zeros(n_groups, dtype=prices.dtype),
+        "min": np.zeros(n_groups, dtype=prices.dtype),
+        "max": np.zeros(n_groups, dtype=prices.dtype),
+        "mean": np.zeros(n_groups, dtype=np.float64)
+    }
+    if len(prices):
+        result["sum"][present] = np.add.reduceat(prices, starts[present])
+        result["min"][present] = np.minimum.reduceat(prices, starts[present])
+        result["max"][present] = np.maximum.reduceat(prices, starts[present])
+        result["mean"][present] = result["sum"][present] / count[present]
+
+    for q in percentiles:
+        values = np.zeros(n_groups, dtype=np.float64)
+        if len(prices):
+            position = starts[present] + (count[present] - 1) * (q / 100)
+            lo = np.floor(position).astype(np.int64)
+            hi = np.ceil(position).astype(np.int64)
+            weight = position - lo
+            values[present] = prices[lo] * (1 - weight) + prices[hi] * weight
+        result[f"p{q}"] = values
+    return result
+
+
+def histogram(keys, prices, n_groups, bounds=PRICE_BOUNDS):
+    """Матрица n_groups × (len(bounds)+1): число цен в каждом диапазоне"""
+    bucket = np.searchsorted(bounds, prices, side="right")
+    n_buckets = len(bounds) + 1
+    flat = np.bincount(keys * n_buckets + bucket, minlength=n_groups * n_buckets)
+    return flat.reshape(n_groups, n_buckets)
+
+
+def category_stats(table):
+    """Статистика по категориям (формат /stats/by-category)"""
+    n = len(table.categories)
+    if n == 0:
+        return []
+    total = np.bincount(table.category, minlength=n)
+
+    # Уникальные сайты категории в порядке первого появления
+    pairs = table.category.astype(np.int64) * len(table.sites) + table.site
+    first = first_occurrence(pairs, n * len(table.sites))
+    first = np.sort(first[first >= 0])
+    sites = [[] for _ in range(n)]
+    for i in first:
+        name = table.sites[table.site[i]]
+        sites[table.category[i]].append(name if name is not None else "Неизвестно")
+
+    mask = table.priced()
+    keys = table.category[mask]
+    prices = table.price[mask]
+    stats = group_stats(keys, prices, n, percentiles=())
+    buckets = histogram(keys, prices, n)
+
+    result = []
+    for code, category in enumerate(table.categories):
+        count = int(stats["count"][code])
+        category_stats = {
+            "category": category,
+            "total_products": int(total[code]),
+            "sites_count": len(sites[code]),
+            "sites": sites[code],
+            "avg_price": round(stats["sum"][code].item() / count, 2) if count else 0,
+            "min_price": stats["min"][code].item() if count else 0,
+            "max_price": stats["max"][code].item() if count else 0,
+            "price_range": f"{stats['min'][code].item()}-{stats['max'][code].item()}" if count else "0-0"
+        }
+        # Распределение по ценовым диапазонам в процентах
+        category_stats["price_distribution"] = {
+            name: round((int(c) / count) * 100, 1)
+            for name, c in zip(PRICE_BUCKETS, buckets[code])
+            if c > 0
+        } if count else {}
+        result.append(category_stats)
+
+    # Сортируем по количеству товаров (по убыванию)
+    result.sort(key=lambda x: x["total_products"], reverse=True)
+    return result
+
+
+def price_status(diff_percent):
+    """Статус и CSS-класс по разнице средних цен в процентах"""
+    if diff_percent > 15:
+        return "значительно дороже", "expensive"
+    if diff_percent > 5:
+        return "дороже", "expensive-moderate"
+    if diff_percent < -15:
+        return "значительно дешевле", "cheaper"
+    if diff_percent < -5:
+        return "дешевле", "cheaper-moderate"
+    return "на уровне рынка", "normal"
+
+
+class ComparisonMatrix:
+    """
+    Матрица сравнения категория × сайт × сайт, посчитанная за один проход.
+    Для каждой пары (категория, сайт) хранятся count/sum/mean/median/min/max,
+    для каждой тройки (категория, сайт, другой сайт) — разница средних,
+    медиан и минимальных цен и класс статуса.
+    """
+
+    def __init__(self, table):
+        mask = table.priced()
+        category = table.category[mask]
+        site = table.site[mask]
+        prices = table.price[mask]
+
+        self.categories = table.categories
+        # Отсутствующий сайт в сравнении показывается пустой строкой
+        self.sites = [name or "" for name in table.sites]
+        n_cat = len(self.categories)
+        n_site = len(self.sites)
+
+        # Категории и пары (категория, сайт) — в порядке первого появления среди товаров с ценой
+        cat_first = first_occurrence(category, n_cat)
+        self.category_order = [int(c) for c in category[np.sort(cat_first[cat_first >= 0])]]
+        pair = category.astype(np.int64) * n_site + site
+        pair_first = first_occurrence(pair, n_cat * n_site)
+        self.site_order = [[] for _ in range(n_cat)]
+        for p in pair[np.sort(pair_first[pair_first >= 0])]:
+            c, s = divmod(int(p), n_site)
+            self.site_order[c].append(s)
+
+        stats = group_stats(pair, prices, n_cat * n_site, percentiles=(50,))
+        shape = (n_cat, n_site)
+        self.count = stats["count"].reshape(shape)
+        self.sum = stats["sum"].reshape(shape)
+        self.mean = stats["mean"].reshape(shape)
+        self.median = stats["p50"].reshape(shape)
+        self.min = stats["min"].reshape(shape)
+        self.max = stats["max"].reshape(shape)
+
+        present = self.count > 0
+        # Минимум/максимум по всем сайтам, кроме данного (для «рынка» относительно сайта)
+        big = np.iinfo(np.int64).max if self.min.dtype.kind == "i" else np.inf
+        mins = np.where(present, self.min, big)
+        maxs = np.where(present, self.max, -big)
+        others = ~np.eye(n_site, dtype=bool)
+        self.others_min = np.where(others[None, :, :], mins[:, None, :], big).min(axis=2) if n_site else mins
+        self.others_max = np.where(others[None, :, :], maxs[:, None, :], -big).max(axis=2) if n_site else maxs
+
+        # Попарные разницы: [категория, сайт, другой сайт]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.avg_diff_percent = (self.mean[:, :, None] / self.mean[:, None, :] - 1) * 100
+            self.median_diff_percent = (self.median[:, :, None] / self.median[:, None, :] - 1) * 100
+        self.min_diff = self.min[:, :, None].astype(np.float64) - self.min[:, None, :]
+        both = present[:, :, None] & present[:, None, :]
+        self.avg_diff_percent[~both] = np.nan
+        self.median_diff_percent[~both] = np.nan
+        self.min_diff[~both] = np.nan
+
+    def site_code(self, name):
+        """Код сайта по названию (без учёта регистра) или None"""
+        name = (name or "").lower()
+        for code, site_name in enumerate(self.sites):
+            if site_name.lower() == name:
+                return code
+        return None
+
+    def pairs(self):
+        """Все попарные сравнения: {категория: {сайт: {другой сайт: {...}}}}"""
+        result = {}
+        for c in self.category_order:
+            by_site = {}
+            for s in self.site_order[c]:
+                by_other = {}
+                for o in self.site_order[c]:
+                    if o == s:
+                        continue
+                    avg_diff = self.avg_diff_percent[c, s, o].item()
+                    by_other[self.sites[o]] = {
+                        "avg_diff_percent": round(avg_diff, 1),
+                        "median_diff_percent": round(self.median_diff_percent[c, s, o].item(), 1),
+                        "min_diff": round(self.min_diff[c, s, o].item(), 2),
+                        "status_class": price_status(avg_diff)[1]
+                    }
+                by_site[self.sites[s]] = {
+                    "count": int(self.count[c, s]),
+                    "avg_price": round(self.mean[c, s].item(), 2),
+                    "median_price": round(self.median[c, s].item(), 2),
+                    "min_price": self.min[c, s].item(),
+                    "max_price": self.max[c, s].item(),
+                    "vs": by_other
+                }
+            result[self.categories[c]] = by_site
+        return result
+
+    def subject_view(self, subject, prefix="subject"):
+        """
+        Сравнение средних цен сайта subject со средними ценами остальных сайтов
+        (формат /compare/jysk; ключи <prefix>_stats, <prefix>_count, <prefix>_advantage).
+        """
+        s = self.site_code(subject)
+        result = []
+        for c in self.category_order:
+            subject_count = int(self.count[c, s]) if s is not None else 0
+            other_sites = [o for o in self.site_order[c] if o != s]
+            market_count = sum(int(self.count[c, o]) for o in other_sites)
+            if subject_count < MIN_COMPARE_SAMPLES or market_count < MIN_COMPARE_SAMPLES:
+                continue
+
+            subject_avg = self.sum[c, s].item() / subject_count
+            other_avg = sum(self.sum[c, o].item() for o in other_sites) / market_count
+            price_diff_percent = ((subject_avg - other_avg) / other_avg) * 100 if other_avg > 0 else 0
+            status, status_class = price_status(price_diff_percent)
+
+            # Сравнение с каждым сайтом отдельно (тоже по средним)
+            site_comparison = []
+            for o in other_sites:
+                count = int(self.count[c, o])
+                if count < MIN_COMPARE_SAMPLES:
+                    continue
+                site_avg = self.sum[c, o].item() / count
+                diff = ((subject_avg - site_avg) / site_avg) * 100 if site_avg > 0 else 0
+                site_comparison.append({
+                    "site": self.sites[o],
+                    "avg_price": round(site_avg, 2),
+                    "product_count": count,
+                    "diff_percent": round(diff, 1),
+                    "status": "дороже" if diff > 0 else "дешевле"
+                })
+            site_comparison.sort(key=lambda x: x["diff_percent"])
+
+            result.append({
+                "category": self.categories[c],
+                f"{prefix}_stats": {
+                    "avg_price": round(subject_avg, 2),
+                    "min_price": self.min[c, s].item(),
+                    "max_price": self.max[c, s].item(),
+                    "count": subject_count
+                },
+                "market_stats": {
+                    "avg_price": round(other_avg, 2),
+                    "min_price": self.others_min[c, s].item(),
+                    "max_price": self.others_max[c, s].item(),
+                    "count": market_count
+                },
+                "comparison": {
+                    "price_diff": round(subject_avg - other_avg, 2),
+                    "price_diff_percent": round(price_diff_percent, 1),
+                    "status": status,
+                    "status_class": status_class
+                },
+                "site_comparison": site_comparison,
+                "samples": {
+                    f"{prefix}_count": subject_count,
+                    "market_count": market_count,
+                    "total_sites": len(other_sites) + 1
+                }
+            })
+
+        # Сортируем по абсолютной разнице в процентах
+        result.sort(key=lambda x: abs(x["comparison"]["price_diff_percent"]), reverse=True)
+
+        total_categories = len(result)
+        if total_categories > 0:
+            categories_where_cheaper = len([r for r in result if r["comparison"]["price_diff_percent"] < -5])
+            categories_where_expensive = len([r for r in result if r["comparison"]["price_diff_percent"] > 5])
+            avg_price_diff = round(
+                sum([r["comparison"]["price_diff_percent"] for r in result]) / total_categories,
+                1
+            )
+        else:
+            categories_where_cheaper = 0
+            categories_where_expensive = 0
+            avg_price_diff = 0
+
+        return {
+            "comparison": result,
+            "summary": {
+                "total_categories": total_categories,
+                "categories_where_cheaper": categories_where_cheaper,
+                "categories_where_expensive": categories_where_expensive,
+                "categories_where_normal": total_categories - categories_where_cheaper - categories_where_expensive,
+                "avg_price_diff": avg_price_diff,
+                f"{prefix}_advantage": avg_price_diff < 0
+            }
+        }
@@ -1,34 +1,83 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
-from parser import citymebel, akram_mebel, hoff, jysk, utils
+from parser import utils
+from parser.checkpoint import CrawlCheckpoint
+from jobs import JobManager
+from refresh import RefreshPlanner
+import analytics
+from sketches import SketchStore, sketch_prices
+from matching import ProductMatcher
+from search import SearchIndex
+from store import ProductTable, read_snapshot, write_snapshot, read_arrow, write_arrow, MISSING, FIELDS as PRODUCT_FIELDS
+import exports
+import importer
+from changes import ChangeLog
+from partitions import PartitionStore, file_stamp
 from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
+import importlib
 import os
 import json
+import time
 import atexit
-import csv
+import threading
 import io
 
 app = Flask(__name__)
 CORS(app)
 
+# Товары прежнего формата одним файлом: читаются только для перехода на партиции
 DATA_FILE = "data/products.json"
+# Товары по партициям и манифест с версией и временем парсинга каждой из них;
+# рядом с JSON партиции лежит её бинарный снимок (msgpack) для быстрого старта воркеров
+PARTITIONS_DIR = "data/partitions"
+# True — отдельная партиция на каждую пару (сайт, категория), иначе — на сайт
+PARTITION_BY_CATEGORY = False
+# Колоночный снимок Arrow IPC для выгрузок и внешнего анализа (нужен pyarrow)
+ARROW_FILE = "data/products.arrow"
+# Готовые файлы выгрузок, по одному на отчёт и версию данных
+EXPORTS_DIR = "data/exports"
+# Журнал изменений каталога для /changes
+CHANGES_FILE = "data/changes.jsonl"
+# SSE /changes/stream: период проверки журнала и максимальная длительность соединения, сек.
+# Соединение занимает синхронный воркер gunicorn, поэтому оно короткое (long-poll,
+# меньше таймаута воркера 30 с): EventSource переподключается сам и продолжает с Last-Event-ID
+CHANGES_POLL_SECONDS = 5
+CHANGES_STREAM_SECONDS = 20
 CATEGORIES_FILE = "data/categories.json"
 LAST_PARSED_FILE = "data/last_parsed.txt"
 COMPARISON_FILE = "data/comparison.json"
+# Файл-блокировка: парсинг выполняет только один процесс (воркер gunicorn)
+CRAWL_LOCK_FILE = "data/crawl.lock"
+# Состояние задач парсинга: статус и отмена доступны из любого воркера
+JOBS_DIR = "data/jobs"
+# Журнал обработанных страниц для продолжения прерванного парсинга
+CHECKPOINT_FILE = "data/crawl_checkpoint.jsonl"
+# Интервалы обновления по категориям (см. refresh.py)
+REFRESH_STATE_FILE = "data/refresh_state.json"
+# Как часто планировщик проверяет, какие категории пора обновить, мин
+REFRESH_CHECK_MINUTES = 15
+# Границы постраничного вывода /search
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_OFFSET = 10000
+# Квантильные скетчи цен по (категория, сайт)
+SKETCHES_FILE = "data/sketches.json"
+# Общий лимит времени на один парсинг всех сайтов, сек
+CRAWL_DEADLINE = 45 * 60
+# CRAWLER_ENABLED=0 — воркер только отдаёт данные: без планировщика и парсеров
+CRAWLER_ENABLED = os.environ.get("CRAWLER_ENABLED", "1") != "0"
 
 os.makedirs("data", exist_ok=True)
 
 SITES = [
     {
-        "parser": citymebel,
+        "parser": "citymebel",
         "name": "City Mebel",
         "categories": {
             "Диваны": "https://citymebel.tj/product-category/living_rooms/sofas/"
         }
     },
     {
-        "parser": akram_mebel,
+        "parser": "akram_mebel",
         "name": "Akram Mebel",
         "categories": {
             "Стулья": "https://akram-mebel.tj/pc/stulya/",
@@ -43,7 +92,7 @@ SITES = [
         }
     },
     {
-        "parser": hoff,
+        "parser": "hoff",
         "name": "HOFF",
         "categories": {
             "Диваны": "https://hoff.ru/catalog/gostinaya/divany/",
@@ -53,7 +102,7 @@ SITES = [
         }
     },
     {
-        "parser": jysk,
+        "parser": "jysk",
         "name": "JYSK",
         "categories": {
             "Диваны": "https://jysk.tj/product-category/gostinaya/divany/",
@@ -63,6 +112,10 @@ SITES = [
     }
 ]
 
+def site_parser(site):
+    """Модуль парсера сайта; парсеры (requests, BeautifulSoup) загружаются только при парсинге"""
+    return importlib.import_module(f"parser.{site['parser']}")
+
 def get_last_parsed_date():
     """Получить дату последнего парсинга"""
     try:
@@ -78,7 +131,7 @@ def get_last_parsed_date():
 def save_last_parsed_date():
     """Сохранить дату текущего парсинга"""
     try:
-        with open(LAST_PARSED_FILE, "w") as f:
+        with utils.atomic_write(LAST_PARSED_FILE) as f:
             f.write(datetime.now().isoformat())
     except Exception as e:
         print(f"Ошибка при сохранении даты парсинга: {e}")
@@ -95,6 +148,228 @@ def should_parse_today():
     # Парсить только если последний парсинг был не сегодня
     return last_parsed_date != today
 
+partition_store = PartitionStore(PARTITIONS_DIR, by_category=PARTITION_BY_CATEGORY)
+
+def data_version():
+    """Версия данных: меняется при изменении любой партиции (до перехода — products.json)"""
+    version = partition_store.version()
+    if version is not None:
+        return version
+    return file_stamp(DATA_FILE)
+
+def data_updated_at():
+    """Когда появилась текущая версия данных: этой датой помечаются кешируемые выгрузки"""
+    revised_at = partition_store.revised_at()
+    if revised_at is not None:
+        return datetime.fromisoformat(revised_at)
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(DATA_FILE))
+    except OSError:
+        return datetime.now()
+
+_table_cache = {"version": None, "table": None}
+# Таблицы партиций: ключ -> (версия партиции, таблица)
+_partition_tables = {}
+_table_lock = threading.Lock()
+
+def load_partition_table(key):
+    """Таблица партиции из бинарного снимка, а если он устарел — из JSON"""
+    filename = partition_store.path(key)
+    snapshot = partition_store.path(key, "msgpack")
+    source = file_stamp(filename)
+    table = read_snapshot(snapshot, source)
+    if table is None:
+        table = ProductTable.from_products(partition_store.load(key))
+        # Следующие воркеры прочитают снимок вместо разбора JSON
+        write_snapshot(table, snapshot, source)
+    return table
+
+def get_product_table():
+    """
+    Товары в колоночном виде. При смене версии данных перечитываются
+    только партиции, версия которых в манифесте изменилась.
+    """
+    version = data_version()
+    with _table_lock:
+        if _table_cache["version"] != version or _table_cache["table"] is None:
+            manifest = partition_store.manifest()
+            if manifest is None:
+                # Данные ещё не разбиты на партиции
+                products = utils.load_json(DATA_FILE)
+                if not isinstance(products, list):
+                    return None
+                table = ProductTable.from_products(products)
+            else:
+                tables = []
+                reloaded = 0
+                for key, entry in manifest["partitions"].items():
+                    cached = _partition_tables.get(key)
+                    if cached is None or cached[0] != entry["version"]:
+                        cached = _partition_tables[key] = (entry["version"], load_partition_table(key))
+                        reloaded += 1
+                    tables.append(cached[1])
+                for key in set(_partition_tables) - set(manifest["partitions"]):
+                    del _partition_tables[key]
+                table = ProductTable.concat(tables)
+                if reloaded:
+                    print(f"Перечитано партиций: {reloaded} из {len(tables)}")
+            _table_cache["table"] = table
+            _table_cache["version"] = version
+        return _table_cache["table"]
+
+change_log = ChangeLog(CHANGES_FILE)
+
+def save_partitions(groups, previous, source, replace=False):
+    """
+    Сохранить партиции groups {ключ: товары} (вызывается под CRAWL_LOCK_FILE).
+    previous — их прежнее содержимое: неизменившиеся партиции не переписываются,
+    разница по изменившимся записывается в журнал изменений.
+    replace=True — партиции, которых нет в groups, удаляются.
+    """
+    changed = partition_store.write(groups, previous, source, replace=replace)
+    if not changed:
+        return changed
+    change_log.record(
+        [product for key in changed for product in previous.get(key, [])],
+        [product for key in changed for product in groups.get(key, [])],
+        source
+    )
+    manifest = partition_store.manifest()
+    with _table_lock:
+        for key in changed:
+            if key not in groups:
+                continue
+            table = ProductTable.from_products(groups[key])
+            write_snapshot(table, partition_store.path(key, "msgpack"), file_stamp(partition_store.path(key)))
+            _partition_tables[key] = (manifest["partitions"][key]["version"], table)
+    return changed
+
+def save_products(products, previous, source=None):
+    """Сохранить каталог целиком: previous — прежний каталог, переписываются только изменившиеся партиции"""
+    return save_partitions(
+        partition_store.split(products),
+        partition_store.split(previous),
+        source,
+        replace=True
+    )
+
+def ensure_partitions():
+    """
+    Разбить данные на партиции, если их ещё нет (products.json прежнего формата)
+    или схема разбиения в манифесте другая. Вызывается под CRAWL_LOCK_FILE.
+    """
+    manifest = partition_store.manifest()
+    if manifest is not None and partition_store.matches_layout(manifest):
+        return
+    if manifest is None:
+        products = utils.load_json(DATA_FILE)
+        if not isinstance(products, list) or not products:
+            return
+    else:
+        products = partition_store.products()
+    partition_store.write(partition_store.split(products), {}, source="migrate", replace=True)
+    print(f"[{datetime.now()}] Товары разбиты на партиции: {partition_store.total()} в {PARTITIONS_DIR}")
+    if manifest is None:
+        # Манифест уже записан: прежний файл больше не читается, а устаревшей копией
+        # не должен подменить партиции, если их удалят — оставляем его как резервную копию
+        try:
+            os.replace(DATA_FILE, DATA_FILE + ".migrated")
+        except OSError as e:
+            print(f"Не удалось переименовать {DATA_FILE}: {e}")
+
+def category_counts():
+    """Число товаров по категориям из манифеста; настроенные категории без товаров — 0"""
+    counts = {category: 0 for site in SITES for category in site["categories"]}
+    counts.update(partition_store.category_counts())
+    return counts
+
+def save_categories(sites_status=None):
+    """Обновить categories.json по манифесту; sites_status=None — оставить прежние статусы"""
+    categories_data = {
+        "total_products": partition_store.total(),
+        "categories": category_counts(),
+        "last_updated": datetime.now().isoformat(),
+        "sites_count": len(SITES)
+    }
+    if sites_status is None:
+        previous = utils.load_json(CATEGORIES_FILE)
+        sites_status = previous.get("sites_status") if isinstance(previous, dict) else None
+    if sites_status is not None:
+        categories_data["sites_status"] = sites_status
+    utils.save_json(categories_data, CATEGORIES_FILE)
+    return categories_data
+
+export_cache = exports.ArtifactCache(EXPORTS_DIR)
+
+_arrow_lock = threading.Lock()
+
+def get_arrow_snapshot():
+    """Arrow-снимок текущей версии через memory map; пересоздаётся, если устарел"""
+    version = data_version()
+    with _arrow_lock:
+        arrow = read_arrow(ARROW_FILE, version)
+        if arrow is None:
+            # Нет данных, pyarrow или снимок не записался — вызывающий код отвечает ошибкой
+            table = get_product_table()
+            if table is None or not write_arrow(table, ARROW_FILE, version):
+                return None
+            arrow = read_arrow(ARROW_FILE, version)
+        return arrow
+
+# Матрица сравнения сайтов, посчитанная для текущей версии данных
+_comparison_cache = {"version": None, "matrix": None}
+_comparison_lock = threading.Lock()
+
+def get_comparison_matrix():
+    """Матрица сравнения всех сайтов; пересчитывается только при смене версии данных"""
+    version = data_version()
+    with _comparison_lock:
+        if _comparison_cache["version"] != version or _comparison_cache["matrix"] is None:
+            table = get_product_table()
+            if table is None:
+                return None
+            _comparison_cache["matrix"] = analytics.ComparisonMatrix(table.price_table())
+            _comparison_cache["version"] = version
+        return _comparison_cache["matrix"]
+
+_search_cache = {"index": None}
+_search_lock = threading.Lock()
+
+def get_search_index():
+    """Поисковый индекс; строится заново только при смене версии данных"""
+    version = data_version()
+    index = _search_cache["index"]
+    if index is not None and index.version == version:
+        return index
+    # Новый индекс строит один запрос; остальные тем временем отвечают по старому
+    # (ждут только при самом первом построении, когда старого ещё нет)
+    if not _search_lock.acquire(blocking=index is None):
+        return index
+    try:
+        index = _search_cache["index"]
+        if index is None or index.version != version:
+            table = get_product_table()
+            if table is None:
+                return None
+            index = SearchIndex(table, version=version)
+            _search_cache["index"] = index
+            print(f"Поисковый индекс построен: {len(table)} товаров за {index.build_seconds} с")
+        return index
+    finally:
+        _search_lock.release()
+
+product_matcher = ProductMatcher()
+
+def get_product_matcher():
+    """Индекс сопоставления товаров; при смене версии данных обновляется инкрементально"""
+    version = data_version()
+    if product_matcher.version != version:
+        table = get_product_table()
+        if table is None:
+            return None
+        product_matcher.sync(table, version=version)
+    return product_matcher
+
 def save_comparison_data(data):
     """Сохранить данные сравнения в файл"""
     try:
@@ -115,106 +390,380 @@ def load_comparison_data():
         print(f"Ошибка при загрузке данных сравнения: {e}")
     return None
 
-def parse_all_sites(force=False):
-    """Парсирует все сайты и сохраняет с категориями"""
+def crawl_units():
+    """Список пар (сайт, категория) в порядке обхода"""
+    return [
+        (site["name"], category_name)
+        for site in SITES
+        for category_name in site["categories"]
+    ]
+
+def refresh_units():
+    """Список (сайт, категория, url) для планировщика обновлений"""
+    return [
+        (site["name"], category_name, cat_url)
+        for site in SITES
+        for category_name, cat_url in site["categories"].items()
+    ]
+
+def site_units(site_names):
+    """Все пары (сайт, категория) указанных сайтов — обновление их партиций целиком"""
+    return [unit for unit in crawl_units() if unit[0] in site_names]
+
+refresh_planner = RefreshPlanner(REFRESH_STATE_FILE)
+sketch_store = SketchStore(SKETCHES_FILE)
+
+def parse_all_sites(force=False, job=None, units=None, sites=None):
+    """
+    Парсирует все сайты и сохраняет с категориями.
+    units — список пар (сайт, категория) для частичного обновления:
+    перезаписываются только их партиции, остальные не читаются и не меняются.
+    sites — названия сайтов, партиции которых нужно обновить целиком.
+    Если передана задача job, в неё пишется прогресс; при отмене
+    задачи парсинг прерывается, а сохранённые данные не изменяются.
+    """
+    if sites is not None:
+        units = list(units or []) + site_units(sites)
+    
     # Проверяем, нужно ли парсить сегодня
-    if not force and not should_parse_today():
-        print(f"[{datetime.now()}] Парсинг уже выполнялся сегодня. Пропускаем.")
+    if units is None and not force and not should_parse_today():
+        return skipped_parse_result()
+    
+    # Парсит только процесс, получивший блокировку; остальные воркеры
+    # подхватят новые данные из файлов после завершения парсинга
+    with utils.file_lock(CRAWL_LOCK_FILE) as acquired:
+        if not acquired:
+            print(f"[{datetime.now()}] Парсинг уже выполняется другим процессом. Пропускаем.")
+            return {
+                "status": "busy",
+                "count": 0,
+                "categories": {},
+                "message": "Парсинг уже выполняется другим процессом"
+            }
         
-        # Загружаем существующие данные для возврата
-        try:
+        # Повторная проверка под блокировкой: другой процесс мог только что закончить
+        if units is None and not force and not should_parse_today():
+            return skipped_parse_result()
+        if units is not None and not force:
+            due = set(refresh_planner.due_units(refresh_units(), get_last_parsed_date(), limit_per_host=None))
+            units = [unit for unit in units if tuple(unit) in due]
+            if not units:
+                return skipped_parse_result()
+        
+        return crawl_all_sites(job, units)
+
+def skipped_parse_result():
+    """Результат для пропущенного парсинга (уже выполнялся сегодня)"""
+    print(f"[{datetime.now()}] Парсинг уже выполнялся сегодня. Пропускаем.")
+    
+    # Счётчики берём из манифеста, не читая сами товары
+    try:
+        if partition_store.manifest() is not None:
+            count = partition_store.total()
+            categories_count = category_counts()
+        else:
             products = utils.load_json(DATA_FILE)
             categories_data = utils.load_json(CATEGORIES_FILE)
-            
-            if isinstance(categories_data, dict):
-                categories_count = categories_data.get("categories", {})
-            else:
-                categories_count = {}
-            
-            return {
-                "status": "skipped", 
-                "count": len(products) if isinstance(products, list) else 0, 
-                "categories": categories_count,
-                "message": "Парсинг уже выполнялся сегодня"
-            }
-        except Exception as e:
-            print(f"Ошибка при загрузке кешированных данных: {e}")
-            # Если не удалось загрузить, парсим заново
+            count = len(products) if isinstance(products, list) else 0
+            categories_count = categories_data.get("categories", {}) if isinstance(categories_data, dict) else {}
+    except Exception as e:
+        print(f"Ошибка при загрузке кешированных данных: {e}")
+        count = 0
+        categories_count = {}
+    
+    return {
+        "status": "skipped", 
+        "count": count, 
+        "categories": categories_count,
+        "message": "Парсинг уже выполнялся сегодня"
+    }
+
+def crawl_all_sites(job=None, units=None):
+    """Обход всех сайтов (или только units); вызывается под блокировкой CRAWL_LOCK_FILE"""
+    if units is None:
+        print(f"[{datetime.now()}] Начало парсинга всех сайтов...")
+    else:
+        units = {tuple(unit) for unit in units}
+        print(f"[{datetime.now()}] Начало обновления категорий: {len(units)}")
     
-    print(f"[{datetime.now()}] Начало парсинга всех сайтов...")
+    ensure_partitions()
+    
+    # Читаем только партиции, которые будут перезаписаны: товары нетронутых
+    # категорий в них сохраняются, остальные партиции не меняются
+    touched = None if units is None else {partition_store.unit_key(*unit) for unit in units}
+    old_partitions = partition_store.load_all(touched)
+    # Текущие товары по (сайт, категория): для нетронутых категорий
+    # и для оценки частоты изменений
+    previous = {}
+    for products in old_partitions.values():
+        for product in products:
+            key = (product.get("site_name"), product.get("category"))
+            previous.setdefault(key, []).append(product)
+    stored_counts = {}
+    manifest = partition_store.manifest()
+    for key, entry in (manifest["partitions"].items() if manifest else []):
+        if touched is not None and key not in touched:
+            for category_name, count in entry["categories"].items():
+                stored_counts[(entry["site"], category_name)] = count
     
     all_items = []
-    categories_count = {}
-    
-    for site in SITES:
-        parser = site["parser"]
-        site_name = site["name"]
-        for category_name, cat_url in site["categories"].items():
-            try:
-                items = parser.parse_category(cat_url)
-                for item in items:
-                    item["category"] = category_name
-                    item["site_name"] = site_name
-                    print(item["category"], item["site_name"])
-                all_items.extend(items)
+    sites_status = {}
+    refreshed = []
+    failed = []
+    unit_sketches = {}
+    
+    from parser import fetcher
+    
+    checkpoint = CrawlCheckpoint.open(CHECKPOINT_FILE)
+    if checkpoint.resumed:
+        print(f"[{datetime.now()}] Продолжение парсинга с чекпоинта от {checkpoint.started_at}")
+    
+    try:
+        with fetcher.deadline(CRAWL_DEADLINE):
+            for site in SITES:
+                parser = site_parser(site)
+                site_name = site["name"]
+                site_status = sites_status[site_name] = {"status": "ok", "categories": {}}
+                for category_name, cat_url in site["categories"].items():
+                    if units is not None and (site_name, category_name) not in units:
+                        # Категорию не обновляем: товары из перезаписываемой партиции
+                        # сохраняем, остальные партиции остаются на диске как есть
+                        if partition_store.unit_key(site_name, category_name) in touched:
+                            kept = previous.get((site_name, category_name), [])
+                            all_items.extend(kept)
+                            kept_count = len(kept)
+                        else:
+                            kept_count = stored_counts.get((site_name, category_name), 0)
+                        site_status["categories"][category_name] = {"status": "kept", "items": kept_count, "error": None}
+                        continue
+                    if job:
+                        job.start_unit(site_name, category_name)
+                    status, error = "done", None
+                    saved = checkpoint.get(site_name, category_name)
+                    items = list(saved["items"]) if saved else []
+                    if saved and saved["done"]:
+                        print(f"{site_name} -> {category_name}: взято из чекпоинта ({len(items)} товаров)")
+                    elif fetcher.deadline_exceeded():
+                        status, error = ("partial" if items else "skipped"), "истёк лимит времени парсинга"
+                    else:
+                        def on_page(page, page_items, source=None, site_name=site_name, category_name=category_name):
+                            checkpoint.record_page(site_name, category_name, page, page_items, source)
+                        
+                        start_page = saved["page"] + 1 if saved else 1
+                        try:
+                            try:
+                                items += parser.parse_category(
+                                    cat_url, start_page=start_page, on_page=on_page,
+                                    source=saved["source"] if saved else None
+                                )
+                            except fetcher.ResumeUnavailable as e:
+                                # Страницы чекпоинта нельзя продолжить тем же способом — обходим заново
+                                print(f"{site_name} -> {category_name}: парсим с первой страницы ({e})")
+                                checkpoint.reset(site_name, category_name)
+                                items = []
+                                items += parser.parse_category(cat_url, on_page=on_page)
+                            checkpoint.complete(site_name, category_name)
+                        except fetcher.CategoryIncomplete as e:
+                            # Сохраняем то, что успели собрать до ошибки
+                            items += e.items
+                            status, error = ("partial" if items else "error"), e.reason
+                        except Exception as e:
+                            status, error = ("partial" if items else "error"), str(e)
+                        if error:
+                            print(f"Ошибка при парсинге {site_name} -> {category_name}: {error}")
+                    
+                    for item in items:
+                        item["category"] = category_name
+                        item["site_name"] = site_name
+                        print(item["category"], item["site_name"])
+                    
+                    fetched = len(items)
+                    old_items = previous.get((site_name, category_name), [])
+                    if status == "done":
+                        refreshed.append((site_name, category_name, old_items, items))
+                    else:
+                        # Неполный обход не удаляет товары: недошедшие до парсинга
+                        # остаются из сохранённых данных, полученные — обновляются
+                        links = {item.get("link") for item in items}
+                        items = items + [p for p in old_items if p.get("link") not in links]
+                        failed.append((site_name, category_name, error))
+                    all_items.extend(items)
+                    unit_sketches[(category_name, site_name)] = sketch_prices(items)
+                    
+                    site_status["categories"][category_name] = {
+                        "status": status,
+                        "items": fetched,
+                        "kept": len(items) - fetched,
+                        "error": error
+                    }
+                    if job:
+                        job.add_items(site_name, category_name, fetched)
+                        job.finish_unit(site_name, category_name, status=status)
                 
-                if category_name not in categories_count:
-                    categories_count[category_name] = 0
-                categories_count[category_name] += len(items)
-            except Exception as e:
-                print(f"Ошибка при парсинге {site_name} -> {category_name}: {e}")
-                continue
+                category_statuses = [c["status"] for c in site_status["categories"].values() if c["status"] != "kept"]
+                if not category_statuses:
+                    site_status["status"] = "kept"
+                elif all(c == "done" for c in category_statuses):
+                    site_status["status"] = "ok"
+                elif any(c in ("done", "partial") for c in category_statuses):
+                    site_status["status"] = "partial"
+                else:
+                    site_status["status"] = "failed"
+    finally:
+        checkpoint.close()
     
-    # Сохраняем товары
-    utils.save_json(all_items, DATA_FILE)
+    # Отменённая задача не должна перезаписывать данные частичным результатом;
+    # журнал остаётся, и следующий парсинг продолжит с места остановки
+    if job:
+        job.check_cancelled()
     
-    # Сохраняем статистику категорий
-    categories_data = {
-        "total_products": len(all_items),
-        "categories": categories_count,
-        "last_updated": datetime.now().isoformat(),
-        "sites_count": len(SITES)
-    }
-    utils.save_json(categories_data, CATEGORIES_FILE)
+    # Сохраняем товары: обновлённые партиции (опустевшие — пустыми),
+    # при полном обходе партиции без товаров удаляются
+    groups = {key: [] for key in touched} if touched is not None else {}
+    for key, products in partition_store.split(all_items).items():
+        groups.setdefault(key, []).extend(products)
+    changed = save_partitions(groups, old_partitions, source="crawl", replace=units is None)
+    print(f"[{datetime.now()}] Изменилось партиций: {len(changed)}")
     
-    # Сохраняем дату парсинга
-    save_last_parsed_date()
+    # Статистика категорий складывается из манифеста
+    categories_data = save_categories(sites_status)
+    categories_count = categories_data["categories"]
     
-    print(f"[{datetime.now()}] Парсинг завершён. Загружено товаров: {len(all_items)}")
+    # Сохраняем дату парсинга (только для полного обхода)
+    if units is None:
+        save_last_parsed_date()
     
-    return {"status": "success", "count": len(all_items), "categories": categories_count}
+    # Обновляем интервалы по наблюдаемым изменениям
+    refresh_planner.record(refreshed)
+    # Неудачные категории повторяем с растущей паузой, а не на каждом проходе
+    refresh_planner.record_failures(failed)
+    
+    # Обновляем квантильные скетчи (текущие и накопленные за всю историю)
+    sketch_store.record(unit_sketches, replace_all=units is None)
+    
+    # Результат сохранён — журнал больше не нужен
+    checkpoint.clear()
+    
+    print(f"[{datetime.now()}] Парсинг завершён. Товаров в каталоге: {categories_data['total_products']}")
+    
+    return {
+        "status": "success",
+        "count": categories_data["total_products"],
+        "categories": categories_count,
+        "sites": sites_status
+    }
 
-# Настройка автопарсинга
-scheduler = BackgroundScheduler()
+# Фоновые задачи парсинга (один активный парсинг на процесс)
+crawl_jobs = JobManager(runner=parse_all_sites, units_factory=crawl_units, state_dir=JOBS_DIR)
 
 def scheduled_parse():
-    """Функция для автоматического парсинга раз в день"""
+    """Автоматическое обновление категорий, у которых подошёл срок"""
     try:
-        print(f"[{datetime.now()}] Проверка необходимости автоматического парсинга...")
-        if should_parse_today():
-            print(f"[{datetime.now()}] Начало автоматического парсинга...")
-            result = parse_all_sites(force=True)
-            print(f"[{datetime.now()}] Парсинг завершён. Загружено товаров: {result['count']}")
-        else:
-            print(f"[{datetime.now()}] Автоматический парсинг не требуется (уже выполнялся сегодня)")
+        due = refresh_planner.due_units(refresh_units(), get_last_parsed_date())
+        if due:
+            # force=False: под блокировкой сроки проверяются повторно, поэтому
+            # при нескольких воркерах обновление выполнит только один из них
+            print(f"[{datetime.now()}] Пора обновить категории: {due}")
+            job, merged = crawl_jobs.submit(force=False, units=due)
+            print(f"[{datetime.now()}] Задача парсинга {job.id} {'уже выполняется' if merged else 'запущена'}")
     except Exception as e:
         print(f"Ошибка при автоматическом парсинге: {e}")
 
-# Запускаем проверку каждый день в 2:00 утра
-scheduler.add_job(func=scheduled_parse, trigger="cron", hour=2, minute=0)
-scheduler.start()
+def start_scheduler():
+    """Настройка автопарсинга (только в процессах с CRAWLER_ENABLED)"""
+    from apscheduler.schedulers.background import BackgroundScheduler
+    
+    scheduler = BackgroundScheduler()
+    # Проверяем сроки обновления категорий каждые REFRESH_CHECK_MINUTES минут
+    scheduler.add_job(func=scheduled_parse, trigger="interval", minutes=REFRESH_CHECK_MINUTES)
+    scheduler.start()
+    
+    # Останавливаем scheduler при выходе
+    atexit.register(lambda: scheduler.shutdown())
+    return scheduler
+
+scheduler = start_scheduler() if CRAWLER_ENABLED else None
 
-# Останавливаем scheduler при выходе
-atexit.register(lambda: scheduler.shutdown())
+if CRAWLER_ENABLED:
+    # Переход на партиции при первом запуске. Каждый воркер пробует взять блокировку
+    # парсинга без ожидания: разбивает данные тот, кто взял её первым, остальные
+    # видят готовый манифест. Если блокировку держит парсинг или импорт, разобьёт он сам
+    with utils.file_lock(CRAWL_LOCK_FILE) as acquired:
+        if acquired:
+            ensure_partitions()
 
 # ========== API ENDPOINTS ==========
 
 @app.route("/fetch", methods=["POST"])
 def fetch():
-    """Запускает парсинг всех сайтов (принудительно или если не парсили сегодня)"""
+    """
+    Ставит парсинг всех сайтов в фон (принудительно или если не парсили сегодня).
+    site=<название> (можно несколько) — обновить только партиции этих сайтов.
+    Сразу возвращает id задачи; повторный вызов присоединяется к задаче любого воркера,
+    если она выполнит и его, иначе встаёт в очередь за ней.
+    """
     force = request.args.get("force", "false").lower() == "true"
-    result = parse_all_sites(force=force)
-    return jsonify(result)
+    sites = request.args.getlist("site")
+    
+    if not CRAWLER_ENABLED:
+        return jsonify({"error": "Парсинг в этом процессе выключен (CRAWLER_ENABLED=0)"}), 503
+    
+    if sites:
+        known = [site["name"] for site in SITES]
+        unknown = [name for name in sites if name not in known]
+        if unknown:
+            return jsonify({"error": f"Сайт не найден: {', '.join(unknown)}", "sites": known}), 404
+        # Явно запрошенные сайты обновляются независимо от сроков
+        job, merged = crawl_jobs.submit(force=True, units=site_units(sites))
+        response = job.to_dict()
+        response["merged"] = merged
+        return jsonify(response), 202
+    
+    if not force and not should_parse_today() and crawl_jobs.active() is None:
+        return jsonify(parse_all_sites(force=False))
+    
+    job, merged = crawl_jobs.submit(force=force)
+    response = job.to_dict()
+    response["merged"] = merged
+    return jsonify(response), 202
+
+@app.route("/fetch/jobs", methods=["GET"])
+def list_fetch_jobs():
+    """Список последних задач парсинга"""
+    return jsonify({"jobs": [job.to_dict() for job in crawl_jobs.list()]})
+
+@app.route("/fetch/jobs/<job_id>", methods=["GET"])
+def get_fetch_job(job_id):
+    """Прогресс задачи парсинга: сайты/категории, товары, ETA"""
+    job = crawl_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Задача не найдена"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/fetch/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_fetch_job(job_id):
+    """Отменить задачу парсинга"""
+    job = crawl_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Задача не найдена"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/fetch/limits", methods=["GET"])
+def get_fetch_limits():
+    """Текущие лимиты частоты и параллельности запросов по хостам"""
+    from parser import fetcher
+    
+    return jsonify({"hosts": fetcher.limiters_snapshot()})
+
+@app.route("/refresh/schedule", methods=["GET"])
+def get_refresh_schedule():
+    """Интервалы и сроки обновления по категориям"""
+    state = refresh_planner.load()
+    due = refresh_planner.due_units(refresh_units(), get_last_parsed_date(), limit_per_host=None)
+    return jsonify({
+        "units": sorted(state.values(), key=lambda u: u.get("next_due", "")),
+        "due": [{"site": site, "category": category} for site, category in due]
+    })
 
 @app.route("/last-parsed", methods=["GET"])
 def get_last_parsed():
@@ -235,99 +784,134 @@ def get_last_parsed():
 @app.route("/stats/by-category", methods=["GET"])
 def get_stats_by_category():
     """Получить статистику отдельно для каждой категории"""
-    products = utils.load_json(DATA_FILE)
+    table = get_product_table()
     
-    if not isinstance(products, list):
+    if table is None:
         return jsonify({"categories": []})
     
-    # Группируем товары по категориям
-    categories_stats = {}
-    
-    for product in products:
-        category = product.get("category", "Без категории")
-        price = product.get("price", 0)
-        
-        if category not in categories_stats:
-            categories_stats[category] = {
-                "total_products": 0,
-                "prices": [],
-                "sites": set()
-            }
-        
-        categories_stats[category]["total_products"] += 1
-        if price and price > 0:
-            categories_stats[category]["prices"].append(price)
-        
-        site_name = product.get("site_name", "Неизвестно")
-        categories_stats[category]["sites"].add(site_name)
-    
-    # Рассчитываем статистику для каждой категории
-    result = []
-    for category, stats in categories_stats.items():
-        prices = stats["prices"]
-        
-        category_stats = {
-            "category": category,
-            "total_products": stats["total_products"],
-            "sites_count": len(stats["sites"]),
-            "sites": list(stats["sites"]),
-            "avg_price": round(sum(prices) / len(prices), 2) if prices else 0,
-            "min_price": min(prices) if prices else 0,
-            "max_price": max(prices) if prices else 0,
-            "price_range": f"{min(prices)}-{max(prices)}" if prices else "0-0"
-        }
-        
-        # Распределение по ценовым диапазонам
-        if prices:
-            ranges = {
-                "До 100": 0,
-                "100-500": 0,
-                "500-1000": 0,
-                "1000-5000": 0,
-                "Более 5000": 0
-            }
-            
-            for price in prices:
-                if price < 100:
-                    ranges["До 100"] += 1
-                elif price < 500:
-                    ranges["100-500"] += 1
-                elif price < 1000:
-                    ranges["500-1000"] += 1
-                elif price < 5000:
-                    ranges["1000-5000"] += 1
-                else:
-                    ranges["Более 5000"] += 1
-            
-            # Преобразуем в проценты
-            total = len(prices)
-            category_stats["price_distribution"] = {
-                range_name: round((count / total) * 100, 1)
-                for range_name, count in ranges.items()
-                if count > 0
-            }
-        else:
-            category_stats["price_distribution"] = {}
-        
-        result.append(category_stats)
-    
-    # Сортируем по количеству товаров (по убыванию)
-    result.sort(key=lambda x: x["total_products"], reverse=True)
+    result = analytics.category_stats(table.price_table())
     
     return jsonify({"categories": result})
 
+@app.route("/stats/quantiles", methods=["GET"])
+def get_stats_quantiles():
+    """
+    Медиана, p10/p90 и IQR цен по категориям (по сайтам и по рынку) из скетчей.
+    scope=current — последний парсинг, scope=history — вся история.
+    """
+    scope = request.args.get("scope", "current")
+    if scope not in ("current", "history"):
+        return jsonify({"error": "scope должен быть current или history"}), 400
+    
+    return jsonify({
+        "scope": scope,
+        "categories": sketch_store.summary(
+            scope=scope,
+            category=request.args.get("category"),
+            site_name=request.args.get("site")
+        )
+    })
+
 @app.route("/products", methods=["GET"])
 def get_products():
     """Получить все товары"""
-    products = utils.load_json(DATA_FILE)
+    # Версию журнала берём до данных: парсинг пишет сначала партиции, потом журнал.
+    # Тогда клиент может получить уже учтённую дельту (её повторное применение
+    # безвредно), но не пропустит изменение, которого нет в отданных товарах
+    changes_version = change_log.version()
+    table = get_product_table()
     
     # Возвращаем в формате для фронтенда
     return jsonify({
-        "products": products if isinstance(products, list) else [],
-        "count": len(products) if isinstance(products, list) else 0,
+        "products": table.to_dicts() if table is not None else [],
+        "count": len(table) if table is not None else 0,
+        # Версия журнала изменений: с неё клиент продолжает синхронизацию через /changes
+        "changes_version": changes_version,
         "last_updated": get_last_parsed_date().isoformat() if get_last_parsed_date() else None
     })
 
+@app.route("/search", methods=["GET"])
+def search_products():
+    """
+    Полнотекстовый поиск по заголовкам.
+    q — запрос (последнее слово ищется и как префикс, prefix=false — отключить),
+    category, site — фильтры, limit/offset — постраничный вывод.
+    """
+    query = request.args.get("q", "")
+    limit = request.args.get("limit", 20, type=int)
+    offset = request.args.get("offset", 0, type=int)
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        return jsonify({"error": f"limit должен быть от 1 до {SEARCH_MAX_LIMIT}"}), 400
+    if not 0 <= offset <= SEARCH_MAX_OFFSET:
+        return jsonify({"error": f"offset должен быть от 0 до {SEARCH_MAX_OFFSET}"}), 400
+    index = get_search_index()
+    if index is None:
+        return jsonify({"error": "Нет данных"}), 400
+    
+    result = index.search(
+        query,
+        category=request.args.get("category"),
+        site=request.args.get("site"),
+        limit=limit,
+        offset=offset,
+        prefix=request.args.get("prefix", "true").lower() == "true"
+    )
+    if result is None:
+        return jsonify({"error": "Пустой запрос"}), 400
+    return jsonify(result)
+
+@app.route("/changes", methods=["GET"])
+def get_changes():
+    """
+    Изменения каталога после версии since: added, removed, repriced, updated.
+    reset=true — версия слишком старая, нужно заново загрузить /products.
+    Без since возвращается только текущая версия.
+    """
+    since = request.args.get("since", type=int)
+    if since is None:
+        return jsonify({"version": change_log.version()})
+    return jsonify(change_log.since(since))
+
+@app.route("/changes/stream", methods=["GET"])
+def stream_changes():
+    """
+    Server-Sent Events: событие changes с дельтой при каждой новой версии каталога.
+    Версия берётся из since или заголовка Last-Event-ID (при переподключении).
+    Поток закрывается через CHANGES_STREAM_SECONDS, клиент переподключается сам.
+    """
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", change_log.version(), type=int)
+    
+    def events(version):
+        started = time.monotonic()
+        # Интервал переподключения для EventSource, мс
+        yield f"retry: {int(CHANGES_POLL_SECONDS * 1000)}\n\n"
+        # id без данных только запоминается EventSource: изменения, случившиеся
+        # между переподключениями, придут в следующем потоке, а не потеряются
+        yield f"id: {version}\n\n"
+        while True:
+            if change_log.version() != version:
+                delta = change_log.since(version)
+                event = "reset" if delta["reset"] else "changes"
+                yield f"id: {delta['version']}\nevent: {event}\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n"
+                if delta["reset"]:
+                    return
+                version = delta["version"]
+            else:
+                # Комментарий-пинг не даёт прокси закрыть простаивающее соединение
+                yield ": ping\n\n"
+            remaining = CHANGES_STREAM_SECONDS - (time.monotonic() - started)
+            if remaining <= 0:
+                return
+            time.sleep(min(CHANGES_POLL_SECONDS, remaining))
+    
+    return Response(
+        events(since),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/categories", methods=["GET"])
 def get_categories():
     """Получить статистику по категориям"""
@@ -337,8 +921,8 @@ def get_categories():
 @app.route("/products/by-category/<category>", methods=["GET"])
 def get_by_category(category):
     """Получить товары по категории"""
-    products = utils.load_json(DATA_FILE)
-    filtered = [p for p in products if p.get("category") == category]
+    table = get_product_table()
+    filtered = table.to_dicts(table.where("category", category)) if table is not None else []
     return jsonify({
         "category": category,
         "products": filtered,
@@ -348,8 +932,8 @@ def get_by_category(category):
 @app.route("/products/by-site/<site>", methods=["GET"])
 def get_by_site(site):
     """Получить товары по сайту"""
-    products = utils.load_json(DATA_FILE)
-    filtered = [p for p in products if p.get("site") == site]
+    table = get_product_table()
+    filtered = table.to_dicts(table.where("site", site)) if table is not None else []
     return jsonify({
         "site": site,
         "products": filtered,
@@ -358,31 +942,96 @@ def get_by_site(site):
 
 @app.route("/export", methods=["GET"])
 def export_file():
-    """Экспортировать товары в JSON"""
-    if os.path.exists(DATA_FILE):
+    """Экспортировать товары: format=json (по умолчанию), arrow (Feather v2) или parquet"""
+    export_format = request.args.get("format", "json").lower()
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
+    if export_format == "json":
+        # Каталог собирается из партиций; готовый файл кешируется на версию данных
+        def make_chunks():
+            table = get_product_table()
+            return exports.json_chunks(table.to_dicts()) if table is not None else None
+        
+        return export_artifact("products", "json", f"products_{stamp}.json", "application/json", make_chunks)
+    
+    if export_format not in ("arrow", "parquet"):
+        return jsonify({"error": "format должен быть json, arrow или parquet"}), 400
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return jsonify({"error": f"Для формата {export_format} на сервере нужен pyarrow"}), 501
+    
+    table = get_product_table()
+    if table is None or not len(table):
+        return jsonify({"error": "Файл не найден"}), 404
+    arrow = get_arrow_snapshot()
+    if arrow is None:
+        return jsonify({"error": f"Не удалось сформировать {export_format}: pyarrow на сервере не работает"}), 501
+    
+    if export_format == "arrow":
         return send_file(
-            DATA_FILE,
+            ARROW_FILE,
             as_attachment=True,
-            download_name=f"products_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            download_name=f"products_{stamp}.arrow",
+            mimetype="application/vnd.apache.arrow.file"
         )
-    return jsonify({"error": "Файл не найден"}), 404
+    
+    output = io.BytesIO()
+    try:
+        pq.write_table(arrow, output)
+    except (pa.ArrowException, OSError) as e:
+        return jsonify({"error": f"Не удалось сформировать parquet: {e}"}), 501
+    output.seek(0)
+    return send_file(
+        output,
+        as_attachment=True,
+        download_name=f"products_{stamp}.parquet",
+        mimetype="application/vnd.apache.parquet"
+    )
+
+def export_artifact(name, ext, download_name, mimetype, make_chunks):
+    """
+    Отдать выгрузку из кеша текущей версии данных, а если её нет —
+    сформировать потоком, одновременно сохраняя в кеш.
+    make_chunks() возвращает порции байтов или None, если данных нет.
+    """
+    version = data_version()
+    cached = export_cache.get(name, version, ext) if version else None
+    if cached:
+        return send_file(cached, as_attachment=True, download_name=download_name, mimetype=mimetype)
+    
+    chunks = make_chunks() if version else None
+    if chunks is None:
+        return jsonify({"error": "Нет данных для экспорта"}), 404
+    return Response(
+        export_cache.stream(name, version, ext, chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{download_name}"'}
+    )
+
+def stats_rows(categories):
+    for category in categories:
+        yield [
+            category["category"],
+            category["total_products"],
+            category["sites_count"],
+            category["avg_price"],
+            category["min_price"],
+            category["max_price"],
+            category["price_range"],
+            ", ".join(category["sites"])
+        ]
 
 @app.route("/export/stats", methods=["GET"])
 def export_stats():
     """Экспортировать статистику по категориям в CSV"""
-    try:
-        stats_data = get_stats_by_category().get_json()
-        categories = stats_data.get("categories", [])
-        
+    def make_chunks():
+        table = get_product_table()
+        categories = analytics.category_stats(table.price_table()) if table is not None else []
         if not categories:
-            return jsonify({"error": "Нет данных для экспорта"}), 404
-        
-        # Создаем CSV в памяти
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        
-        # Заголовки
-        writer.writerow([
+            return None
+        header = [
             "Категория", 
             "Товаров", 
             "Сайтов", 
@@ -391,54 +1040,38 @@ def export_stats():
             "Макс. цена (сом)", 
             "Диапазон цен (сом)",
             "Сайты"
-        ])
-        
-        # Данные
-        for category in categories:
-            writer.writerow([
-                category["category"],
-                category["total_products"],
-                category["sites_count"],
-                category["avg_price"],
-                category["min_price"],
-                category["max_price"],
-                category["price_range"],
-                ", ".join(category["sites"])
-            ])
-        
-        # Возвращаем CSV файл
-        output.seek(0)
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8-sig')),
-            as_attachment=True,
-            download_name=f"stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mimetype='text/csv'
+        ]
+        return exports.csv_chunks(header, stats_rows(categories), bom=True)
+    
+    try:
+        return export_artifact(
+            "stats", "csv",
+            f"stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            "text/csv",
+            make_chunks
         )
-        
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def jysk_comparison():
+    """Сравнение JYSK с рынком для выгрузок (без печати и сохранения comparison.json)"""
+    matrix = get_comparison_matrix()
+    return matrix.subject_view("JYSK", prefix="jysk") if matrix is not None else None
+
 @app.route("/export/comparison", methods=["GET"])
 def export_comparison():
-    """Экспортировать сравнение цен JYSK в CSV"""
-    try:
-        comparison_data = compare_jysk_prices().get_json()
-        
-        if "comparison" not in comparison_data:
-            return jsonify({"error": "Нет данных для экспорта"}), 404
-        
-        categories = comparison_data.get("comparison", [])
-        summary = comparison_data.get("summary", {})
-        
+    """Экспортировать сравнение цен JYSK в CSV (ZIP с двумя файлами)"""
+    def make_chunks():
+        comparison_data = jysk_comparison()
+        categories = comparison_data.get("comparison", []) if comparison_data else []
         if not categories:
-            return jsonify({"error": "Нет данных для экспорта"}), 404
-        
-        # Создаем CSV в памяти
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            return None
+        summary = comparison_data.get("summary", {})
+        # Архив кешируется на версию данных, поэтому в нём дата данных, а не запроса
+        updated_at = data_updated_at()
+        stamp = updated_at.strftime('%Y%m%d_%H%M%S')
         
-        # Заголовки основного файла
-        writer.writerow([
+        header = [
             "Категория",
             "Статус",
             "Разница (%)",
@@ -452,11 +1085,9 @@ def export_comparison():
             "Рынок (макс, сом)",
             "Товаров рынка",
             "Всего сайтов"
-        ])
-        
-        # Данные
-        for category in categories:
-            writer.writerow([
+        ]
+        rows = (
+            [
                 category["category"],
                 category["comparison"]["status"],
                 f"{category['comparison']['price_diff_percent']}%",
@@ -470,361 +1101,280 @@ def export_comparison():
                 category["market_stats"]["max_price"],
                 category["market_stats"]["count"],
                 category["samples"]["total_sites"]
-            ])
-        
-        # Создаем второй CSV с сводкой
-        summary_output = io.StringIO()
-        summary_writer = csv.writer(summary_output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        
-        summary_writer.writerow(["Параметр", "Значение"])
-        summary_writer.writerow(["Всего категорий", summary["total_categories"]])
-        summary_writer.writerow(["JYSK дешевле", summary["categories_where_cheaper"]])
-        summary_writer.writerow(["JYSK дороже", summary["categories_where_expensive"]])
-        summary_writer.writerow(["На уровне рынка", summary["categories_where_normal"]])
-        summary_writer.writerow(["Средняя разница", f"{summary['avg_price_diff']}%"])
-        summary_writer.writerow(["Преимущество JYSK", "Да" if summary["jysk_advantage"] else "Нет"])
-        summary_writer.writerow(["Дата экспорта", datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
-        
-        # Возвращаем ZIP архив с двумя файлами
-        from zipfile import ZipFile
-        import tempfile
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp:
-            with ZipFile(tmp.name, 'w') as zipf:
-                # Добавляем основной файл сравнения
-                output.seek(0)
-                zipf.writestr(f"jysk_comparison_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", output.getvalue())
-                
-                # Добавляем файл сводки
-                summary_output.seek(0)
-                zipf.writestr(f"jysk_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", summary_output.getvalue())
-            
-            # Читаем ZIP файл
-            with open(tmp.name, 'rb') as f:
-                zip_data = f.read()
-        
-        # Удаляем временный файл
-        os.unlink(tmp.name)
-        
-        # Возвращаем ZIP архив
-        return send_file(
-            io.BytesIO(zip_data),
-            as_attachment=True,
-            download_name=f"jysk_comparison_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-            mimetype='application/zip'
+            ]
+            for category in categories
+        )
+        summary_rows = [
+            ["Всего категорий", summary["total_categories"]],
+            ["JYSK дешевле", summary["categories_where_cheaper"]],
+            ["JYSK дороже", summary["categories_where_expensive"]],
+            ["На уровне рынка", summary["categories_where_normal"]],
+            ["Средняя разница", f"{summary['avg_price_diff']}%"],
+            ["Преимущество JYSK", "Да" if summary["jysk_advantage"] else "Нет"],
+            ["Данные обновлены", updated_at.strftime("%Y-%m-%d %H:%M:%S")]
+        ]
+        return exports.zip_chunks([
+            (f"jysk_comparison_{stamp}.csv", exports.csv_chunks(header, rows)),
+            (f"jysk_summary_{stamp}.csv", exports.csv_chunks(["Параметр", "Значение"], summary_rows))
+        ])
+    
+    try:
+        return export_artifact(
+            "comparison", "zip",
+            f"jysk_comparison_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            "application/zip",
+            make_chunks
         )
-        
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def full_report_sheets(table, categories, comparison_data):
+    """Листы полного отчёта: (название, заголовок, строки)"""
+    columns = [[None if v is MISSING else v for v in table.column(field)] for field in PRODUCT_FIELDS]
+    sheets = [("Товары", list(PRODUCT_FIELDS), zip(*columns))]
+    
+    if categories:
+        header = list(categories[0].keys())
+        rows = []
+        for category in categories:
+            row = dict(category)
+            row["sites"] = ", ".join(category["sites"])
+            row["price_distribution"] = ", ".join(f"{k}: {v}%" for k, v in category["price_distribution"].items())
+            rows.append([row[key] for key in header])
+        sheets.append(("Статистика", header, rows))
+    
+    comparison_categories = comparison_data.get("comparison", [])
+    if comparison_categories:
+        max_sites = max(len(cat.get("site_comparison", [])) for cat in comparison_categories)
+        header = [
+            "Категория", "Статус", "Разница (%)", "Разница (сом)",
+            "JYSK_средняя", "JYSK_мин", "JYSK_макс", "JYSK_количество",
+            "Рынок_средняя", "Рынок_мин", "Рынок_макс", "Рынок_количество"
+        ]
+        # Сравнение по сайтам
+        for i in range(1, max_sites + 1):
+            header += [f"Сайт_{i}", f"Сайт_{i}_цена", f"Сайт_{i}_разница"]
+        rows = []
+        for cat in comparison_categories:
+            row = [
+                cat["category"],
+                cat["comparison"]["status"],
+                cat["comparison"]["price_diff_percent"],
+                cat["comparison"]["price_diff"],
+                cat["jysk_stats"]["avg_price"],
+                cat["jysk_stats"]["min_price"],
+                cat["jysk_stats"]["max_price"],
+                cat["jysk_stats"]["count"],
+                cat["market_stats"]["avg_price"],
+                cat["market_stats"]["min_price"],
+                cat["market_stats"]["max_price"],
+                cat["market_stats"]["count"]
+            ]
+            for site in cat.get("site_comparison", []):
+                row += [site["site"], site["avg_price"], f"{site['diff_percent']}%"]
+            rows.append(row)
+        sheets.append(("Сравнение_JYSK", header, rows))
+    
+    summary_data = comparison_data.get("summary", {})
+    summary = {
+        "Всего категорий": summary_data.get("total_categories", 0),
+        "JYSK дешевле": summary_data.get("categories_where_cheaper", 0),
+        "JYSK дороже": summary_data.get("categories_where_expensive", 0),
+        "На уровне рынка": summary_data.get("categories_where_normal", 0),
+        "Средняя разница (%)": summary_data.get("avg_price_diff", 0),
+        "Преимущество JYSK": "Да" if summary_data.get("jysk_advantage", False) else "Нет",
+        "Данные обновлены": data_updated_at().strftime("%Y-%m-%d %H:%M:%S"),
+        "Последний парсинг": get_last_parsed_date().isoformat() if get_last_parsed_date() else "Нет данных"
+    }
+    sheets.append(("Сводка", list(summary), [list(summary.values())]))
+    return sheets
+
 @app.route("/export/full-report", methods=["GET"])
 def export_full_report():
     """Экспортировать полный отчет в Excel"""
+    mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    download_name = f"full_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     try:
-        import pandas as pd
-        from io import BytesIO
-        
-        # Получаем данные
-        products = utils.load_json(DATA_FILE)
-        stats_data = get_stats_by_category().get_json()
-        comparison_data = compare_jysk_prices().get_json()
-        
-        if not isinstance(products, list) or not products:
-            return jsonify({"error": "Нет данных для экспорта"}), 404
-        
-        # Создаем Excel writer
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # 1. Лист с товарами
-            products_df = pd.DataFrame(products)
-            if not products_df.empty:
-                products_df.to_excel(writer, sheet_name='Товары', index=False)
-            
-            # 2. Лист со статистикой по категориям
-            categories = stats_data.get("categories", [])
-            if categories:
-                stats_df = pd.DataFrame(categories)
-                stats_df.to_excel(writer, sheet_name='Статистика', index=False)
-            
-            # 3. Лист со сравнением JYSK
-            comparison_categories = comparison_data.get("comparison", [])
-            if comparison_categories:
-                comparison_rows = []
-                for cat in comparison_categories:
-                    row = {
-                        "Категория": cat["category"],
-                        "Статус": cat["comparison"]["status"],
-                        "Разница (%)": cat["comparison"]["price_diff_percent"],
-                        "Разница (сом)": cat["comparison"]["price_diff"],
-                        "JYSK_средняя": cat["jysk_stats"]["avg_price"],
-                        "JYSK_мин": cat["jysk_stats"]["min_price"],
-                        "JYSK_макс": cat["jysk_stats"]["max_price"],
-                        "JYSK_количество": cat["jysk_stats"]["count"],
-                        "Рынок_средняя": cat["market_stats"]["avg_price"],
-                        "Рынок_мин": cat["market_stats"]["min_price"],
-                        "Рынок_макс": cat["market_stats"]["max_price"],
-                        "Рынок_количество": cat["market_stats"]["count"]
-                    }
-                    # Добавляем сравнение по сайтам
-                    for i, site in enumerate(cat.get("site_comparison", []), 1):
-                        row[f"Сайт_{i}"] = site["site"]
-                        row[f"Сайт_{i}_цена"] = site["avg_price"]
-                        row[f"Сайт_{i}_разница"] = f"{site['diff_percent']}%"
-                    comparison_rows.append(row)
-                
-                comparison_df = pd.DataFrame(comparison_rows)
-                comparison_df.to_excel(writer, sheet_name='Сравнение_JYSK', index=False)
+        version = data_version()
+        path = export_cache.get("full_report", version, "xlsx") if version else None
+        if path is None:
+            table = get_product_table()
+            if table is None or not len(table):
+                return jsonify({"error": "Нет данных для экспорта"}), 404
             
-            # 4. Лист с сводкой
-            summary_data = comparison_data.get("summary", {})
-            summary_df = pd.DataFrame([{
-                "Всего категорий": summary_data.get("total_categories", 0),
-                "JYSK дешевле": summary_data.get("categories_where_cheaper", 0),
-                "JYSK дороже": summary_data.get("categories_where_expensive", 0),
-                "На уровне рынка": summary_data.get("categories_where_normal", 0),
-                "Средняя разница (%)": summary_data.get("avg_price_diff", 0),
-                "Преимущество JYSK": "Да" if summary_data.get("jysk_advantage", False) else "Нет",
-                "Дата отчета": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "Последний парсинг": get_last_parsed_date().isoformat() if get_last_parsed_date() else "Нет данных"
-            }])
-            summary_df.to_excel(writer, sheet_name='Сводка', index=False)
+            sheets = full_report_sheets(
+                table,
+                analytics.category_stats(table.price_table()),
+                jysk_comparison() or {}
+            )
+            path = export_cache.build("full_report", version, "xlsx", lambda f: exports.write_xlsx(f, sheets))
         
-        output.seek(0)
+        return send_file(path, as_attachment=True, download_name=download_name, mimetype=mimetype)
         
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"full_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        
-    except ImportError:
-        return jsonify({"error": "Для экспорта в Excel требуется библиотека pandas. Установите: pip install pandas openpyxl"}), 500
+    except ImportError as e:
+        return jsonify({"error": f"Для Excel-отчёта на сервере нужен openpyxl: {e}"}), 501
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/import", methods=["POST"])
 def import_file():
-    """Импортировать товары из JSON"""
+    """
+    Импортировать товары из JSON-массива или NDJSON (потоково, с проверкой каждой записи).
+    mode=upsert (по умолчанию) — добавить новые и обновить существующие товары по link;
+    mode=replace — заменить каталог, только если все записи корректны.
+    """
     file = request.files.get("file")
     if not file:
         return jsonify({"error": "Файл не найден"}), 400
+    mode = request.args.get("mode", "upsert")
+    if mode not in ("upsert", "replace"):
+        return jsonify({"error": "mode должен быть upsert или replace"}), 400
     
-    try:
-        data = json.load(file)
-        utils.save_json(data, DATA_FILE)
+    # Под той же блокировкой, что и парсинг: иначе парсинг перезапишет импорт
+    with utils.file_lock(CRAWL_LOCK_FILE) as acquired:
+        if not acquired:
+            return jsonify({"error": "Идёт парсинг, повторите импорт позже"}), 409
+        
+        ensure_partitions()
+        existing = partition_store.products()
+        try:
+            products, report = importer.run_import(
+                io.TextIOWrapper(file.stream, encoding="utf-8-sig"),
+                existing if mode == "upsert" else [],
+                replace=mode == "replace"
+            )
+        except (importer.ImportFormatError, UnicodeDecodeError) as e:
+            return jsonify({"error": f"Не удалось разобрать файл: {e}"}), 400
+        
+        if products is None:
+            # Применять нечего: всё совпало с каталогом или записи с ошибками
+            report["status"] = "rejected" if report["errors_count"] else "unchanged"
+            return jsonify(report), 422 if report["errors_count"] else 200
+        
+        # Индексы и агрегаты обновляем один раз на весь импорт
+        save_products(products, previous=existing, source="import")
+        save_categories()
+        sketch_store.rebuild_current(products)
         
         # Обновляем дату парсинга на текущую
         save_last_parsed_date()
-        
-        return jsonify({"status": "imported", "count": len(data)})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
+    
+    report["status"] = "imported"
+    report["count"] = len(products)
+    return jsonify(report)
 
 @app.route("/stats", methods=["GET"])
 def get_stats():
     """Получить общую статистику"""
-    products = utils.load_json(DATA_FILE)
+    table = get_product_table()
     categories = utils.load_json(CATEGORIES_FILE)
     
-    if not isinstance(products, list):
-        products = []
-    
-    prices = [p.get("price", 0) for p in products if isinstance(p.get("price"), (int, float))]
+    prices = table.priced() if table is not None else []
     
     stats = {
-        "total_products": len(products),
+        "total_products": len(table) if table is not None else 0,
         "total_categories": len(categories.get("categories", {})) if isinstance(categories, dict) else 0,
         "total_sites": len(SITES),
-        "avg_price": sum(prices) / len(prices) if prices else 0,
-        "min_price": min(prices) if prices else 0,
-        "max_price": max(prices) if prices else 0,
+        "avg_price": float(prices.sum()) / len(prices) if len(prices) else 0,
+        "min_price": prices.min().item() if len(prices) else 0,
+        "max_price": prices.max().item() if len(prices) else 0,
         "last_parsed": get_last_parsed_date().isoformat() if get_last_parsed_date() else None,
         "should_parse_today": should_parse_today()
     }
     
     return jsonify(stats)
 
+@app.route("/compare", methods=["GET"])
+def compare_prices():
+    """
+    Сравнить СРЕДНИЕ цены сайта subject с СРЕДНИМИ ценами других магазинов.
+    matrix=true — добавить попарное сравнение всех сайтов по категориям.
+    """
+    subject = request.args.get("subject", "JYSK")
+    matrix = get_comparison_matrix()
+    
+    if matrix is None:
+        return jsonify({"error": "Нет данных"}), 400
+    if matrix.site_code(subject) is None:
+        return jsonify({"error": f"Сайт не найден: {subject}", "sites": matrix.sites}), 404
+    
+    result = matrix.subject_view(subject)
+    result["subject"] = matrix.sites[matrix.site_code(subject)]
+    if request.args.get("matrix", "false").lower() == "true":
+        result["matrix"] = matrix.pairs()
+    return jsonify(result)
+
 @app.route("/compare/jysk", methods=["GET"])
 def compare_jysk_prices():
     """Сравнить СРЕДНИЕ цены JYSK с СРЕДНИМИ ценами других магазинов"""
-    products = utils.load_json(DATA_FILE)
+    matrix = get_comparison_matrix()
     
-    if not isinstance(products, list):
+    if matrix is None:
         return jsonify({"error": "Нет данных"}), 400
     
-    # Группируем товары по категориям
-    categories_comparison = {}
-    
-    for product in products:
-        category = product.get("category", "Без категории")
-        site_name = product.get("site_name", "")
-        price = product.get("price", 0)
-        
-        # Пропускаем товары без цены
-        if not price or price <= 0:
-            continue
-        
-        if category not in categories_comparison:
-            categories_comparison[category] = {
-                "jysk": {"prices": []},
-                "other_sites": {}
-            }
-        
-        # Разделяем по сайтам
-        if site_name.lower() == "jysk":
-            categories_comparison[category]["jysk"]["prices"].append(price)
-        else:
-            if site_name not in categories_comparison[category]["other_sites"]:
-                categories_comparison[category]["other_sites"][site_name] = []
-            categories_comparison[category]["other_sites"][site_name].append(price)
-    
-    # Рассчитываем статистику и сравнение
-    result = []
-    
-    for category, data in categories_comparison.items():
-        jysk_prices = data["jysk"]["prices"]
-        
-        # Собираем ВСЕ цены с других сайтов
-        other_prices = []
-        for site_prices in data["other_sites"].values():
-            other_prices.extend(site_prices)
-        
-        # Пропускаем категории с недостаточным количеством данных
-        if len(jysk_prices) < 3 or len(other_prices) < 3:
-            continue
-        
-        # ===== ВАЖНО: СЧИТАЕМ СРЕДНИЕ ЦЕНЫ =====
-        jysk_avg = sum(jysk_prices) / len(jysk_prices)
-        other_avg = sum(other_prices) / len(other_prices)
-        
-        print(f"\n[{category}]")
-        print(f"  JYSK: {len(jysk_prices)} товаров, средняя цена = {jysk_avg:.2f}")
-        print(f"  Рынок: {len(other_prices)} товаров, средняя цена = {other_avg:.2f}")
-        
-        # Определяем разницу в процентах (на основе СРЕДНИХ цен)
-        if other_avg > 0:
-            price_diff_percent = ((jysk_avg - other_avg) / other_avg) * 100
-        else:
-            price_diff_percent = 0
-        
-        print(f"  Разница: {price_diff_percent:.1f}%")
-        
-        # Определяем статус
-        if price_diff_percent > 15:
-            status = "значительно дороже"
-            status_class = "expensive"
-        elif price_diff_percent > 5:
-            status = "дороже"
-            status_class = "expensive-moderate"
-        elif price_diff_percent < -15:
-            status = "значительно дешевле"
-            status_class = "cheaper"
-        elif price_diff_percent < -5:
-            status = "дешевле"
-            status_class = "cheaper-moderate"
-        else:
-            status = "на уровне рынка"
-            status_class = "normal"
-        
-        # Сравнение с каждым сайтом отдельно (тоже по средним)
-        site_comparison = []
-        for site_name, prices in data["other_sites"].items():
-            if prices and len(prices) >= 3:
-                site_avg = sum(prices) / len(prices)  # СРЕДНЯЯ цена по сайту
-                if site_avg > 0:
-                    diff = ((jysk_avg - site_avg) / site_avg) * 100
-                else:
-                    diff = 0
-                
-                site_comparison.append({
-                    "site": site_name,
-                    "avg_price": round(site_avg, 2),
-                    "product_count": len(prices),
-                    "diff_percent": round(diff, 1),
-                    "status": "дороже" if diff > 0 else "дешевле"
-                })
-        
-        # Сортируем сайты по разнице
-        site_comparison.sort(key=lambda x: x["diff_percent"])
-        
-        result.append({
-            "category": category,
-            "jysk_stats": {
-                "avg_price": round(jysk_avg, 2),
-                "min_price": min(jysk_prices),
-                "max_price": max(jysk_prices),
-                "count": len(jysk_prices)
-            },
-            "market_stats": {
-                "avg_price": round(other_avg, 2),
-                "min_price": min(other_prices),
-                "max_price": max(other_prices),
-                "count": len(other_prices)
-            },
-            "comparison": {
-                "price_diff": round(jysk_avg - other_avg, 2),
-                "price_diff_percent": round(price_diff_percent, 1),
-                "status": status,
-                "status_class": status_class
-            },
-            "site_comparison": site_comparison,
-            "samples": {
-                "jysk_count": len(jysk_prices),
-                "market_count": len(other_prices),
-                "total_sites": len(data["other_sites"]) + 1
-            }
-        })
-    
-    # Сортируем по абсолютной разнице в процентах
-    result.sort(key=lambda x: abs(x["comparison"]["price_diff_percent"]), reverse=True)
-    
-    # Рассчитываем сводную статистику
-    total_categories = len(result)
-    if total_categories > 0:
-        categories_where_cheaper = len([r for r in result if r["comparison"]["price_diff_percent"] < -5])
-        categories_where_expensive = len([r for r in result if r["comparison"]["price_diff_percent"] > 5])
-        
-        # Средняя разница по всем категориям
-        avg_price_diff = round(
-            sum([r["comparison"]["price_diff_percent"] for r in result]) / total_categories, 
-            1
-        )
-    else:
-        categories_where_cheaper = 0
-        categories_where_expensive = 0
-        avg_price_diff = 0
+    comparison_result = matrix.subject_view("JYSK", prefix="jysk")
+    summary = comparison_result["summary"]
     
     print(f"\n=== ИТОГОВАЯ СТАТИСТИКА ===")
-    print(f"Всего категорий: {total_categories}")
-    print(f"JYSK дешевле: {categories_where_cheaper}")
-    print(f"JYSK дороже: {categories_where_expensive}")
-    print(f"Средняя разница: {avg_price_diff}%")
-    
-    comparison_result = {
-        "comparison": result,
-        "summary": {
-            "total_categories": total_categories,
-            "categories_where_cheaper": categories_where_cheaper,
-            "categories_where_expensive": categories_where_expensive,
-            "categories_where_normal": total_categories - categories_where_cheaper - categories_where_expensive,
-            "avg_price_diff": avg_price_diff,
-            "jysk_advantage": avg_price_diff < 0
-        }
-    }
+    print(f"Всего категорий: {summary['total_categories']}")
+    print(f"JYSK дешевле: {summary['categories_where_cheaper']}")
+    print(f"JYSK дороже: {summary['categories_where_expensive']}")
+    print(f"Средняя разница: {summary['avg_price_diff']}%")
     
     # Сохраняем данные сравнения
     save_comparison_data(comparison_result)
     
     return jsonify(comparison_result)
 
+@app.route("/matches", methods=["GET"])
+def get_matches():
+    """
+    Одинаковые товары на разных сайтах.
+    Фильтры: category, site, min_sites (по умолчанию 2), limit.
+    """
+    matcher = get_product_matcher()
+    if matcher is None:
+        return jsonify({"error": "Нет данных"}), 400
+    
+    category = request.args.get("category")
+    site = request.args.get("site")
+    min_sites = request.args.get("min_sites", 2, type=int)
+    limit = request.args.get("limit", 100, type=int)
+    
+    groups = []
+    for group in matcher.groups():
+        if len(group["sites"]) < min_sites:
+            continue
+        if site and site not in group["sites"]:
+            continue
+        if category and not any(p["category"] == category for p in group["products"]):
+            continue
+        groups.append(group)
+    
+    return jsonify({"total": len(groups), "groups": groups[:limit]})
+
+@app.route("/matches/product", methods=["GET"])
+def get_product_matches():
+    """Совпадения конкретного товара (по ссылке) на других сайтах"""
+    link = request.args.get("link")
+    if not link:
+        return jsonify({"error": "Не указан link"}), 400
+    matcher = get_product_matcher()
+    if matcher is None:
+        return jsonify({"error": "Нет данных"}), 400
+    
+    matches = matcher.matches(link)
+    if matches is None:
+        return jsonify({"error": "Товар не найден"}), 404
+    return jsonify({"link": link, "matches": matches})
+
 @app.route("/health", methods=["GET"])
 def health():
     """Проверка здоровья сервиса"""
     return jsonify({
         "status": "ok", 
         "timestamp": datetime.now().isoformat(),
-        "data_exists": os.path.exists(DATA_FILE),
+        "data_exists": data_version() is not None,
         "should_parse_today": should_parse_today(),
         "last_parsed": get_last_parsed_date().isoformat() if get_last_parsed_date() else None
     })
@@ -832,15 +1382,11 @@ def health():
 if __name__ == "__main__":
     print("Инициализация парсера...")
     
-    # Проверяем, нужно ли выполнить первый парсинг
-    if not os.path.exists(DATA_FILE) or should_parse_today():
-        try:
-            print("Выполнение первого парсинга...")
-            parse_all_sites()
-            print("Первый парсинг завершён")
-        except Exception as e:
-            print(f"Ошибка при первом парсинге: {e}")
-    else:
+    # Первый парсинг ставим в фон — API начинает отвечать сразу
+    if CRAWLER_ENABLED and (data_version() is None or should_parse_today()):
+        job, _ = crawl_jobs.submit(force=False)
+        print(f"Первый парсинг запущен в фоне, задача {job.id}")
+    elif CRAWLER_ENABLED:
         print("Данные уже существуют и сегодня парсинг уже выполнялся. Пропускаем начальный парсинг.")
         print(f"Последний парсинг: {get_last_parsed_date()}")
     
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+from parser import utils
+
+# Сколько последних наборов изменений хранить; более старые клиенты получают reset
+MAX_CHANGESETS = 90
+
+
+def product_key(product):
+    link = product.get("link") if isinstance(product, dict) else None
+    return link or None
+
+
+def diff(old_products, new_products):
+    """
+    Разница двух каталогов по ссылке товара:
+      added    — новые товары целиком;
+      removed  — ссылки пропавших товаров;
+      repriced — {"link", "old_price", "price"} для изменившихся цен;
+      updated  — товары целиком, если изменилось что-то кроме цены.
+    Товары без ссылки не отслеживаются.
+    """
+    old = {}
+    for product in old_products:
+        key = product_key(product)
+        if key:
+            old[key] = product
+    new = {}
+    for product in new_products:
+        key = product_key(product)
+        if key:
+            new[key] = product
+
+    added, repriced, updated = [], [], []
+    for link, product in new.items():
+        before = old.get(link)
+        if before is None:
+            added.append(product)
+            continue
+        if before.get("price") != product.get("price"):
+            repriced.append({"link": link, "old_price": before.get("price"), "price": product.get("price")})
+        if {k: v for k, v in before.items() if k != "price"} != {k: v for k, v in product.items() if k != "price"}:
+            updated.append(product)
+    removed = [link for link in old if link not in new]
+    return {"added": added, "removed": removed, "repriced": repriced, "updated": updated}
+
+
+def merge(changesets):
+    """
+    Свести последовательность наборов изменений в одну дельту:
+    товар, добавленный и удалённый в промежутке, в ответ не попадает,
+    несколько переоценок сворачиваются в одну (первая старая цена -> последняя).
+    """
+    # link -> состояние до первого и после последнего набора
+    states = {}
+    for changeset in changesets:
+        for product in changeset["added"]:
+            state = states.setdefault(product["link"], {"existed": False})
+            state["product"] = product
+            state["removed"] = False
+            # Удалённый и вернувшийся товар клиент получает целиком
+            state["updated"] = state["existed"]
+        for link in changeset["removed"]:
+            state = states.setdefault(link, {"existed": True})
+            state["removed"] = True
+            for field in ("product", "price", "old_price"):
+                state.pop(field, None)
+        for change in changeset["repriced"]:
+            state = states.setdefault(change["link"], {"existed": True, "old_price": change["old_price"]})
+            state["price"] = change["price"]
+            if "product" in state:
+                state["product"] = dict(state["product"], price=change["price"])
+        for product in changeset["updated"]:
+            state = states.setdefault(product["link"], {"existed": True})
+            state["product"] = product
+            state["updated"] = True
+
+    result = {"added": [], "removed": [], "repriced": [], "updated": []}
+    for link, state in states.items():
+        if state.get("removed"):
+            if state["existed"]:
+                result["removed"].append(link)
+            continue
+        if not state["existed"]:
+            result["added"].append(state["product"])
+            continue
+        if "old_price" in state and state["price"] != state["old_price"]:
+            result["repriced"].append({"link": link, "old_price": state["old_price"], "price": state["price"]})
+        if state.get("updated"):
+            result["updated"].append(state["product"])
+    return result
+
+
+class ChangeLog:
+    """
+    Журнал наборов изменений каталога (NDJSON), версия — порядковый номер набора.
+    Запись идёт под блокировкой парсинга (её держат и парсинг, и импорт),
+    поэтому номера версий не повторяются между процессами.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._cache = {"stamp": None, "changesets": []}
+        self._lock = threading.Lock()
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def changesets(self):
+        """Все сохранённые наборы; файл перечитывается только после изменения"""
+        stamp = self._stamp()
+        with self._lock:
+            if stamp != self._cache["stamp"]:
+                changesets = []
+                if stamp is not None:
+                    with open(self.filename, "r", encoding="utf-8") as f:
+                        for line in f:
+                            try:
+                                changesets.append(json.loads(line))
+                            except ValueError:
+                                # Недописанная строка после падения процесса
+                                break
+                self._cache = {"stamp": stamp, "changesets": changesets}
+            return self._cache["changesets"]
+
+    def version(self):
+        changesets = self.changesets()
+        return changesets[-1]["version"] if changesets else 0
+
+    def record(self, old_products, new_products, source):
+        """Сохранить набор изменений между каталогами; None, если изменений нет"""
+        changes = diff(old_products, new_products)
+        if not any(changes.values()):
+            return None
+        changesets = self.changesets()
+        changeset = {
+            "version": self.version() + 1,
+            "created": datetime.now().isoformat(),
+            "source": source
+        }
+        changeset.update(changes)
+
+        if len(changesets) >= MAX_CHANGESETS:
+            # Переписываем журнал, оставляя последние MAX_CHANGESETS наборов
+            kept = changesets[-(MAX_CHANGESETS - 1):] + [changeset]
+            with utils.atomic_write(self.filename) as f:
+                for item in kept:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        else:
+            os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+            with open(self.filename, "a", encoding="utf-8") as f:
+                f.write(json.dumps(changeset, ensure_ascii=False) + "\n")
+        print(f"[{datetime.now()}] Изменения каталога v{changeset['version']} ({source}): "
+              f"+{len(changes['added'])} -{len(changes['removed'])} "
+              f"цены {len(changes['repriced'])}, прочее {len(changes['updated'])}")
+        return changeset
+
+    def since(self, version):
+        """
+        Дельта после версии version.
+        reset=True — журнал уже не покрывает эту версию, нужна полная загрузка /products.
+        """
+        changesets = self.changesets()
+        current = changesets[-1]["version"] if changesets else 0
+        newer = [c for c in changesets if c["version"] > version]
+        oldest = changesets[0]["version"] if changesets else current + 1
+        if version > current or (version < oldest - 1 and version < current):
+            return {"version": current, "since": version, "reset": True}
+        result = {"version": current, "since": version, "reset": False, "changesets": len(newer)}
+        result.update(merge(newer))
+        return result
@@ -0,0 +1,176 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+
+from parser import utils
+
+# Размер порции, которой отдаём выгрузку клиенту
+CHUNK_SIZE = 64 * 1024
+
+
+class _Sink:
+    """Приёмник байтов для ZipFile без seek: накопленное забираем через drain()"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+def cell(value):
+    """Значение для CSV/XLSX: вложенные структуры — JSON-строкой"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def csv_chunks(header, rows, bom=False):
+    """CSV построчно, порциями по CHUNK_SIZE байт"""
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(header)
+    first = True
+    for row in rows:
+        writer.writerow(row)
+        if output.tell() >= CHUNK_SIZE:
+            yield output.getvalue().encode("utf-8-sig" if bom and first else "utf-8")
+            output.seek(0)
+            output.truncate()
+            first = False
+    if output.tell() or first:
+        yield output.getvalue().encode("utf-8-sig" if bom and first else "utf-8")
+
+
+def json_chunks(items):
+    """JSON-массив по элементу, порциями по CHUNK_SIZE байт"""
+    output = io.StringIO()
+    output.write("[")
+    for i, item in enumerate(items):
+        output.write(("\n" if i == 0 else ",\n") + json.dumps(item, ensure_ascii=False))
+        if output.tell() >= CHUNK_SIZE:
+            yield output.getvalue().encode("utf-8")
+            output.seek(0)
+            output.truncate()
+    output.write("\n]\n")
+    yield output.getvalue().encode("utf-8")
+
+
+def zip_chunks(entries):
+    """
+    ZIP-архив потоком: entries — [(имя файла, порции байтов)].
+    Файлы сжимаются и отдаются по мере записи, архив целиком в памяти не собирается.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, chunks in entries:
+            with archive.open(name, "w") as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    if sink.size >= CHUNK_SIZE:
+                        yield sink.drain()
+    yield sink.drain()
+
+
+def write_xlsx(f, sheets):
+    """
+    Книга Excel в режиме write-only (строки пишутся сразу, без модели листа в памяти).
+    sheets — [(название, заголовок, строки)].
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for title, header, rows in sheets:
+        sheet = workbook.create_sheet(title)
+        sheet.append(header)
+        for row in rows:
+            sheet.append([cell(value) for value in row])
+    workbook.save(f)
+
+
+def version_order(version):
+    """
+    Порядок версий данных: обе схемы версий (ревизия манифеста и штамп файла)
+    начинаются с шестнадцатеричного времени в наносекундах. None — не разобрать.
+    """
+    try:
+        return int(version.split("-", 1)[0], 16)
+    except (AttributeError, ValueError):
+        return None
+
+
+class ArtifactCache:
+    """
+    Готовые выгрузки на диске, по одной на (отчёт, версия данных).
+    При записи новой версии файлы отчёта более старых версий удаляются.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, name, version, ext):
+        return os.path.join(self.directory, f"{name}-{version}.{ext}")
+
+    def get(self, name, version, ext):
+        path = self.path(name, version, ext)
+        return path if os.path.exists(path) else None
+
+    def stream(self, name, version, ext, chunks):
+        """Отдавать порции клиенту и параллельно сохранять их в кеш"""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-", suffix=f".{ext}")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            path = self.path(name, version, ext)
+            os.replace(tmp_path, path)
+            self._prune(name, version, ext)
+        except BaseException:
+            # Клиент отключился или отчёт упал — недописанный файл в кеш не попадает
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def build(self, name, version, ext, write):
+        """Собрать файл функцией write(f) (для форматов, которые нельзя отдавать потоком)"""
+        path = self.path(name, version, ext)
+        with utils.atomic_write(path, "wb") as f:
+            write(f)
+        self._prune(name, version, ext)
+        return path
+
+    def _prune(self, name, version, ext):
+        """
+        Удалить файлы отчёта более старых версий, чем version. Запрос по старой
+        версии может дописать файл позже запроса по новой — тогда новый не трогаем.
+        """
+        current = version_order(version)
+        if current is None:
+            return
+        prefix, suffix = f"{name}-", f".{ext}"
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith(prefix) and filename.endswith(suffix)):
+                continue
+            other = version_order(filename[len(prefix):-len(suffix)])
+            if other is not None and other < current:
+                try:
+                    os.unlink(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
@@ -0,0 +1,284 @@
+import json
+from urllib.parse import urlsplit
+
+from parser.utils import normalize_price
+
+# Сколько записей применяем к каталогу за один шаг
+BATCH_SIZE = 1000
+# Сколько ошибок по записям возвращаем в ответе (считаются все)
+MAX_REPORTED_ERRORS = 100
+# Размер порции чтения файла, символов
+READ_SIZE = 64 * 1024
+# Предельный размер одного элемента JSON-массива
+MAX_ELEMENT_SIZE = 16 * 1024 * 1024
+# Оборванный на границе порции элемент даёт ошибку не дальше этого числа символов от конца буфера
+TRUNCATION_MARGIN = 32
+
+# Схема товара: поле -> обязательно ли оно
+SCHEMA = {
+    "title": True,
+    "price": True,
+    "link": True,
+    "image": False,
+    "category_url": False,
+    "site": False,
+    "category": False,
+    "site_name": False
+}
+
+
+class ImportFormatError(Exception):
+    """Файл не удаётся разобрать как JSON-массив или NDJSON"""
+
+
+def iter_json_array(stream):
+    """
+    Элементы JSON-массива по одному, без загрузки файла целиком.
+    Выдаёт (номер, значение); битый JSON внутри массива прерывает импорт.
+    """
+    decoder = json.JSONDecoder()
+    buffer = stream.read(READ_SIZE).lstrip()
+    if not buffer.startswith("["):
+        raise ImportFormatError("ожидался JSON-массив")
+    pos = 1
+    index = 0
+    eof = False
+    expect_value = True
+    while True:
+        # Пропускаем пробелы и запятые между элементами
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            chunk = stream.read(READ_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+        if pos >= len(buffer):
+            raise ImportFormatError("массив не закрыт")
+        if buffer[pos] == "]":
+            if expect_value and index:
+                raise ImportFormatError(f"лишняя запятая после элемента {index - 1}")
+            return
+        if buffer[pos] == ",":
+            if expect_value:
+                raise ImportFormatError(f"лишняя запятая перед элементом {index}")
+            pos += 1
+            expect_value = True
+            continue
+        if not expect_value:
+            raise ImportFormatError(f"ожидалась запятая после элемента {index - 1}")
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # Ошибка вдали от конца буфера — элемент битый, а не оборван: дальше не читаем
+                truncated = e.msg.startswith("Unterminated string") or len(buffer) - e.pos <= TRUNCATION_MARGIN
+                if eof or not truncated:
+                    raise ImportFormatError(f"элемент {index}: {e.msg}") from e
+                if len(buffer) - pos > MAX_ELEMENT_SIZE:
+                    raise ImportFormatError(f"элемент {index} больше {MAX_ELEMENT_SIZE // (1024 * 1024)} МБ")
+                # Элемент не поместился в буфер — дочитываем, удваивая буфер (разбор заново линеен в сумме)
+                chunk = stream.read(max(READ_SIZE, len(buffer) - pos))
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            # Число могло оборваться на границе порции («12» из «123», «1» из «1.5»)
+            is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if is_number and not eof and not buffer[end:].strip("0123456789+-.eE"):
+                chunk = stream.read(READ_SIZE)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            break
+        yield index, value
+        index += 1
+        expect_value = False
+        buffer, pos = buffer[end:], 0
+
+
+def iter_ndjson(stream, errors):
+    """Записи NDJSON построчно; строки с битым JSON попадают в errors"""
+    index = 0
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield index, json.loads(line)
+        except json.JSONDecodeError as e:
+            errors.add(index, None, [f"некорректный JSON: {e.msg}"])
+        index += 1
+
+
+def iter_records(stream, errors):
+    """JSON-массив или NDJSON — определяется по первому символу"""
+    first = stream.read(1)
+    while first and first.isspace():
+        first = stream.read(1)
+    stream = _Prefixed(first, stream)
+    if first == "[":
+        return iter_json_array(stream)
+    return iter_ndjson(stream, errors)
+
+
+class _Prefixed:
+    """Поток с возвращённым назад первым символом"""
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        prefix, self.prefix = self.prefix, ""
+        if size is not None and size >= 0:
+            return prefix + self.stream.read(max(size - len(prefix), 0))
+        return prefix + self.stream.read()
+
+    def __iter__(self):
+        prefix, self.prefix = self.prefix, ""
+        first_line = prefix + self.stream.readline() if prefix else None
+        if first_line:
+            yield first_line
+        yield from self.stream
+
+
+class ImportErrors:
+    """Ошибки по записям: считаются все, в ответ попадают первые MAX_REPORTED_ERRORS"""
+
+    def __init__(self):
+        self.count = 0
+        self.items = []
+
+    def add(self, index, link, messages):
+        self.count += 1
+        if len(self.items) < MAX_REPORTED_ERRORS:
+            self.items.append({"index": index, "link": link, "errors": messages})
+
+
+def validate(record):
+    """Проверить запись по SCHEMA: (товар, None) или (None, [ошибки])"""
+    if not isinstance(record, dict):
+        return None, ["запись должна быть объектом"]
+
+    errors = []
+    product = {}
+    for field, required in SCHEMA.items():
+        value = record.get(field)
+        if value is None or value == "":
+            if required:
+                errors.append(f"{field}: обязательное поле")
+            continue
+        if field == "price":
+            if isinstance(value, bool):
+                errors.append("price: ожидалось число")
+                continue
+            if isinstance(value, str):
+                price = normalize_price(value)
+                if price == 0 and value.strip() != "0":
+                    errors.append(f"price: не удалось разобрать «{value}»")
+                    continue
+                value = price
+            if not isinstance(value, (int, float)) or value < 0:
+                errors.append("price: ожидалось неотрицательное число")
+                continue
+            product[field] = int(value) if isinstance(value, float) and value.is_integer() else value
+            continue
+        if not isinstance(value, str):
+            errors.append(f"{field}: ожидалась строка")
+            continue
+        value = value.strip()
+        if field in ("link", "image", "category_url") and urlsplit(value).scheme not in ("http", "https"):
+            errors.append(f"{field}: ожидался http(s) URL")
+            continue
+        product[field] = value
+
+    if errors:
+        return None, errors
+    return product, None
+
+
+class Upserter:
+    """
+    Применяет импортируемые товары к каталогу пачками по BATCH_SIZE.
+    Существующий товар с той же ссылкой обновляется (поля импорта поверх старых),
+    новый добавляется в конец; replace=True — каталог собирается только из импорта.
+    """
+
+    def __init__(self, existing, replace=False):
+        self.catalog = [] if replace else list(existing)
+        # link -> позиция в каталоге (товары без ссылки и дубли остаются как есть)
+        self.positions = {}
+        for i, product in enumerate(self.catalog):
+            link = product.get("link") if isinstance(product, dict) else None
+            if link:
+                self.positions[link] = i
+        self.batch = []
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+
+    def add(self, product):
+        self.batch.append(product)
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        for product in self.batch:
+            position = self.positions.get(product["link"])
+            if position is None:
+                self.positions[product["link"]] = len(self.catalog)
+                self.catalog.append(product)
+                self.inserted += 1
+                continue
+            old = self.catalog[position]
+            merged = dict(old, **product)
+            if merged == old:
+                self.unchanged += 1
+            else:
+                self.catalog[position] = merged
+                self.updated += 1
+        self.batch = []
+
+    def products(self):
+        self.flush()
+        return self.catalog
+
+
+def run_import(stream, existing, replace=False):
+    """
+    Потоковый импорт: stream — текстовый поток с JSON-массивом или NDJSON.
+    Возвращает (товары каталога или None, если применять нечего, отчёт).
+    """
+    errors = ImportErrors()
+    upserter = Upserter(existing, replace=replace)
+    parsed = invalid = 0
+    for index, record in iter_records(stream, errors):
+        parsed += 1
+        product, messages = validate(record)
+        if messages:
+            invalid += 1
+            link = record.get("link") if isinstance(record, dict) else None
+            errors.add(index, link if isinstance(link, str) else None, messages)
+            continue
+        upserter.add(product)
+
+    products = upserter.products()
+    report = {
+        # Битые строки NDJSON тоже считаются полученными записями
+        "received": parsed + errors.count - invalid,
+        "inserted": upserter.inserted,
+        "updated": upserter.updated,
+        "unchanged": upserter.unchanged,
+        "errors_count": errors.count,
+        "errors": errors.items
+    }
+    if replace:
+        # Полная замена каталога — только если файл целиком корректен
+        if errors.count or not products:
+            return None, report
+        return products, report
+    if not (upserter.inserted or upserter.updated):
+        return None, report
+    return products, report
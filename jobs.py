@@ -0,0 +1,420 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import datetime
+
+from parser import utils
+
+# Сколько завершённых задач хранить для запросов статуса
+MAX_FINISHED_JOBS = 20
+# Как часто задача в очереди проверяет, завершились ли задачи перед ней, сек
+QUEUE_POLL_SECONDS = 2
+# Файл-блокировка постановки задач (общая для всех воркеров)
+SUBMIT_LOCK_NAME = "submit.lock"
+
+
+class CrawlCancelled(Exception):
+    """Задача парсинга была отменена"""
+
+
+def covers(job_force, job_selected, force, units):
+    """Выполнит ли задача (job_force, job_selected) всё, что просит запрос (force, units)"""
+    if force and not job_force:
+        # Без force задача пропускает категории, обновлять которые ещё рано
+        return False
+    if job_selected is None:
+        return True
+    return units is not None and {tuple(u) for u in units} <= {tuple(u) for u in job_selected}
+
+
+class CrawlJob:
+    """Фоновая задача парсинга с прогрессом по сайтам и категориям"""
+
+    def __init__(self, force=False, units=None, selected=None, state_dir=None):
+        self.id = uuid.uuid4().hex[:12]
+        # state_dir: состояние задачи пишется в файл, чтобы его видели другие воркеры
+        self.state_dir = state_dir
+        self.pid = os.getpid()
+        self.force = force
+        # selected: только эти пары (сайт, категория); None — все сайты
+        self.selected = selected
+        self.status = "queued"
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.requests = 1
+        self.items = 0
+        self.current = None
+        # units: список пар (сайт, категория) в порядке обхода
+        self.units = list(units or [])
+        self.done_units = 0
+        self.sites = {}
+        for site_name, category_name in self.units:
+            self.sites.setdefault(site_name, {})[category_name] = {"status": "pending", "items": 0}
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    # ----- вызывается из parse_all_sites -----
+
+    def start_unit(self, site_name, category_name):
+        if self.cancelled:
+            raise CrawlCancelled()
+        with self._lock:
+            self.current = {"site": site_name, "category": category_name}
+            self._unit(site_name, category_name)["status"] = "running"
+        self.save()
+
+    def add_items(self, site_name, category_name, count):
+        with self._lock:
+            self._unit(site_name, category_name)["items"] += count
+            self.items += count
+
+    def finish_unit(self, site_name, category_name, status="done"):
+        with self._lock:
+            self._unit(site_name, category_name)["status"] = status
+            self.done_units += 1
+            self.current = None
+        self.save()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise CrawlCancelled()
+
+    def _unit(self, site_name, category_name):
+        return self.sites.setdefault(site_name, {}).setdefault(
+            category_name, {"status": "pending", "items": 0}
+        )
+
+    # ----- управление -----
+
+    def covers(self, force, units):
+        return covers(self.force, self.selected, force, units)
+
+    def widen(self, force, selected, units):
+        """Расширить задачу в очереди запросом, который она не покрывала"""
+        with self._lock:
+            self.force = self.force or force
+            if self.selected is not None:
+                known = {tuple(u) for u in self.selected}
+                self.selected = None if selected is None else self.selected + [u for u in selected if tuple(u) not in known]
+            known = {tuple(u) for u in self.units}
+            for site_name, category_name in units:
+                if (site_name, category_name) not in known:
+                    self.units.append((site_name, category_name))
+                    self._unit(site_name, category_name)
+            self.requests += 1
+        self.save()
+
+    def cancel(self):
+        self._cancel.set()
+        self.save()
+
+    @property
+    def cancelled(self):
+        # Отмену могли запросить через другой воркер — тогда она приходит файлом-меткой
+        if not self._cancel.is_set() and self.state_dir and os.path.exists(cancel_path(self.state_dir, self.id)):
+            self._cancel.set()
+        return self._cancel.is_set()
+
+    def save(self):
+        """Записать состояние задачи в state_dir (если задан)"""
+        if not self.state_dir:
+            return
+        try:
+            with utils.atomic_write(state_path(self.state_dir, self.id)) as f:
+                json.dump(self.to_dict(), f, ensure_ascii=False)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Не удалось сохранить состояние задачи {self.id}: {e}")
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def eta_seconds(self):
+        """Оценка оставшегося времени по средней длительности категории"""
+        if self.status != "running" or not self.started_at or not self.done_units:
+            return None
+        elapsed = (datetime.now() - self.started_at).total_seconds()
+        remaining = len(self.units) - self.done_units
+        return round(elapsed / self.done_units * remaining, 1)
+
+    def to_dict(self):
+        with self._lock:
+            total = len(self.units)
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "force": self.force,
+                "selected": [list(unit) for unit in self.selected] if self.selected is not None else None,
+                "created_at": self.created_at.isoformat(),
+                "started_at": self.started_at.isoformat() if self.started_at else None,
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+                "progress": {
+                    "done": self.done_units,
+                    "total": total,
+                    "percent": round(self.done_units / total * 100, 1) if total else 0,
+                    "current": self.current,
+                    "items": self.items,
+                    "eta_seconds": self.eta_seconds()
+                },
+                "sites": {site: dict(categories) for site, categories in self.sites.items()},
+                "merged_requests": self.requests,
+                "cancel_requested": self._cancel.is_set(),
+                "pid": self.pid,
+                "result": self.result,
+                "error": self.error
+            }
+
+
+def state_path(state_dir, job_id):
+    return os.path.join(state_dir, f"{job_id}.json")
+
+
+def cancel_path(state_dir, job_id):
+    return os.path.join(state_dir, f"{job_id}.cancel")
+
+
+def _status(job):
+    return job.status if isinstance(job, CrawlJob) else job.data.get("status")
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class StoredJob:
+    """Задача другого воркера, известная только по файлу состояния"""
+
+    def __init__(self, state_dir, data):
+        self.state_dir = state_dir
+        self.data = data
+        self.id = data["job_id"]
+        self.created_at = datetime.fromisoformat(data["created_at"])
+        self.force = data.get("force", False)
+        self.selected = data.get("selected")
+
+    @property
+    def finished(self):
+        return self.data.get("finished_at") is not None
+
+    @property
+    def lost(self):
+        """Воркер, выполнявший задачу, завершился, не дописав результат"""
+        return not self.finished and not _process_alive(self.data.get("pid", 0))
+
+    def covers(self, force, units):
+        return covers(self.force, self.selected, force, units)
+
+    @property
+    def cancelled(self):
+        return self.data.get("cancel_requested") or os.path.exists(cancel_path(self.state_dir, self.id))
+
+    def cancel(self):
+        # Выполняющий задачу воркер увидит метку в начале следующей категории
+        with utils.atomic_write(cancel_path(self.state_dir, self.id)) as f:
+            f.write(datetime.now().isoformat())
+
+    def to_dict(self):
+        data = dict(self.data)
+        if self.lost:
+            data["status"] = "lost"
+        elif os.path.exists(cancel_path(self.state_dir, self.id)):
+            data["cancel_requested"] = True
+        return data
+
+
+class JobManager:
+    """
+    Очередь фоновых задач парсинга: одновременно выполняется не более одной.
+    Задачи живут в потоках своего процесса; при state_dir их состояние пишется
+    в файлы, поэтому статус, отмена и присоединение к задаче работают из любого
+    воркера gunicorn.
+    """
+
+    def __init__(self, runner, units_factory, state_dir=None):
+        # runner(force, job, units) -> dict: выполняет парсинг
+        # units_factory() -> список пар (сайт, категория)
+        self._runner = runner
+        self._units_factory = units_factory
+        self._state_dir = state_dir
+        self._jobs = {}
+        self._active = None
+        # Задача этого процесса, ждущая завершения ранее поставленных
+        self._queued = None
+        self._lock = threading.Lock()
+
+    def submit(self, force=False, units=None):
+        """
+        Поставить парсинг в очередь. Если незавершённая задача (любого воркера)
+        уже выполнит всё, что просит запрос, он присоединяется к ней; иначе
+        задача ждёт своей очереди. Возвращает (задача, merged).
+        units — список пар (сайт, категория) для частичного обновления.
+        """
+        # Проверка и постановка — под общей блокировкой, иначе два воркера
+        # одновременно запустят по задаче и одна из них вернёт busy
+        with self._submit_lock():
+            with self._lock:
+                pending = self._pending()
+                # Отменённые задачи запрос не выполнят — их только дожидаемся
+                for job in pending:
+                    if not job.cancelled and job.covers(force, units):
+                        if isinstance(job, CrawlJob):
+                            job.requests += 1
+                        return job, True
+                if self._queued is not None and not self._queued.cancelled:
+                    self._queued.widen(force, units, units or self._units_factory())
+                    return self._queued, True
+
+                job = CrawlJob(
+                    force=force,
+                    units=units or self._units_factory(),
+                    selected=units,
+                    state_dir=self._state_dir
+                )
+                self._jobs[job.id] = job
+                waits = [other.id for other in pending]
+                if waits:
+                    self._queued = job
+                else:
+                    self._active = job
+                self._trim()
+            job.save()
+
+        thread = threading.Thread(target=self._run, args=(job, waits), name=f"crawl-{job.id}", daemon=True)
+        thread.start()
+        return job, False
+
+    def _submit_lock(self):
+        if not self._state_dir:
+            return nullcontext()
+        return utils.file_lock(os.path.join(self._state_dir, SUBMIT_LOCK_NAME), blocking=True)
+
+    def _pending(self):
+        """
+        Незавершённые задачи: сначала выполняющиеся, затем в очереди.
+        Отменённая задача, поток которой ещё работает, тоже считается:
+        второй поток парсинга упёрся бы в блокировку и вернул busy.
+        """
+        jobs = [job for job in (self._active, self._queued) if job is not None and not job.finished]
+        if self._state_dir and os.path.isdir(self._state_dir):
+            jobs += [
+                stored for stored in self.list_stored()
+                if stored.id not in self._jobs and not stored.finished and not stored.lost
+            ]
+        return sorted(jobs, key=lambda job: (_status(job) != "running", job.created_at))
+
+    def _done(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.finished
+        stored = self._load(job_id) if self._state_dir else None
+        return stored is None or stored.finished or stored.lost
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self._state_dir:
+            return self._load(job_id)
+        return job
+
+    def _load(self, job_id):
+        if not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(state_path(self._state_dir, job_id), "r", encoding="utf-8") as f:
+                return StoredJob(self._state_dir, json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def active(self):
+        """Выполняющаяся задача этого или другого воркера"""
+        with self._lock:
+            running = [job for job in self._pending() if _status(job) == "running"]
+        return running[0] if running else None
+
+    def list(self):
+        with self._lock:
+            jobs = {job.id: job for job in self._jobs.values()}
+        if self._state_dir and os.path.isdir(self._state_dir):
+            for stored in self.list_stored():
+                jobs.setdefault(stored.id, stored)
+        return sorted(jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if not job.finished:
+            job.cancel()
+        return job
+
+    def _run(self, job, waits):
+        started = time.monotonic()
+        try:
+            # Ждём задачи, поставленные раньше (в том числе другими воркерами)
+            while waits:
+                job.check_cancelled()
+                time.sleep(QUEUE_POLL_SECONDS)
+                waits = [job_id for job_id in waits if not self._done(job_id)]
+            with self._lock:
+                if self._queued is job:
+                    self._queued = None
+                self._active = job
+                job.status = "running"
+                job.started_at = datetime.now()
+            job.save()
+            result = self._runner(force=job.force, job=job, units=job.selected)
+            job.result = result
+            job.status = result.get("status", "success")
+        except CrawlCancelled:
+            job.status = "cancelled"
+            job.result = {"status": "cancelled", "count": job.items}
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"Ошибка в задаче парсинга {job.id}: {e}")
+        finally:
+            with self._lock:
+                if self._queued is job:
+                    self._queued = None
+                job.finished_at = datetime.now()
+            job.save()
+            print(f"[{job.finished_at}] Задача {job.id}: {job.status} за {time.monotonic() - started:.1f} сек")
+
+    def _trim(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        finished.sort(key=lambda j: j.created_at)
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self._jobs[job.id]
+        if self._state_dir and os.path.isdir(self._state_dir):
+            # Файлы состояния всех воркеров: оставляем последние MAX_FINISHED_JOBS завершённых
+            stored = [job for job in self.list_stored() if job.finished]
+            stored.sort(key=lambda j: j.created_at)
+            for job in stored[:-MAX_FINISHED_JOBS]:
+                for path in (state_path(self._state_dir, job.id), cancel_path(self._state_dir, job.id)):
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+
+    def list_stored(self):
+        jobs = []
+        for filename in os.listdir(self._state_dir):
+            job_id, ext = os.path.splitext(filename)
+            if ext == ".json":
+                stored = self._load(job_id)
+                if stored is not None:
+                    jobs.append(stored)
+        return jobs
@@ -0,0 +1,331 @@
+import itertools
+import threading
+import zlib
+
+import numpy as np
+
+import text
+
+# MinHash: NUM_PERM хешей, разбитых на BANDS полос по ROWS значений.
+# Порог срабатывания LSH ≈ (1/BANDS) ** (1/ROWS) ≈ 0.59
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+# Минимальное сходство Жаккара признаков для совпадения товаров
+MATCH_THRESHOLD = 0.6
+# Заголовки с меньшим числом признаков («Диван») слишком общие для сопоставления
+MIN_FEATURES = 2
+# Корзины LSH хранят различные наборы признаков, а не товары: сотни одинаковых
+# заголовков занимают в корзине одно место. Корзина полосы больше MAX_BUCKET
+# (общие слова) дробится по ключу двух соседних полос
+MAX_BUCKET = 100
+# Первые столько товаров сайта с одинаковыми признаками («опорные») связываются
+# со всеми совпадающими товарами других сайтов, остальные — только с опорными:
+# группы те же, а рёбер меньше
+EXACT_PER_SITE = 5
+
+_PRIME = 4294967291  # наибольшее простое < 2**32
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, 2 ** 31 - 1, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, 2 ** 31 - 1, size=NUM_PERM).astype(np.uint64)
+_EMPTY = np.full(NUM_PERM, _PRIME, dtype=np.uint32)
+
+
+def title_features(title):
+    """
+    Признаки заголовка: основы слов, артикулы (code:) и размеры (dim:).
+    Размеры вырезаются до токенизации, чтобы «200x90» не стало артикулом.
+    """
+    dims = text.dimensions(title)
+    folded = text.DIMENSIONS_RE.sub(" ", text.fold(title))
+    features = {f"dim:{d}" for d in dims}
+    for token in text.TOKEN_RE.findall(folded):
+        if text.is_model_code(token):
+            features.add(f"code:{token}")
+        elif len(token) >= 2:
+            features.add(text.stem(token))
+    return features
+
+
+def signatures(feature_sets):
+    """MinHash-подписи для списка множеств признаков: массив (n, NUM_PERM) uint32"""
+    lengths = np.array([len(f) for f in feature_sets], dtype=np.int64)
+    result = np.tile(_EMPTY, (len(feature_sets), 1))
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return result
+    hashes = np.fromiter(
+        (zlib.crc32(feature.encode("utf-8")) for features in feature_sets for feature in features),
+        dtype=np.uint64, count=int(lengths.sum())
+    )
+    permuted = (hashes[:, None] * _A[None, :] + _B[None, :]) % _PRIME
+    starts = (np.cumsum(lengths) - lengths)[nonempty]
+    result[nonempty] = np.minimum.reduceat(permuted, starts, axis=0).astype(np.uint32)
+    return result
+
+
+def features_match(fa, fb):
+    """Совпадают ли товары по признакам заголовков (без учёта сайта)"""
+    # Размеры, если указаны с обеих сторон, должны пересекаться: в заголовке их часто
+    # опускают. Артикул, указанный хотя бы с одной стороны, должен совпасть:
+    # модели одной серии различаются только им
+    da = {f for f in fa if f.startswith("dim:")}
+    db = {f for f in fb if f.startswith("dim:")}
+    if da and db and not (da & db):
+        return False
+    ca = {f for f in fa if f.startswith("code:")}
+    cb = {f for f in fb if f.startswith("code:")}
+    if (ca or cb) and not (ca & cb):
+        return False
+    return len(fa & fb) / len(fa | fb) >= MATCH_THRESHOLD if fa or fb else False
+
+
+def wide_key(keys, band):
+    """Ключ пары соседних полос — для дробления переполненной корзины полосы band"""
+    return int(keys[band]), int(keys[(band + 1) % BANDS])
+
+
+def band_keys(signature_rows):
+    """Ключ каждой полосы LSH: (n, BANDS) uint64"""
+    rows = signature_rows.astype(np.uint64).reshape(len(signature_rows), BANDS, ROWS)
+    keys = np.zeros(rows.shape[:2], dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for r in range(ROWS):
+            keys = keys * np.uint64(1000003) + rows[:, :, r]
+    return keys
+
+
+class ProductMatcher:
+    """
+    Индекс сопоставления одинаковых товаров на разных сайтах (MinHash/LSH по заголовкам).
+    Обновляется инкрементально: sync() добавляет новые, удаляет пропавшие
+    и переиндексирует товары с изменившимся заголовком. Совпадения новых
+    товаров проверяются только среди кандидатов LSH, поэтому стоимость
+    обновления пропорциональна числу изменившихся товаров.
+    """
+
+    def __init__(self):
+        self.entries = {}  # link -> запись товара
+        # Корзины полос и пар соседних полос: ключ -> {признаки: None}
+        self.buckets = [dict() for _ in range(BANDS)]
+        self.wide_buckets = [dict() for _ in range(BANDS)]
+        # Признаки -> {сайт: {ссылка: None}} (словари как упорядоченные множества)
+        self.exact = {}
+        self.version = None
+        self._groups = None
+        self._lock = threading.RLock()
+
+    def sync(self, products, version=None):
+        """Привести индекс к списку товаров; возвращает число добавленных/удалённых"""
+        with self._lock:
+            if version is not None and version == self.version:
+                return {"added": 0, "removed": 0}
+            current = {}
+            for product in products:
+                link = product.get("link")
+                if link:
+                    current[link] = product
+
+            removed = [link for link, entry in self.entries.items()
+                       if link not in current or current[link].get("title") != entry["title"]]
+            for link in removed:
+                self._remove(link)
+
+            added = []
+            for link, product in current.items():
+                entry = self.entries.get(link)
+                if entry is None:
+                    added.append(product)
+                else:
+                    # Заголовок тот же — обновляем только цену и подписи сайта/категории
+                    entry.update(self._meta(product))
+            self._add(added)
+
+            # Цены могли измениться даже без новых товаров — группы пересчитаем при запросе
+            self._groups = None
+            self.version = version
+            return {"added": len(added), "removed": len(removed)}
+
+    @staticmethod
+    def _meta(product):
+        return {
+            "price": product.get("price", 0),
+            "site": product.get("site_name") or product.get("site", ""),
+            "category": product.get("category", ""),
+            "image": product.get("image", "")
+        }
+
+    def _add(self, products):
+        if not products:
+            return
+        features = [title_features(p.get("title", "")) for p in products]
+        sigs = signatures(features)
+        keys = band_keys(sigs)
+        for i, product in enumerate(products):
+            link = product["link"]
+            entry = {
+                "link": link,
+                "title": product.get("title", ""),
+                "features": frozenset(features[i]),
+                "keys": keys[i] if len(features[i]) >= MIN_FEATURES else None,
+                "matches": set()
+            }
+            entry.update(self._meta(product))
+            self.entries[link] = entry
+            if entry["keys"] is None:
+                continue
+            sites = self.exact.get(entry["features"])
+            if sites is None:
+                # Первый товар с такими признаками — набор признаков попадает в корзины
+                sites = self.exact[entry["features"]] = {}
+                for band in range(BANDS):
+                    self.buckets[band].setdefault(int(keys[i, band]), {})[entry["features"]] = None
+                    self.wide_buckets[band].setdefault(wide_key(keys[i], band), {})[entry["features"]] = None
+            sites.setdefault(entry["site"], {})[link] = None
+
+        # Проверяем совпадения новых товаров среди кандидатов LSH. Сравниваются
+        # наборы признаков, поэтому одинаковые заголовки проверяются один раз
+        matched_sets = {}
+        for product in products:
+            link = product["link"]
+            entry = self.entries[link]
+            if entry["keys"] is None:
+                continue
+            features = entry["features"]
+            if features not in matched_sets:
+                matched_sets[features] = self._matched_features(features, entry["keys"])
+            self._link(link, matched_sets[features])
+
+    def _matched_features(self, features, keys):
+        return [other for other in self.candidate_features(features, keys) if features_match(features, other)]
+
+    def _link(self, link, matched_sets):
+        """Связать товар с товарами других сайтов, признаки которых из matched_sets"""
+        entry = self.entries[link]
+        anchor = link in itertools.islice(self.exact[entry["features"]][entry["site"]], EXACT_PER_SITE)
+        for other_features in matched_sets:
+            for site, links in self.exact[other_features].items():
+                if site == entry["site"]:
+                    continue
+                # Опорный товар — со всеми, остальные — с опорными товарами другого сайта
+                for other in (links if anchor else itertools.islice(links, EXACT_PER_SITE)):
+                    entry["matches"].add(other)
+                    self.entries[other]["matches"].add(link)
+
+    def _remove(self, link):
+        entry = self.entries.pop(link, None)
+        if entry is None:
+            return
+        for other in entry["matches"]:
+            if other in self.entries:
+                self.entries[other]["matches"].discard(link)
+        if entry["keys"] is None:
+            return
+        features = entry["features"]
+        sites = self.exact[features]
+        links = sites[entry["site"]]
+        anchor = link in itertools.islice(links, EXACT_PER_SITE)
+        del links[link]
+        if anchor and len(links) >= EXACT_PER_SITE:
+            # Место опорного товара занимает следующий — связываем его со всеми,
+            # как при построении индекса с нуля
+            promoted = next(itertools.islice(links, EXACT_PER_SITE - 1, None))
+            self._link(promoted, self._matched_features(features, entry["keys"]))
+        if not links:
+            del sites[entry["site"]]
+        if sites:
+            return
+        # Последний товар с такими признаками — убираем их из корзин
+        del self.exact[features]
+        for band in range(BANDS):
+            for buckets, key in ((self.buckets[band], int(entry["keys"][band])),
+                                 (self.wide_buckets[band], wide_key(entry["keys"], band))):
+                bucket = buckets.get(key)
+                if bucket is not None:
+                    bucket.pop(features, None)
+                    if not bucket:
+                        del buckets[key]
+
+    def similarity(self, a, b):
+        """Сходство Жаккара признаков двух товаров"""
+        fa, fb = self.entries[a]["features"], self.entries[b]["features"]
+        return len(fa & fb) / len(fa | fb) if fa or fb else 0.0
+
+    def candidate_features(self, features, keys):
+        """
+        Наборы признаков, попавшие с features в одну корзину LSH хотя бы в одной полосе.
+        Вместо переполненной корзины берётся корзина пары полос (а если переполнена
+        и она — первые MAX_BUCKET наборов).
+        """
+        result = {features}
+        for band in range(BANDS):
+            bucket = self.buckets[band].get(int(keys[band]), {})
+            if len(bucket) > MAX_BUCKET:
+                bucket = self.wide_buckets[band].get(wide_key(keys, band), {})
+            result.update(itertools.islice(bucket, MAX_BUCKET))
+        return result
+
+    def matches(self, link):
+        """Совпавшие товары с других сайтов, по убыванию сходства"""
+        with self._lock:
+            entry = self.entries.get(link)
+            if entry is None:
+                return None
+            return [
+                dict(self._describe([other])["products"][0], similarity=round(self.similarity(link, other), 3))
+                for other in sorted(entry["matches"], key=lambda other: (-self.similarity(link, other), other))
+            ]
+
+    def groups(self):
+        """Группы одинаковых товаров с разных сайтов (объединение совпавших пар)"""
+        with self._lock:
+            if self._groups is not None:
+                return self._groups
+            # Компоненты связности графа совпадений
+            seen = set()
+            components = []
+            for link, entry in self.entries.items():
+                if not entry["matches"] or link in seen:
+                    continue
+                component = []
+                stack = [link]
+                seen.add(link)
+                while stack:
+                    current = stack.pop()
+                    component.append(current)
+                    for other in self.entries[current]["matches"]:
+                        if other not in seen:
+                            seen.add(other)
+                            stack.append(other)
+                components.append(component)
+
+            self._groups = [self._describe(links) for links in components]
+            self._groups.sort(key=lambda g: g["spread_percent"], reverse=True)
+            return self._groups
+
+    def _describe(self, links):
+        entries = sorted((self.entries[link] for link in links), key=lambda e: e["price"] or 0)
+        prices = [e["price"] for e in entries if e["price"] and e["price"] > 0]
+        min_price = min(prices) if prices else 0
+        max_price = max(prices) if prices else 0
+        return {
+            "title": entries[0]["title"],
+            "sites": sorted({e["site"] for e in entries}),
+            "min_price": min_price,
+            "max_price": max_price,
+            "spread_percent": round((max_price - min_price) / min_price * 100, 1) if min_price else 0,
+            "cheapest_site": entries[0]["site"] if prices else None,
+            "products": [
+                {
+                    "title": e["title"],
+                    "site_name": e["site"],
+                    "category": e["category"],
+                    "price": e["price"],
+                    "link": e["link"],
+                    "image": e["image"],
+                    "diff_from_min_percent": round((e["price"] - min_price) / min_price * 100, 1)
+                    if min_price and e["price"] else None
+                }
+                for e in entries
+            ]
+        }
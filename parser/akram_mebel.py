@@ -1,21 +1,42 @@
-import requests
 from bs4 import BeautifulSoup
 from .utils import normalize_price
+from .fetcher import fetch, FETCH_ERRORS, CategoryIncomplete
+from . import woo_api
 
 HEADERS = {"User-Agent": "Mozilla/5.0"}
+# Сначала пробуем WooCommerce Store API (JSON), при недоступности — HTML
+STORE_API = True
 
-def parse_category(category_url):
+def parse_category(category_url, start_page=1, on_page=None, source=None):
+    """
+    Товары категории начиная со страницы start_page.
+    on_page(page, page_items, source) вызывается после каждой обработанной страницы;
+    source — способ обхода ("api" или "html"), которым записан продолжаемый чекпоинт.
+    """
+    return woo_api.parse_with_fallback(
+        category_url, "akram-mebel", parse_category_html, start_page, on_page, source, use_api=STORE_API
+    )
+
+def parse_category_html(category_url, start_page=1, on_page=None):
+    """Товары категории из HTML-страниц каталога"""
     items = []
-    page = 1
+    page = start_page
     while True:
         url = category_url.rstrip("/") + f"/page/{page}/"
-        r = requests.get(url, headers=HEADERS)
+        try:
+            r = fetch(url, headers=HEADERS)
+        except FETCH_ERRORS as e:
+            # Отдаём уже собранные товары вместе с причиной остановки
+            raise CategoryIncomplete(items, str(e)) from e
         if r.status_code == 404:
             break
+        if r.status_code >= 500:
+            raise CategoryIncomplete(items, f"HTTP {r.status_code} на {url}")
         soup = BeautifulSoup(r.text, "lxml")
         products = soup.select("li.product")
         if not products:
             break
+        page_start = len(items)
         for p in products:
             try:
                 title = p.select_one("h2.woocommerce-loop-product__title").get_text(strip=True)
@@ -32,6 +53,8 @@ def parse_category(category_url):
                 })
             except Exception:
                 continue
+        if on_page:
+            on_page(page, items[page_start:])
         page += 1
     return items
 
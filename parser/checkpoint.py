@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+# Чекпоинт старше этого срока считается устаревшим и не используется
+CHECKPOINT_MAX_AGE = timedelta(days=1)
+
+
+def _new_unit():
+    return {"page": 0, "items": [], "source": None, "done": False}
+
+
+class CrawlCheckpoint:
+    """
+    Журнал парсинга (NDJSON): каждая обработанная страница категории
+    дописывается в файл вместе с товарами. После перезапуска процесса
+    парсинг продолжается с последней сохранённой страницы.
+
+    Записи журнала:
+      {"type": "start", "started_at": ...}
+      {"type": "page", "site": ..., "category": ..., "page": N, "items": [...], "source": ...}
+      {"type": "reset", "site": ..., "category": ...}
+      {"type": "done", "site": ..., "category": ...}
+
+    source — способ обхода страниц ("api", "html" или null), reset — категория
+    начата заново и её прежние страницы не в счёт.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.started_at = None
+        self.resumed = False
+        # (сайт, категория) -> {"page": последняя страница, "items": [...], "source": ..., "done": bool}
+        self.units = {}
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def open(cls, filename, max_age=CHECKPOINT_MAX_AGE):
+        """Продолжить свежий журнал или начать новый"""
+        checkpoint = cls(filename)
+        if os.path.exists(filename):
+            checkpoint._load()
+            if checkpoint.started_at and datetime.now() - checkpoint.started_at <= max_age:
+                checkpoint.resumed = bool(checkpoint.units)
+            else:
+                checkpoint.started_at = None
+                checkpoint.units = {}
+        if checkpoint.started_at is None:
+            os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+            checkpoint.started_at = datetime.now()
+            checkpoint._file = open(filename, "w", encoding="utf-8")
+            checkpoint._append({"type": "start", "started_at": checkpoint.started_at.isoformat()})
+        else:
+            checkpoint._file = open(filename, "a", encoding="utf-8")
+        return checkpoint
+
+    def _load(self):
+        valid_size = 0
+        with open(self.filename, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    # Недописанная последняя строка после падения процесса
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                valid_size += len(line)
+                kind = record.get("type")
+                if kind == "start":
+                    try:
+                        self.started_at = datetime.fromisoformat(record["started_at"])
+                    except (KeyError, ValueError):
+                        self.started_at = None
+                    continue
+                unit = self.units.setdefault((record["site"], record["category"]), _new_unit())
+                if kind == "page":
+                    unit["page"] = record["page"]
+                    unit["items"].extend(record["items"])
+                    unit["source"] = record.get("source")
+                elif kind == "reset":
+                    unit.update(_new_unit())
+                elif kind == "done":
+                    unit["done"] = True
+        # Отрезаем повреждённый хвост, чтобы новые записи не склеились с ним
+        if valid_size != os.path.getsize(self.filename):
+            with open(self.filename, "r+b") as f:
+                f.truncate(valid_size)
+
+    def _append(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def get(self, site, category):
+        """Сохранённое состояние категории или None"""
+        return self.units.get((site, category))
+
+    def record_page(self, site, category, page, items, source=None):
+        unit = self.units.setdefault((site, category), _new_unit())
+        unit["page"] = page
+        unit["items"].extend(items)
+        unit["source"] = source
+        self._append({"type": "page", "site": site, "category": category, "page": page, "items": items, "source": source})
+
+    def reset(self, site, category):
+        """Забыть сохранённые страницы категории: её обходят заново"""
+        self.units[(site, category)] = _new_unit()
+        self._append({"type": "reset", "site": site, "category": category})
+
+    def complete(self, site, category):
+        self.units.setdefault((site, category), _new_unit())["done"] = True
+        self._append({"type": "done", "site": site, "category": category})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        """Удалить журнал после успешного сохранения результата"""
+        self.close()
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
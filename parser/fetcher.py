@@ -0,0 +1,237 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+# Ответы, при которых сайт просит снизить нагрузку
+THROTTLE_STATUSES = (429, 503)
+# Сколько раз повторять запрос после 429/503
+MAX_RETRIES = 3
+# Верхняя граница ожидания по Retry-After, сек
+MAX_RETRY_AFTER = 120
+# Задержки ниже этого порога не считаются признаком перегрузки, сек
+MIN_SLOW_LATENCY = 0.5
+# Таймауты запроса по умолчанию: (соединение, чтение), сек
+DEFAULT_TIMEOUT = (5, 20)
+# Circuit breaker: после стольких ошибок подряд хост отключается
+BREAKER_THRESHOLD = 5
+# ...на столько секунд
+BREAKER_COOLDOWN = 300
+
+
+class FetchAborted(Exception):
+    """Запрос не выполнялся: исчерпан лимит времени или хост отключён"""
+
+
+class DeadlineExceeded(FetchAborted):
+    """Истёк общий лимит времени парсинга"""
+
+
+class CircuitOpen(FetchAborted):
+    """Хост временно отключён после серии ошибок"""
+
+
+# Ошибки, после которых дальнейший обход категории бессмысленен
+FETCH_ERRORS = (FetchAborted, requests.RequestException)
+
+
+class CategoryIncomplete(Exception):
+    """Категория спарсена не полностью; items содержит уже собранные товары"""
+
+    def __init__(self, items, reason):
+        super().__init__(reason)
+        self.items = items
+        self.reason = reason
+
+
+class ResumeUnavailable(Exception):
+    """Категорию нельзя продолжить с сохранённой страницы — её нужно обойти заново"""
+
+
+_local = threading.local()
+
+
+@contextmanager
+def deadline(seconds):
+    """Общий лимит времени для всех запросов текущего потока"""
+    previous = getattr(_local, "deadline", None)
+    _local.deadline = time.monotonic() + seconds if seconds else None
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def time_left():
+    """Сколько секунд осталось до общего лимита (None — лимита нет)"""
+    current = getattr(_local, "deadline", None)
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+def deadline_exceeded():
+    left = time_left()
+    return left is not None and left <= 0
+
+
+class HostLimiter:
+    """
+    Ограничитель запросов к одному хосту: token bucket с адаптивной (AIMD) частотой.
+    При хороших ответах частота растёт аддитивно, при 429/503 или росте
+    задержки — уменьшается мультипликативно.
+
+    Категории обходятся последовательно, поэтому к хосту всегда идёт не больше
+    одного запроса: лимит параллельности не нужен, ограничивается только частота.
+    """
+
+    def __init__(self, rate=2.0, min_rate=0.2, max_rate=10.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.latency = None  # сглаженная задержка ответа (EWMA), сек
+        self.successes = 0
+        # Circuit breaker
+        self.failures = 0
+        self.open_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Дождаться разрешения на запрос"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self.open_until:
+                    raise CircuitOpen(f"хост отключён ещё на {self.open_until - now:.0f} сек")
+                left = time_left()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded("истёк лимит времени парсинга")
+                self._refill(now)
+                wait = 0.0
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    return
+                if left is not None:
+                    wait = min(wait, left)
+                self._cond.wait(wait)
+
+    def release(self, status=None, latency=None, retry_after=None):
+        """Учесть результат запроса и подстроить частоту"""
+        with self._cond:
+            if status is None or status >= 500:
+                self.failures += 1
+                if self.failures >= BREAKER_THRESHOLD:
+                    self.open_until = time.monotonic() + BREAKER_COOLDOWN
+                    self.failures = 0
+            else:
+                self.failures = 0
+            if status in THROTTLE_STATUSES or status is None:
+                self._decrease(0.5)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            elif latency is not None and self.latency is not None and latency > max(self.latency * 2, MIN_SLOW_LATENCY):
+                # Задержка резко выросла — сайт перегружен
+                self._decrease(0.75)
+            else:
+                self._increase()
+            if latency is not None:
+                self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        # Ёмкость корзины — один запрос: после паузы не бывает всплеска запросов
+        self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _increase(self):
+        self.successes += 1
+        self.rate = min(self.max_rate, self.rate + 0.1)
+
+    def _decrease(self, factor):
+        self.successes = 0
+        self.rate = max(self.min_rate, self.rate * factor)
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "rate": round(self.rate, 2),
+                "latency": round(self.latency, 3) if self.latency is not None else None,
+                "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 1),
+                "circuit_open_for": round(max(0.0, self.open_until - time.monotonic()), 1)
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(url):
+    """Ограничитель для хоста из URL (один на процесс)"""
+    host = urlsplit(url).hostname or ""
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter()
+        return _limiters[host]
+
+
+def limiters_snapshot():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {host: limiter.snapshot() for host, limiter in limiters.items()}
+
+
+def parse_retry_after(value):
+    """Retry-After: число секунд или HTTP-дата"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        seconds = (when - datetime.now(timezone.utc)).total_seconds()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def fetch(url, **kwargs):
+    """
+    requests.get с ограничением частоты по хосту и таймаутами.
+    На 429/503 повторяет запрос с учётом Retry-After, затем возвращает последний ответ.
+    Бросает FetchAborted, если истёк общий лимит времени или хост отключён.
+    """
+    limiter = get_limiter(url)
+    timeout = kwargs.pop("timeout", DEFAULT_TIMEOUT)
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        left = time_left()
+        if left is not None:
+            read_timeout = max(1.0, min(read_timeout, left))
+        kwargs["timeout"] = (connect_timeout, read_timeout)
+        started = time.monotonic()
+        try:
+            r = requests.get(url, **kwargs)
+        except requests.RequestException:
+            limiter.release(status=None, latency=time.monotonic() - started)
+            raise
+        retry_after = parse_retry_after(r.headers.get("Retry-After"))
+        limiter.release(status=r.status_code, latency=time.monotonic() - started, retry_after=retry_after)
+        if r.status_code not in THROTTLE_STATUSES or attempt == MAX_RETRIES:
+            return r
+        print(f"{r.status_code} от {urlsplit(url).hostname}, повтор через {retry_after or 0:.0f} сек")
+    return r
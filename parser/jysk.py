@@ -1,13 +1,27 @@
 # jysk.py
-import requests
 from bs4 import BeautifulSoup
 from .utils import normalize_price
+from .fetcher import fetch, FETCH_ERRORS, CategoryIncomplete
+from . import woo_api
 
 HEADERS = {"User-Agent": "Mozilla/5.0"}
+# Сначала пробуем WooCommerce Store API (JSON), при недоступности — HTML
+STORE_API = True
 
-def parse_category(category_url):
+def parse_category(category_url, start_page=1, on_page=None, source=None):
+    """
+    Товары категории начиная со страницы start_page.
+    on_page(page, page_items, source) вызывается после каждой обработанной страницы;
+    source — способ обхода ("api" или "html"), которым записан продолжаемый чекпоинт.
+    """
+    return woo_api.parse_with_fallback(
+        category_url, "jysk", parse_category_html, start_page, on_page, source, use_api=STORE_API
+    )
+
+def parse_category_html(category_url, start_page=1, on_page=None):
+    """Товары категории из HTML-страниц каталога"""
     items = []
-    page = 1
+    page = start_page
     
     try:
         while True:
@@ -17,8 +31,14 @@ def parse_category(category_url):
             else:
                 url = f"{category_url}page/{page}/"
                 
-            r = requests.get(url, headers=HEADERS, timeout=10)
+            try:
+                r = fetch(url, headers=HEADERS)
+            except FETCH_ERRORS as e:
+                # Отдаём уже собранные товары вместе с причиной остановки
+                raise CategoryIncomplete(items, str(e)) from e
             
+            if r.status_code >= 500:
+                raise CategoryIncomplete(items, f"HTTP {r.status_code} на {url}")
             if r.status_code != 200:
                 break
                 
@@ -32,6 +52,7 @@ def parse_category(category_url):
                 break
                 
             print(f"На странице {page} найдено {len(products)} товаров")
+            page_start = len(items)
                 
             for p in products:
                 try:
@@ -89,6 +110,9 @@ def parse_category(category_url):
                     print(f"  ✗ Ошибка при парсинге товара: {e}")
                     continue
             
+            if on_page:
+                on_page(page, items[page_start:])
+            
             # Проверяем есть ли следующая страница
             next_page = soup.select_one("a.next") or soup.select_one("a[rel='next']")
             if not next_page:
@@ -96,6 +120,8 @@ def parse_category(category_url):
                 
             page += 1
             
+    except CategoryIncomplete:
+        raise
     except Exception as e:
         print(f"Ошибка при парсинге JYSK категории {category_url}: {e}")
     
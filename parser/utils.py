@@ -1,12 +1,72 @@
 import json
 import os
 import re
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки между процессами не поддерживаются
+    fcntl = None
+
+@contextmanager
+def atomic_write(filename, mode="w", encoding="utf-8"):
+    """
+    Запись во временный файл рядом с целевым и атомарная замена через os.replace.
+    Читатели видят либо старый, либо новый файл целиком, но не частично записанный.
+    """
+    directory = os.path.dirname(filename) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(filename))
+    try:
+        with os.fdopen(fd, mode, encoding=encoding if "b" not in mode else None) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
 
 def save_json(data, filename="data/products.json"):
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-    with open(filename, "w", encoding="utf-8") as f:
+    with atomic_write(filename) as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
+@contextmanager
+def file_lock(filename, blocking=False):
+    """
+    Межпроцессная блокировка на файле (flock). Возвращает True, если блокировка получена.
+    Блокировка освобождается ОС автоматически, если процесс-владелец упал.
+    """
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    f = open(filename, "a+")
+    try:
+        if fcntl is None:
+            acquired = True
+        else:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(f.fileno(), flags)
+                acquired = True
+            except BlockingIOError:
+                acquired = False
+        if acquired:
+            # Записываем владельца для диагностики
+            f.seek(0)
+            f.truncate()
+            f.write(f"{os.getpid()} {datetime.now().isoformat()}\n")
+            f.flush()
+        yield acquired
+    finally:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            except OSError:
+                pass
+        f.close()
+
 def load_json(filename="data/products.json"):
     if os.path.exists(filename):
         with open(filename, "r", encoding="utf-8") as f:
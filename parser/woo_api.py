@@ -0,0 +1,125 @@
+import html
+from urllib.parse import urlsplit
+
+from .fetcher import fetch, FETCH_ERRORS, CategoryIncomplete, ResumeUnavailable
+
+HEADERS = {"User-Agent": "Mozilla/5.0", "Accept": "application/json"}
+# Публичный WooCommerce Store API (без ключей)
+STORE_API_PATH = "/wp-json/wc/store/v1/products"
+# Максимум, который отдаёт Store API за один запрос
+PER_PAGE = 100
+
+
+class ApiUnavailable(Exception):
+    """Store API на сайте выключен или не отдаёт товары категории"""
+
+
+def category_slug(category_url):
+    """Слаг категории из URL: https://akram-mebel.tj/pc/stulya/ -> stulya"""
+    return urlsplit(category_url).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def api_url(category_url):
+    parts = urlsplit(category_url)
+    return f"{parts.scheme}://{parts.netloc}{STORE_API_PATH}"
+
+
+def to_item(product, category_url, site):
+    """Товар Store API -> наша схема товара; None, если цены нет"""
+    prices = product.get("prices") or {}
+    raw_price = prices.get("price")
+    if not raw_price:
+        return None
+    try:
+        price = int(raw_price) // 10 ** int(prices.get("currency_minor_unit", 0))
+    except (TypeError, ValueError):
+        return None
+
+    images = product.get("images") or []
+    image = ""
+    if images:
+        image = images[0].get("thumbnail") or images[0].get("src") or ""
+
+    return {
+        "title": html.unescape(product.get("name", "")).strip(),
+        "price": price,
+        "link": product.get("permalink", ""),
+        "image": image,
+        "category_url": category_url,
+        "site": site
+    }
+
+
+def parse_category(category_url, site, start_page=1, on_page=None):
+    """
+    Товары категории через Store API по PER_PAGE за запрос.
+    Бросает ApiUnavailable, если API недоступен на первой же странице,
+    чтобы парсер мог перейти на HTML.
+    """
+    items = []
+    page = start_page
+    url = api_url(category_url)
+    slug = category_slug(category_url)
+    while True:
+        params = {"category": slug, "per_page": PER_PAGE, "page": page}
+        try:
+            r = fetch(url, headers=HEADERS, params=params)
+        except FETCH_ERRORS as e:
+            raise CategoryIncomplete(items, str(e)) from e
+        if r.status_code >= 500:
+            raise CategoryIncomplete(items, f"HTTP {r.status_code} на {r.url}")
+        # Страница за последней отдаёт 400 (rest_post_invalid_page_number)
+        if r.status_code == 400 and page > 1:
+            break
+
+        try:
+            products = r.json() if r.status_code == 200 else None
+        except ValueError:
+            products = None
+        if not isinstance(products, list):
+            if page == start_page:
+                raise ApiUnavailable(f"HTTP {r.status_code} на {r.url}")
+            break
+        if not products:
+            # Пустая первая страница: слаг не распознан или категория пуста —
+            # пусть это проверит HTML-парсер
+            if page == 1:
+                raise ApiUnavailable(f"нет товаров по category={slug}")
+            break
+
+        page_items = [item for item in (to_item(p, category_url, site) for p in products) if item]
+        items.extend(page_items)
+        if on_page:
+            on_page(page, page_items)
+
+        total_pages = r.headers.get("X-WP-TotalPages")
+        if len(products) < PER_PAGE or (total_pages and total_pages.isdigit() and page >= int(total_pages)):
+            break
+        page += 1
+    return items
+
+
+def parse_with_fallback(category_url, site, html_parser, start_page=1, on_page=None, source=None, use_api=True):
+    """
+    Товары категории через Store API (use_api), при его недоступности — html_parser.
+    on_page(page, page_items, source) получает и способ обхода: "api" или "html".
+    Номера и размеры страниц API и HTML не совпадают, поэтому чекпоинт (start_page > 1)
+    продолжается только тем способом source, которым записаны его страницы;
+    иначе бросается ResumeUnavailable и категорию обходят с первой страницы.
+    """
+    def tagged(source):
+        return (lambda page, page_items: on_page(page, page_items, source)) if on_page else None
+
+    resuming = start_page > 1
+    if resuming and source not in ("api", "html"):
+        raise ResumeUnavailable(f"неизвестно, как записан чекпоинт (source={source!r})")
+    if resuming and source == "api" and not use_api:
+        raise ResumeUnavailable("чекпоинт записан через Store API, а он выключен")
+    if use_api and (not resuming or source == "api"):
+        try:
+            return parse_category(category_url, site, start_page, tagged("api"))
+        except ApiUnavailable as e:
+            if resuming:
+                raise ResumeUnavailable(f"Store API недоступен: {e}") from e
+            print(f"Store API недоступен ({e}), парсим HTML: {category_url}")
+    return html_parser(category_url, start_page, tagged("html"))
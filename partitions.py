@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from parser import utils
+
+# Версия формата манифеста партиций
+MANIFEST_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+# Ключ партиции для товаров без сайта
+UNKNOWN_SITE = ""
+
+
+def file_stamp(filename):
+    """Версия файла по времени изменения и размеру; None, если файла нет"""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+class PartitionStore:
+    """
+    Товары, разбитые на файлы по сайтам (by_category=True — по сайту и категории),
+    и манифест с версией, временем парсинга и числом товаров каждой партиции.
+    Запись идёт только под блокировкой парсинга; манифест пишется последним,
+    поэтому читатели видят партицию новой версии только после записи её файла.
+    """
+
+    def __init__(self, directory, by_category=False):
+        self.directory = directory
+        self.by_category = by_category
+        self.manifest_file = os.path.join(directory, MANIFEST_NAME)
+        self._cache = {"stamp": None, "manifest": None}
+        self._lock = threading.Lock()
+
+    def unit_key(self, site_name, category):
+        site_name = site_name or UNKNOWN_SITE
+        return f"{site_name}/{category}" if self.by_category else site_name
+
+    def key(self, product):
+        return self.unit_key(product.get("site_name"), product.get("category"))
+
+    def split(self, products):
+        """Товары по партициям с сохранением порядка: {ключ: [товары]}"""
+        groups = {}
+        for product in products:
+            groups.setdefault(self.key(product), []).append(product)
+        return groups
+
+    def path(self, key, ext="json"):
+        """Файл партиции: читаемая часть ключа и хеш (названия бывают кириллицей)"""
+        slug = re.sub(r"[^0-9a-z]+", "-", key.lower()).strip("-")
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.directory, f"{slug}-{digest}.{ext}" if slug else f"{digest}.{ext}")
+
+    def manifest(self):
+        """Манифест (перечитывается только после изменения файла) или None до первой записи"""
+        stamp = file_stamp(self.manifest_file)
+        with self._lock:
+            if stamp != self._cache["stamp"]:
+                manifest = utils.load_json(self.manifest_file) if stamp is not None else None
+                if not isinstance(manifest, dict) or manifest.get("format") != MANIFEST_FORMAT:
+                    manifest = None
+                self._cache = {"stamp": stamp, "manifest": manifest}
+            return self._cache["manifest"]
+
+    def version(self):
+        """Версия данных: меняется, только когда меняется содержимое какой-либо партиции"""
+        manifest = self.manifest()
+        return manifest["revision"] if manifest else None
+
+    def revised_at(self):
+        """Время появления текущей версии данных (ISO) или None до первой записи"""
+        manifest = self.manifest()
+        if not manifest:
+            return None
+        # В манифестах, записанных до появления revised_at, есть только updated_at
+        return manifest.get("revised_at") or manifest.get("updated_at")
+
+    def matches_layout(self, manifest):
+        return manifest.get("by_category", False) == self.by_category
+
+    def load(self, key):
+        products = utils.load_json(self.path(key))
+        return products if isinstance(products, list) else []
+
+    def load_all(self, keys=None):
+        """Содержимое партиций {ключ: товары}: всех из манифеста или только keys"""
+        manifest = self.manifest()
+        stored = manifest["partitions"] if manifest else {}
+        return {key: self.load(key) for key in stored if keys is None or key in keys}
+
+    def products(self):
+        return [product for products in self.load_all().values() for product in products]
+
+    def category_counts(self):
+        """Число товаров по категориям, сложенное из манифеста (без чтения партиций)"""
+        manifest = self.manifest()
+        counts = {}
+        for entry in (manifest["partitions"].values() if manifest else []):
+            for category, count in entry["categories"].items():
+                counts[category] = counts.get(category, 0) + count
+        return counts
+
+    def total(self):
+        manifest = self.manifest()
+        return sum(entry["count"] for entry in manifest["partitions"].values()) if manifest else 0
+
+    def write(self, groups, previous, source, replace=False):
+        """
+        Записать партиции groups {ключ: товары}; previous — их текущее содержимое.
+        Файлы неизменившихся партиций не переписываются (при парсинге у них
+        обновляется только время парсинга). replace=True — партиции, которых нет
+        в groups, удаляются. Возвращает ключи партиций, содержимое которых изменилось.
+        """
+        now = datetime.now().isoformat()
+        manifest = self.manifest()
+        orphaned = []
+        if manifest is not None and not self.matches_layout(manifest):
+            # Смена схемы разбиения: прежние партиции удаляются после записи новых
+            orphaned = [key for key in manifest["partitions"] if key not in groups]
+            manifest = None
+        if manifest is None:
+            manifest = {"format": MANIFEST_FORMAT, "by_category": self.by_category, "revision": None, "partitions": {}}
+        stored = dict(manifest["partitions"])
+
+        changed = []
+        for key, products in groups.items():
+            entry = stored.get(key)
+            if entry is not None and products == previous.get(key):
+                if source == "crawl":
+                    stored[key] = dict(entry, crawled_at=now)
+                continue
+            utils.save_json(products, self.path(key))
+            categories = {}
+            for product in products:
+                category = product.get("category") or "Без категории"
+                categories[category] = categories.get(category, 0) + 1
+            stored[key] = {
+                "site": products[0].get("site_name") if products else key.split("/")[0] or None,
+                "file": os.path.basename(self.path(key)),
+                "version": (entry["version"] + 1) if entry else 1,
+                "count": len(products),
+                "categories": categories,
+                "updated_at": now,
+                "crawled_at": now if source == "crawl" else (entry or {}).get("crawled_at")
+            }
+            if self.by_category:
+                stored[key]["category"] = products[0].get("category") if products else key.split("/", 1)[1]
+            changed.append(key)
+
+        dropped = [key for key in stored if replace and key not in groups]
+        for key in dropped:
+            del stored[key]
+        changed.extend(dropped)
+
+        if changed or stored != manifest["partitions"]:
+            manifest = dict(manifest, partitions=stored, updated_at=now)
+            if changed or manifest["revision"] is None:
+                manifest["revision"] = f"{time.time_ns():x}"
+                manifest["revised_at"] = now
+            with utils.atomic_write(self.manifest_file) as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+        # Файлы удалённых партиций убираем после записи манифеста, который на них уже не ссылается
+        for key in dropped + orphaned:
+            for ext in ("json", "msgpack"):
+                try:
+                    os.unlink(self.path(key, ext))
+                except OSError:
+                    pass
+        return changed
@@ -0,0 +1,158 @@
+import zlib
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from parser import utils
+
+# Границы интервала обновления одной категории
+MIN_INTERVAL = timedelta(hours=6)
+MAX_INTERVAL = timedelta(days=7)
+DEFAULT_INTERVAL = timedelta(hours=24)
+# Доля изменившихся товаров, выше которой интервал сокращается вдвое
+HIGH_CHANGE_RATE = 0.10
+# ...и ниже которой интервал растёт в полтора раза
+LOW_CHANGE_RATE = 0.01
+# Разброс времени запуска внутри интервала, чтобы категории не совпадали
+STAGGER_FRACTION = 0.1
+# Сколько категорий одного хоста обновлять за один проход планировщика
+MAX_UNITS_PER_HOST = 2
+# Пауза перед повтором категории после неудачного обхода; удваивается
+# с каждой неудачей подряд, но не больше MAX_FAILURE_BACKOFF
+FAILURE_BACKOFF = timedelta(minutes=30)
+MAX_FAILURE_BACKOFF = timedelta(hours=24)
+
+
+def unit_key(site_name, category_name):
+    return f"{site_name}|{category_name}"
+
+
+def change_rate(old_items, new_items):
+    """Доля добавленных, удалённых и переоценённых товаров (по ссылке)"""
+    old_prices = {p.get("link"): p.get("price") for p in old_items}
+    new_prices = {p.get("link"): p.get("price") for p in new_items}
+    added = len(new_prices.keys() - old_prices.keys())
+    removed = len(old_prices.keys() - new_prices.keys())
+    repriced = sum(1 for link in new_prices.keys() & old_prices.keys() if new_prices[link] != old_prices[link])
+    total = len(old_prices.keys() | new_prices.keys())
+    return (added + removed + repriced) / total if total else 0.0
+
+
+class RefreshPlanner:
+    """
+    Планировщик обновления по парам (сайт, категория).
+    Интервал каждой категории подстраивается под наблюдаемую частоту
+    изменений цен и ассортимента в пределах MIN_INTERVAL..MAX_INTERVAL.
+    Состояние хранится в JSON-файле и общее для всех воркеров.
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+
+    def load(self):
+        state = utils.load_json(self.state_file)
+        return state if isinstance(state, dict) else {}
+
+    def _offset(self, key, interval):
+        # Детерминированный сдвиг по хешу ключа
+        fraction = (zlib.crc32(key.encode("utf-8")) % 1000) / 1000
+        return interval * STAGGER_FRACTION * fraction
+
+    def _next_due(self, key, last_crawled, interval):
+        return last_crawled + interval + self._offset(key, interval)
+
+    def due_units(self, units, last_parsed=None, now=None, limit_per_host=MAX_UNITS_PER_HOST):
+        """
+        Категории, которые пора обновить.
+        units — список (сайт, категория, url); не больше limit_per_host на хост,
+        сначала самые просроченные.
+        """
+        now = now or datetime.now()
+        state = self.load()
+        overdue = []
+        for site_name, category_name, url in units:
+            key = unit_key(site_name, category_name)
+            entry = state.get(key)
+            if entry:
+                next_due = datetime.fromisoformat(entry["next_due"])
+            elif last_parsed:
+                # Категория ещё не отслеживалась: считаем от последнего полного парсинга
+                next_due = self._next_due(key, last_parsed, DEFAULT_INTERVAL)
+            else:
+                next_due = now
+            if next_due <= now:
+                overdue.append((next_due, urlsplit(url).hostname or "", site_name, category_name))
+
+        overdue.sort()
+        per_host = {}
+        selected = []
+        for _, host, site_name, category_name in overdue:
+            if limit_per_host is not None and per_host.get(host, 0) >= limit_per_host:
+                continue
+            per_host[host] = per_host.get(host, 0) + 1
+            selected.append((site_name, category_name))
+        return selected
+
+    def record(self, results, now=None):
+        """
+        Учесть результаты парсинга.
+        results — список (сайт, категория, старые товары, новые товары).
+        """
+        now = now or datetime.now()
+        state = self.load()
+        for site_name, category_name, old_items, new_items in results:
+            key = unit_key(site_name, category_name)
+            entry = state.get(key, {})
+            interval = timedelta(seconds=entry.get("interval_seconds", DEFAULT_INTERVAL.total_seconds()))
+            # Первое наблюдение: сравнивать не с чем, интервал не меняем
+            rate = change_rate(old_items, new_items) if old_items else None
+
+            if rate is None:
+                pass
+            elif rate > HIGH_CHANGE_RATE:
+                interval = interval / 2
+            elif rate < LOW_CHANGE_RATE:
+                interval = interval * 1.5
+            interval = max(MIN_INTERVAL, min(MAX_INTERVAL, interval))
+
+            avg_rate = entry.get("avg_change_rate")
+            if rate is not None:
+                avg_rate = rate if avg_rate is None else avg_rate * 0.7 + rate * 0.3
+            state[key] = {
+                "site": site_name,
+                "category": category_name,
+                "interval_seconds": int(interval.total_seconds()),
+                "last_crawled": now.isoformat(),
+                "next_due": self._next_due(key, now, interval).isoformat(),
+                "last_change_rate": round(rate, 4) if rate is not None else None,
+                "avg_change_rate": round(avg_rate, 4) if avg_rate is not None else None,
+                "products": len(new_items)
+            }
+        utils.save_json(state, self.state_file)
+
+    def record_failures(self, failures, now=None):
+        """
+        Учесть неудачные обходы: failures — список (сайт, категория, ошибка).
+        Интервал категории не меняется, следующий срок отодвигается на паузу,
+        которая растёт с каждой неудачей подряд (успешный обход её сбрасывает).
+        """
+        if not failures:
+            return
+        now = now or datetime.now()
+        state = self.load()
+        for site_name, category_name, error in failures:
+            key = unit_key(site_name, category_name)
+            entry = dict(state.get(key) or {
+                "site": site_name,
+                "category": category_name,
+                "interval_seconds": int(DEFAULT_INTERVAL.total_seconds())
+            })
+            count = entry.get("failures", 0) + 1
+            backoff = min(MAX_FAILURE_BACKOFF, FAILURE_BACKOFF * 2 ** (count - 1))
+            entry.update({
+                "failures": count,
+                "last_error": error,
+                "last_failed": now.isoformat(),
+                "next_due": (now + backoff).isoformat()
+            })
+            state[key] = entry
+        utils.save_json(state, self.state_file)
@@ -0,0 +1,168 @@
+import bisect
+import math
+import time
+
+import numpy as np
+
+import analytics
+import text
+
+# Параметры BM25 (в заголовке каждый терм почти всегда встречается один раз)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Вес совпадения только по префиксу (набираемое слово) относительно точного
+PREFIX_WEIGHT = 0.6
+# Бонус, если первое слово запроса совпало с первым словом заголовка («Диван …»)
+FIRST_TERM_BONUS = 0.5
+# Не разворачиваем префикс больше чем в столько термов словаря
+MAX_PREFIX_TERMS = 200
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс по заголовкам товаров (ProductTable).
+    Строится один раз на версию данных и дальше не меняется,
+    поэтому запросы читают его без блокировок.
+    """
+
+    def __init__(self, table, version=None):
+        started = time.perf_counter()
+        self.version = version
+        self.table = table
+
+        postings = {}
+        lengths = np.zeros(len(table), dtype=np.int32)
+        first_terms = []
+        for doc, title in enumerate(table.column("title")):
+            doc_terms = text.terms(title if isinstance(title, str) else "")
+            lengths[doc] = len(doc_terms)
+            first_terms.append(doc_terms[0] if doc_terms else "")
+            for term in set(doc_terms):
+                postings.setdefault(term, []).append(doc)
+
+        # Списки документов идут по возрастанию — intersect1d/isin работают без сортировки
+        self.postings = {term: np.array(docs, dtype=np.int32) for term, docs in postings.items()}
+        self.vocabulary = sorted(self.postings)
+        self.lengths = lengths
+        self.avg_length = float(lengths.mean()) if len(lengths) else 0.0
+        self.first_term, self.first_terms = analytics.encode(first_terms)
+        self.category, self.categories = table.recode("category", "Без категории")
+        self.site, self.sites = table.recode("site_name", "Неизвестно")
+        self.price = table.price
+        self.build_seconds = round(time.perf_counter() - started, 3)
+
+    def idf(self, df):
+        n = len(self.table)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def prefix_terms(self, prefix):
+        """Термы словаря, начинающиеся с prefix (не больше MAX_PREFIX_TERMS)"""
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        result = []
+        for term in self.vocabulary[start:start + MAX_PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            result.append(term)
+        return result
+
+    def parse_query(self, query, prefix=True):
+        """
+        Запрос -> группы термов; каждая группа должна совпасть (логическое И).
+        Последнее слово при prefix=True ищется и как префикс (подсказки при наборе).
+        """
+        folded = text.fold(query)
+        words = text.TOKEN_RE.findall(text.DIMENSIONS_RE.sub(" ", folded))
+        typing = prefix and words and not folded[-1:].isspace()
+        groups = []
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            exact = word if text.is_model_code(word) or word.isdigit() else text.stem(word)
+            if len(word) < 2 and not (last and typing):
+                continue
+            groups.append({
+                "exact": exact,
+                "prefix": word if last and typing else None
+            })
+        for dims in text.dimensions(query):
+            groups.append({"exact": dims, "prefix": None})
+        return groups
+
+    def _group_docs(self, group):
+        exact = self.postings.get(group["exact"], _EMPTY)
+        if not group["prefix"]:
+            return exact, exact
+        expanded = [self.postings[term] for term in self.prefix_terms(group["prefix"])]
+        if not expanded:
+            return exact, exact
+        # Объединение через битовую маску: без сортировки, O(числа товаров)
+        mask = np.zeros(len(self.table), dtype=bool)
+        mask[exact] = True
+        for docs in expanded:
+            mask[docs] = True
+        return np.flatnonzero(mask).astype(np.int32), exact
+
+    def search(self, query, category=None, site=None, limit=20, offset=0, prefix=True):
+        started = time.perf_counter()
+        groups = self.parse_query(query, prefix)
+        if not groups:
+            return None
+
+        matched = None
+        scored = []
+        for group in groups:
+            docs, exact = self._group_docs(group)
+            matched = docs if matched is None else np.intersect1d(matched, docs, assume_unique=True)
+            scored.append((group, exact, self.idf(len(docs))))
+            if not len(matched):
+                break
+
+        # Фасеты: каждая считается с учётом фильтра по другому измерению
+        in_category = np.ones(len(matched), dtype=bool)
+        in_site = np.ones(len(matched), dtype=bool)
+        if category is not None:
+            code = self.categories.index(category) if category in self.categories else -1
+            in_category = self.category[matched] == code
+        if site is not None:
+            code = self.sites.index(site) if site in self.sites else -1
+            in_site = self.site[matched] == code
+        facets = {
+            "category": self._facet(self.category[matched[in_site]], self.categories),
+            "site": self._facet(self.site[matched[in_category]], self.sites)
+        }
+        docs = matched[in_category & in_site]
+
+        # BM25 с tf=1: короткие заголовки с нужными словами выше длинных
+        norm = 1 - BM25_B + BM25_B * self.lengths[docs] / (self.avg_length or 1)
+        saturation = (BM25_K1 + 1) / (1 + BM25_K1 * norm)
+        scores = np.zeros(len(docs))
+        for group, exact, idf in scored:
+            weight = np.where(np.isin(docs, exact, assume_unique=True), 1.0, PREFIX_WEIGHT)
+            scores += idf * weight * saturation
+        first = scored[0][0]
+        first_codes = [
+            i for i, term in enumerate(self.first_terms)
+            if term == first["exact"] or (first["prefix"] and term.startswith(first["prefix"]))
+        ]
+        scores += FIRST_TERM_BONUS * np.isin(self.first_term[docs], first_codes)
+
+        # При равном релевансе — дешевле выше
+        order = np.lexsort((self.price[docs], -scores))[offset:offset + limit]
+        results = [dict(self.table.to_dict(int(docs[i])), score=round(float(scores[i]), 3)) for i in order]
+
+        return {
+            "query": query,
+            "total": int(len(docs)),
+            "results": results,
+            "facets": facets,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    @staticmethod
+    def _facet(codes, names):
+        counts = np.bincount(codes, minlength=len(names))
+        return [
+            {"name": names[i], "count": int(counts[i])}
+            for i in np.argsort(-counts, kind="stable") if counts[i] > 0
+        ]
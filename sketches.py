@@ -0,0 +1,208 @@
+import math
+from datetime import datetime
+
+from parser import utils
+
+# Точность KLL: ошибка ранга порядка 1/K (K=200 — около 1%)
+DEFAULT_K = 200
+# Процентили, которые отдаёт API
+SUMMARY_QUANTILES = {"p10": 0.10, "p25": 0.25, "median": 0.50, "p75": 0.75, "p90": 0.90}
+
+
+class KLLSketch:
+    """
+    Потоковый квантильный скетч KLL (Karnin–Lang–Liberty).
+    Память O(K), объединяется с другими скетчами без потери гарантий:
+    скетч рынка = merge скетчей сайтов, скетч истории = merge всех парсингов.
+    """
+
+    def __init__(self, k=DEFAULT_K):
+        self.k = k
+        self.n = 0
+        self.min = None
+        self.max = None
+        # levels[h] — элементы с весом 2**h
+        self.levels = [[]]
+        # Чередуем чётные/нечётные элементы при сжатии, чтобы не смещать оценку
+        self._flip = 0
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def _max_size(self):
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _size(self):
+        return sum(len(level) for level in self.levels)
+
+    def update(self, value):
+        self.levels[0].append(value)
+        self.n += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def extend(self, values):
+        for value in values:
+            self.update(value)
+        return self
+
+    def _compress(self):
+        while self._size() >= self._max_size():
+            for h, level in enumerate(self.levels):
+                if len(level) < self._capacity(h):
+                    continue
+                if h + 1 == len(self.levels):
+                    self.levels.append([])
+                level.sort()
+                # Нечётный элемент остаётся на своём уровне
+                keep = [level.pop()] if len(level) % 2 else []
+                self.levels[h + 1].extend(level[self._flip::2])
+                self._flip ^= 1
+                self.levels[h] = keep
+                break
+            else:
+                break
+
+    def merge(self, other):
+        """Добавить в скетч все наблюдения другого скетча"""
+        if other.n == 0:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, level in enumerate(other.levels):
+            self.levels[h].extend(level)
+        self.n += other.n
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """Оценка q-квантиля (0 ≤ q ≤ 1); None для пустого скетча"""
+        if self.n == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        weighted = sorted((value, 1 << h) for h, level in enumerate(self.levels) for value in level)
+        total = sum(weight for _, weight in weighted)
+        target = q * total
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen >= target:
+                return value
+        return self.max
+
+    def summary(self):
+        result = {"count": self.n, "min": self.min, "max": self.max}
+        for name, q in SUMMARY_QUANTILES.items():
+            result[name] = self.quantile(q)
+        result["iqr"] = result["p75"] - result["p25"] if self.n else None
+        return result
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "min": self.min, "max": self.max, "levels": self.levels}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data.get("k", DEFAULT_K))
+        sketch.n = data.get("n", 0)
+        sketch.min = data.get("min")
+        sketch.max = data.get("max")
+        sketch.levels = [list(level) for level in data.get("levels", [[]])] or [[]]
+        return sketch
+
+
+def key(category, site_name):
+    return f"{category}|{site_name}"
+
+
+def split_key(value):
+    category, _, site_name = value.rpartition("|")
+    return category, site_name
+
+
+def sketch_prices(items):
+    """Скетч по ценам товаров (товары без цены пропускаются)"""
+    sketch = KLLSketch()
+    for item in items:
+        price = item.get("price")
+        if isinstance(price, (int, float)) and price > 0:
+            sketch.update(price)
+    return sketch
+
+
+class SketchStore:
+    """
+    Скетчи цен по (категория, сайт), хранятся в JSON-файле:
+      current — по последнему парсингу каждой категории;
+      history — все наблюдения за всё время.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        data = utils.load_json(self.filename)
+        if not isinstance(data, dict):
+            data = {}
+        return {
+            scope: {k: KLLSketch.from_dict(v) for k, v in data.get(scope, {}).items()}
+            for scope in ("current", "history")
+        }
+
+    def save(self, sketches):
+        utils.save_json({
+            "updated": datetime.now().isoformat(),
+            "current": {k: s.to_dict() for k, s in sketches["current"].items()},
+            "history": {k: s.to_dict() for k, s in sketches["history"].items()}
+        }, self.filename)
+
+    def record(self, units, replace_all=False):
+        """
+        Учесть свежие скетчи: units — {(категория, сайт): KLLSketch}.
+        replace_all — полный парсинг: текущие скетчи остальных категорий удаляются.
+        """
+        sketches = self.load()
+        if replace_all:
+            sketches["current"] = {}
+        for (category, site_name), sketch in units.items():
+            k = key(category, site_name)
+            sketches["current"][k] = sketch
+            history = sketches["history"].get(k) or KLLSketch()
+            sketches["history"][k] = history.merge(sketch)
+        self.save(sketches)
+
+    def rebuild_current(self, products):
+        """Пересчитать текущие скетчи по полному списку товаров (например, после импорта)"""
+        grouped = {}
+        for product in products:
+            grouped.setdefault((product.get("category", "Без категории"), product.get("site_name", "Неизвестно")), []).append(product)
+        sketches = self.load()
+        sketches["current"] = {key(*unit): sketch_prices(items) for unit, items in grouped.items()}
+        self.save(sketches)
+
+    def summary(self, scope="current", category=None, site_name=None):
+        """Квантили по категориям: по каждому сайту и по рынку в целом (merge)"""
+        sketches = self.load().get(scope, {})
+        categories = {}
+        for k, sketch in sketches.items():
+            cat, site = split_key(k)
+            if category is not None and cat != category:
+                continue
+            if site_name is not None and site != site_name:
+                continue
+            entry = categories.setdefault(cat, {"category": cat, "market": KLLSketch(), "sites": {}})
+            entry["market"].merge(sketch)
+            entry["sites"][site] = sketch.summary()
+        result = []
+        for entry in categories.values():
+            entry["market"] = entry["market"].summary()
+            result.append(entry)
+        result.sort(key=lambda x: x["market"]["count"], reverse=True)
+        return result
@@ -0,0 +1,415 @@
+import json
+
+import numpy as np
+
+import analytics
+from parser import utils
+
+# Поля товара в порядке, в котором их пишут парсеры
+FIELDS = ("title", "price", "link", "image", "category_url", "site", "category", "site_name")
+# Поля с небольшим числом различных значений хранятся словарным кодированием
+ENCODED_FIELDS = ("category_url", "site", "category", "site_name")
+# Уникальные для каждого товара строки
+TEXT_FIELDS = ("title", "link", "image")
+# Версия формата бинарного снимка таблицы
+SNAPSHOT_FORMAT = 2
+# Ключ метаданных Arrow-снимка с версией исходного JSON
+ARROW_SOURCE_KEY = b"products_source"
+
+
+class _Missing:
+    """Метка отсутствующего поля (в отличие от null в JSON)"""
+
+    def __repr__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+def _is_price(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ProductRow:
+    """Лёгкое представление строки таблицы с интерфейсом словаря (только чтение)"""
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def get(self, field, default=None):
+        value = self._table.value(field, self._index)
+        return default if value is MISSING else value
+
+    def __getitem__(self, field):
+        value = self._table.value(field, self._index)
+        if value is MISSING:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return self._table.value(field, self._index) is not MISSING
+
+    def to_dict(self):
+        return self._table.to_dict(self._index)
+
+    def __repr__(self):
+        return f"ProductRow({self.to_dict()!r})"
+
+
+class ProductTable:
+    """
+    Колоночное хранение товаров: строки с повторяющимися значениями
+    (сайт, категория, URL категории) — коды int32 и словарь значений,
+    цены — массив NumPy, заголовки/ссылки/картинки — обычные списки.
+    Нестандартные поля и нечисловые цены хранятся отдельно, а при смеси
+    целых и дробных цен int_prices отмечает целые, поэтому to_dicts()
+    возвращает товары без потерь.
+    """
+
+    def __init__(self, size, strings, codes, values, price, raw_prices, extras, int_prices=None):
+        self.size = size
+        self.strings = strings
+        self.codes = codes
+        self.values = values
+        self.price = price
+        self.raw_prices = raw_prices
+        self.extras = extras
+        # Какие цены в массиве float64 были целыми (None — отмечать нечего)
+        self.int_prices = int_prices
+        self._price_table = None
+
+    @classmethod
+    def from_products(cls, products):
+        size = len(products)
+        strings = {field: [p.get(field, MISSING) for p in products] for field in TEXT_FIELDS}
+        codes, values = {}, {}
+        for field in ENCODED_FIELDS:
+            codes[field], values[field] = analytics.encode([p.get(field, MISSING) for p in products])
+
+        raw = [p.get("price", MISSING) for p in products]
+        raw_prices = {i: v for i, v in enumerate(raw) if not _is_price(v)}
+        price = np.array([0 if i in raw_prices else v for i, v in enumerate(raw)] if raw_prices else raw)
+        if price.dtype.kind not in "if":
+            price = price.astype(np.int64)
+        int_prices = None
+        if price.dtype.kind == "f":
+            int_prices = np.fromiter((_is_price(v) and not isinstance(v, float) for v in raw), dtype=bool, count=size)
+            if not int_prices.any():
+                int_prices = None
+
+        extras = {}
+        for i, p in enumerate(products):
+            if len(p) > len(FIELDS) or any(field not in FIELDS for field in p):
+                extra = {k: v for k, v in p.items() if k not in FIELDS}
+                if extra:
+                    extras[i] = extra
+        return cls(size, strings, codes, values, price, raw_prices, extras, int_prices)
+
+    @classmethod
+    def concat(cls, tables):
+        """Одна таблица из нескольких (партиций): словари кодированных полей объединяются"""
+        # Пустые таблицы пропускаем: их цены float64 и превратили бы целые цены в дробные
+        tables = [table for table in tables if table.size]
+        if not tables:
+            return cls.from_products([])
+        if len(tables) == 1:
+            return tables[0]
+
+        strings = {field: [] for field in TEXT_FIELDS}
+        for table in tables:
+            for field in TEXT_FIELDS:
+                strings[field].extend(table.strings[field])
+
+        codes, values = {}, {}
+        for field in ENCODED_FIELDS:
+            index = {}
+            parts = []
+            for table in tables:
+                remap = np.fromiter(
+                    (index.setdefault(v, len(index)) for v in table.values[field]),
+                    dtype=np.int32, count=len(table.values[field])
+                )
+                parts.append(remap[table.codes[field]])
+            codes[field] = np.concatenate(parts)
+            values[field] = list(index)
+
+        raw_prices, extras = {}, {}
+        offset = 0
+        for table in tables:
+            raw_prices.update((offset + i, v) for i, v in table.raw_prices.items())
+            extras.update((offset + i, extra) for i, extra in table.extras.items())
+            offset += table.size
+        price = np.concatenate([table.price for table in tables])
+        int_prices = None
+        if price.dtype.kind == "f":
+            # Целочисленные партиции при объединении с дробными становятся float64 — запоминаем их
+            int_prices = np.concatenate([
+                table.int_prices if table.int_prices is not None
+                else np.full(table.size, table.price.dtype.kind == "i")
+                for table in tables
+            ])
+            if not int_prices.any():
+                int_prices = None
+        return cls(offset, strings, codes, values, price, raw_prices, extras, int_prices)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (ProductRow(self, i) for i in range(self.size))
+
+    def row(self, index):
+        return ProductRow(self, index)
+
+    def value(self, field, index):
+        if field in self.strings:
+            return self.strings[field][index]
+        if field in self.codes:
+            return self.values[field][self.codes[field][index]]
+        if field == "price":
+            if index in self.raw_prices:
+                return self.raw_prices[index]
+            if self.int_prices is not None and self.int_prices[index]:
+                return int(self.price[index])
+            return self.price[index].item()
+        return self.extras.get(index, {}).get(field, MISSING)
+
+    def to_dict(self, index):
+        product = {}
+        for field in FIELDS:
+            value = self.value(field, index)
+            if value is not MISSING:
+                product[field] = value
+        if index in self.extras:
+            product.update(self.extras[index])
+        return product
+
+    def to_dicts(self, indices=None):
+        """Товары в виде словарей (все или по списку индексов)"""
+        if indices is None:
+            indices = range(self.size)
+        # Колонки разворачиваем один раз, а не через value() для каждой ячейки
+        columns = [(field, self.column(field)) for field in FIELDS]
+        result = []
+        for i in indices:
+            product = {field: column[i] for field, column in columns if column[i] is not MISSING}
+            if i in self.extras:
+                product.update(self.extras[i])
+            result.append(product)
+        return result
+
+    def column(self, field):
+        """Значения поля по всем строкам (MISSING для отсутствующих)"""
+        if field in self.strings:
+            return self.strings[field]
+        if field in self.codes:
+            values = self.values[field]
+            return [values[code] for code in self.codes[field].tolist()]
+        if field == "price":
+            prices = self.price.tolist()
+            if self.int_prices is not None:
+                for i in np.flatnonzero(self.int_prices).tolist():
+                    prices[i] = int(prices[i])
+            for i, value in self.raw_prices.items():
+                prices[i] = value
+            return prices
+        return [self.extras.get(i, {}).get(field, MISSING) for i in range(self.size)]
+
+    def where(self, field, value):
+        """Индексы строк, где кодированное поле равно value"""
+        values = self.values[field]
+        if value not in values:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.codes[field] == values.index(value))
+
+    def priced(self):
+        """Цены товаров с числовой ценой"""
+        if not self.raw_prices:
+            return self.price
+        mask = np.ones(self.size, dtype=bool)
+        mask[list(self.raw_prices)] = False
+        return self.price[mask]
+
+    def to_columns(self):
+        """Колонки для табличных отчётов: {поле: значения}, отсутствующие — None"""
+        columns = {}
+        for field in list(FIELDS) + sorted({k for extra in self.extras.values() for k in extra}):
+            values = [None if v is MISSING else v for v in self.column(field)]
+            if any(v is not None for v in values):
+                columns[field] = values
+        return columns
+
+    def recode(self, field, default):
+        """Коды поля с подстановкой default вместо отсутствующего значения"""
+        values = [default if v is MISSING else v for v in self.values[field]]
+        remap, unique = analytics.encode(values)
+        return remap[self.codes[field]], unique
+
+    def price_table(self):
+        """PriceTable для аналитики без повторного разбора товаров"""
+        if self._price_table is None:
+            category, categories = self.recode("category", "Без категории")
+            site, sites = self.recode("site_name", None)
+            self._price_table = analytics.PriceTable(category, site, self.price, categories, sites)
+        return self._price_table
+
+    def to_snapshot(self):
+        """Таблица в виде словаря для msgpack: колонки кодов и цен — сырые байты"""
+        def plain(values):
+            return [None if v is MISSING else v for v in values]
+
+        def missing(values):
+            return [i for i, v in enumerate(values) if v is MISSING]
+
+        return {
+            "size": self.size,
+            "strings": {f: plain(col) for f, col in self.strings.items()},
+            "missing_strings": {f: missing(col) for f, col in self.strings.items()},
+            "values": {f: plain(vals) for f, vals in self.values.items()},
+            "missing_values": {f: missing(vals) for f, vals in self.values.items()},
+            "codes": {f: codes.astype(np.int32).tobytes() for f, codes in self.codes.items()},
+            "price": self.price.tobytes(),
+            "price_dtype": self.price.dtype.str,
+            "int_prices": self.int_prices.tobytes() if self.int_prices is not None else None,
+            "raw_prices": [[i, v] for i, v in self.raw_prices.items() if v is not MISSING],
+            "missing_prices": [i for i, v in self.raw_prices.items() if v is MISSING],
+            "extras": [[i, extra] for i, extra in self.extras.items()]
+        }
+
+    @classmethod
+    def from_snapshot(cls, data):
+        def restore(values, missing):
+            for i in missing:
+                values[i] = MISSING
+            return values
+
+        strings = {f: restore(col, data["missing_strings"][f]) for f, col in data["strings"].items()}
+        values = {f: restore(vals, data["missing_values"][f]) for f, vals in data["values"].items()}
+        codes = {f: np.frombuffer(raw, dtype=np.int32) for f, raw in data["codes"].items()}
+        price = np.frombuffer(data["price"], dtype=np.dtype(data["price_dtype"]))
+        int_prices = np.frombuffer(data["int_prices"], dtype=bool) if data["int_prices"] is not None else None
+        raw_prices = {i: v for i, v in data["raw_prices"]}
+        raw_prices.update((i, MISSING) for i in data["missing_prices"])
+        extras = {i: extra for i, extra in data["extras"]}
+        return cls(data["size"], strings, codes, values, price, raw_prices, extras, int_prices)
+
+
+def write_snapshot(table, filename, source):
+    """
+    Сохранить бинарный снимок таблицы (msgpack) с версией исходного JSON.
+    Без установленного msgpack снимок не пишется — читаем JSON как раньше.
+    """
+    try:
+        import msgpack
+    except ImportError:
+        return False
+    try:
+        with utils.atomic_write(filename, "wb") as f:
+            msgpack.pack({"format": SNAPSHOT_FORMAT, "source": source, "table": table.to_snapshot()}, f)
+        return True
+    except (TypeError, ValueError, OverflowError, OSError) as e:
+        print(f"Не удалось сохранить снимок товаров: {e}")
+        return False
+
+
+def read_snapshot(filename, source):
+    """Таблица из снимка, если он есть и сделан из той же версии JSON; иначе None"""
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    try:
+        with open(filename, "rb") as f:
+            data = msgpack.unpack(f, strict_map_key=False)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, msgpack.UnpackException) as e:
+        print(f"Снимок товаров повреждён, читаем JSON: {e}")
+        return None
+    if not isinstance(data, dict) or data.get("format") != SNAPSHOT_FORMAT or data.get("source") != source:
+        return None
+    try:
+        return ProductTable.from_snapshot(data["table"])
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Снимок товаров повреждён, читаем JSON: {e}")
+        return None
+
+
+def _arrow_text(value):
+    if value is MISSING or value is None:
+        return None
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def to_arrow(table, source=None):
+    """
+    Таблица Arrow: кодированные поля — dictionary-колонки (те же коды int32),
+    цена — int64/float64 с null для нечисловых, отсутствующие значения — null.
+    Нестандартные поля товаров в снимок не попадают.
+    """
+    import pyarrow as pa
+
+    columns = []
+    for field in FIELDS:
+        if field in table.codes:
+            values = table.values[field]
+            keep = [i for i, v in enumerate(values) if _arrow_text(v) is not None]
+            remap = np.full(len(values), -1, dtype=np.int32)
+            remap[keep] = np.arange(len(keep), dtype=np.int32)
+            indices = remap[table.codes[field]]
+            columns.append(pa.DictionaryArray.from_arrays(
+                pa.array(indices, mask=indices < 0),
+                pa.array([_arrow_text(values[i]) for i in keep], type=pa.string())
+            ))
+        elif field == "price":
+            mask = np.zeros(table.size, dtype=bool)
+            mask[list(table.raw_prices)] = True
+            columns.append(pa.array(table.price, mask=mask))
+        else:
+            columns.append(pa.array([_arrow_text(v) for v in table.strings[field]], type=pa.string()))
+    metadata = {ARROW_SOURCE_KEY: json.dumps(source)} if source is not None else None
+    return pa.Table.from_arrays(columns, names=list(FIELDS), metadata=metadata)
+
+
+def write_arrow(table, filename, source):
+    """
+    Сохранить Arrow IPC (Feather v2) снимок без сжатия — его можно читать через mmap.
+    Без pyarrow или при ошибке записи снимок не пишется (возвращается False).
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return False
+    try:
+        arrow = to_arrow(table, source)
+        with utils.atomic_write(filename, "wb") as f:
+            with pa.ipc.new_file(f, arrow.schema) as writer:
+                writer.write_table(arrow)
+        return True
+    except (pa.ArrowException, TypeError, ValueError, OverflowError, OSError) as e:
+        print(f"Не удалось сохранить Arrow-снимок: {e}")
+        return False
+
+
+def read_arrow(filename, source):
+    """
+    Arrow-снимок через memory map (без копирования в память процесса),
+    если он сделан из той же версии JSON; иначе None (и без pyarrow).
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(filename, "r"))
+    except (OSError, pa.ArrowInvalid):
+        return None
+    metadata = reader.schema.metadata or {}
+    if metadata.get(ARROW_SOURCE_KEY) != json.dumps(source).encode("utf-8"):
+        return None
+    return reader.read_all()
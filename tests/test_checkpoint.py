@@ -0,0 +1,17 @@
+from parser.checkpoint import CrawlCheckpoint
+
+
+def test_source_and_reset_survive_reload(tmp_path):
+    filename = str(tmp_path / "checkpoint.jsonl")
+    checkpoint = CrawlCheckpoint.open(filename)
+    checkpoint.record_page("A", "Диваны", 1, [{"link": "a1"}], "html")
+    checkpoint.record_page("A", "Столы", 1, [{"link": "s1"}], "html")
+    checkpoint.reset("A", "Столы")
+    checkpoint.record_page("A", "Столы", 1, [{"link": "s2"}], "api")
+    checkpoint.close()
+
+    resumed = CrawlCheckpoint.open(filename)
+    assert resumed.resumed
+    assert resumed.get("A", "Диваны") == {"page": 1, "items": [{"link": "a1"}], "source": "html", "done": False}
+    assert resumed.get("A", "Столы") == {"page": 1, "items": [{"link": "s2"}], "source": "api", "done": False}
+    resumed.close()
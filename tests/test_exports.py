@@ -0,0 +1,36 @@
+import os
+
+from exports import ArtifactCache
+
+
+def write(cache, version, data):
+    return b"".join(cache.stream("products", version, "json", iter([data])))
+
+
+def test_newer_version_prunes_older(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    write(cache, "100", b"old")
+    write(cache, "200", b"new")
+
+    assert cache.get("products", "100", "json") is None
+    assert cache.get("products", "200", "json") is not None
+
+
+def test_late_older_version_keeps_newer(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    write(cache, "200", b"new")
+    # Запрос по старой версии дописал выгрузку позже
+    write(cache, "100", b"old")
+
+    path = cache.get("products", "200", "json")
+    assert path is not None
+    with open(path, "rb") as f:
+        assert f.read() == b"new"
+
+
+def test_other_reports_are_kept(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    cache.build("stats", "100", "csv", lambda f: f.write(b"stats"))
+    write(cache, "200", b"new")
+
+    assert sorted(os.listdir(tmp_path)) == ["products-200.json", "stats-100.csv"]
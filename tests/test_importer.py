@@ -0,0 +1,69 @@
+import io
+import json
+
+import pytest
+
+import importer
+from importer import ImportFormatError, iter_json_array
+
+
+class CountingStream(io.StringIO):
+    """StringIO, запоминающий, сколько символов из него прочитано"""
+
+    def __init__(self, text):
+        super().__init__(text)
+        self.consumed = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.consumed += len(data)
+        return data
+
+
+def parse(text):
+    return [value for _, value in iter_json_array(io.StringIO(text))]
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 64])
+def test_elements_split_across_chunks(monkeypatch, read_size):
+    monkeypatch.setattr(importer, "READ_SIZE", read_size)
+    items = [
+        {"title": "Диван «Осло»", "price": 12345, "link": "https://a/1"},
+        {"title": "Стол \"X\" \\ 2", "price": 1.5e3, "tags": [True, False, None]},
+        123456789, -0.25, "строка", [], {}
+    ]
+    text = "[\n" + ",\n".join(json.dumps(item, ensure_ascii=False) for item in items) + "\n]"
+
+    assert parse(text) == items
+
+
+@pytest.mark.parametrize("empty", ["[]", "[ ]", "  [\n\n]\n"])
+def test_empty_array(empty):
+    assert parse(empty) == []
+
+
+def test_trailing_comma():
+    with pytest.raises(ImportFormatError, match="лишняя запятая"):
+        parse('[{"a": 1}, {"a": 2},]')
+
+
+@pytest.mark.parametrize("broken", ['{"a": tru, "b": 1}', '{"a": 1 "b": 2}', '{"a": [1, 2}'])
+def test_malformed_middle_element_fails_fast(monkeypatch, broken):
+    monkeypatch.setattr(importer, "READ_SIZE", 64)
+    tail = ",\n".join(json.dumps({"title": "x" * 50, "n": i}) for i in range(10000))
+    stream = CountingStream('[{"a": 0},\n' + broken + ",\n" + tail + "\n]")
+
+    with pytest.raises(ImportFormatError, match="элемент 1"):
+        list(iter_json_array(stream))
+    # Остаток файла не дочитывается
+    assert stream.consumed < 1024
+
+
+def test_unterminated_element_is_capped(monkeypatch):
+    monkeypatch.setattr(importer, "READ_SIZE", 64)
+    monkeypatch.setattr(importer, "MAX_ELEMENT_SIZE", 4096)
+    stream = CountingStream('[{"title": "' + "x" * 100000 + "\n")
+
+    with pytest.raises(ImportFormatError, match="элемент 0 больше"):
+        list(iter_json_array(stream))
+    assert stream.consumed < 3 * 4096
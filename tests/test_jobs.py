@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobManager
+
+ALL_UNITS = [("A", "Диваны"), ("A", "Столы"), ("B", "Диваны")]
+
+
+class Runner:
+    """Парсинг, который ждёт команды release и запоминает свои вызовы"""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def __call__(self, force, job, units):
+        self.calls.append((force, units))
+        self.release.wait(5)
+        return {"status": "success", "count": 0}
+
+
+def wait_finished(manager, job_id):
+    deadline = time.monotonic() + 5
+    while not manager.get(job_id).finished:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture(autouse=True)
+def fast_queue(monkeypatch):
+    monkeypatch.setattr(jobs, "QUEUE_POLL_SECONDS", 0.01)
+
+
+def test_covered_request_merges(tmp_path):
+    runner = Runner()
+    manager = JobManager(runner, lambda: ALL_UNITS, state_dir=str(tmp_path))
+    job, merged = manager.submit(force=True)
+    same, merged_again = manager.submit(force=False, units=[("A", "Диваны")])
+
+    assert (merged, merged_again) == (False, True)
+    assert same is job and job.requests == 2
+    runner.release.set()
+    wait_finished(manager, job.id)
+    assert len(runner.calls) == 1
+
+
+def test_full_crawl_is_queued_behind_partial_refresh(tmp_path):
+    runner = Runner()
+    manager = JobManager(runner, lambda: ALL_UNITS, state_dir=str(tmp_path))
+    partial, _ = manager.submit(force=False, units=[("A", "Диваны")])
+    full, merged = manager.submit(force=True)
+    # Следующий запрос, который очередь не покрывает, расширяет её
+    queued, merged_into_queue = manager.submit(force=False, units=[("B", "Диваны")])
+
+    assert full is not partial and not merged
+    assert queued is full and merged_into_queue
+    assert full.status == "queued"
+    runner.release.set()
+    wait_finished(manager, full.id)
+    assert runner.calls == [(False, [("A", "Диваны")]), (True, None)]
+
+
+def test_job_of_another_worker_is_merged(tmp_path):
+    runner = Runner()
+    worker_a = JobManager(runner, lambda: ALL_UNITS, state_dir=str(tmp_path))
+    worker_b = JobManager(runner, lambda: ALL_UNITS, state_dir=str(tmp_path))
+    job, _ = worker_a.submit(force=False, units=[("A", "Диваны"), ("B", "Диваны")])
+    # Воркер B видит задачу A по файлу состояния
+    while worker_b.active() is None:
+        time.sleep(0.01)
+
+    seen, merged = worker_b.submit(force=False, units=[("B", "Диваны")])
+    assert merged and seen.id == job.id
+    assert worker_b.active().id == job.id
+
+    # Не покрытый запрос ждёт задачу другого воркера, а не упирается в её блокировку
+    full, merged = worker_b.submit(force=True)
+    assert not merged
+    time.sleep(0.1)
+    assert full.status == "queued"
+    runner.release.set()
+    wait_finished(worker_b, full.id)
+    assert runner.calls == [(False, [("A", "Диваны"), ("B", "Диваны")]), (True, None)]
+
+
+def test_cancelled_job_is_not_merged_into(tmp_path):
+    runner = Runner()
+    manager = JobManager(runner, lambda: ALL_UNITS, state_dir=str(tmp_path))
+    job, _ = manager.submit(force=True)
+    manager.cancel(job.id)
+    next_job, merged = manager.submit(force=True)
+
+    assert not merged and next_job is not job
+    runner.release.set()
+    wait_finished(manager, next_job.id)
+    assert len(runner.calls) == 2
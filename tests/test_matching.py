@@ -0,0 +1,110 @@
+import matching
+from matching import ProductMatcher
+
+
+def product(site, i, title):
+    return {"link": f"https://{site}.test/{i}", "title": title, "site_name": site, "price": 100 + i, "category": "Диваны"}
+
+
+def test_matches_across_sites():
+    matcher = ProductMatcher()
+    matcher.sync([
+        product("a", 1, "Диван угловой Верона 250x160"),
+        product("b", 1, "Угловой диван «Верона» 250x160"),
+        product("b", 2, "Кровать Мария 160x200")
+    ])
+    assert [m["link"] for m in matcher.matches("https://a.test/1")] == ["https://b.test/1"]
+    assert matcher.matches("https://b.test/2") == []
+
+
+def test_oversized_buckets_still_match_near_identical_titles():
+    # Сотни одинаковых заголовков раньше переполняли корзины всех полос LSH
+    count = matching.MAX_BUCKET * 3
+    products = [product("a", i, "Стул офисный Бюрократ") for i in range(count)]
+    products += [product("b", i, "Стул офисный Бюрократ") for i in range(count)]
+    products.append(product("c", 0, "Офисный стул Бюрократ черный"))
+    matcher = ProductMatcher()
+    matcher.sync(products)
+
+    # В корзинах — различные наборы признаков, а не товары
+    assert max(len(b) for b in matcher.buckets[0].values()) <= 2
+    groups = matcher.groups()
+    assert len(groups) == 1
+    assert groups[0]["sites"] == ["a", "b", "c"]
+    assert len(groups[0]["products"]) == 2 * count + 1
+
+
+def test_incremental_sync_removes_stale_entries():
+    matcher = ProductMatcher()
+    products = [product("a", 1, "Шкаф купе Лайт 180"), product("b", 1, "Шкаф-купе Лайт 180")]
+    matcher.sync(products, version=1)
+    assert len(matcher.groups()) == 1
+
+    matcher.sync(products[:1], version=2)
+    assert matcher.groups() == []
+    assert matcher.matches("https://a.test/1") == []
+    assert matcher.exact == {frozenset(matching.title_features("Шкаф купе Лайт 180")): {"a": {"https://a.test/1": None}}}
+
+
+def test_crowded_bucket_is_split_by_band_pairs(monkeypatch):
+    monkeypatch.setattr(matching, "MAX_BUCKET", 1)
+    products = [product("a", i, f"Диван Лофт модель{i}") for i in range(20)]
+    products += [product("a", 100, "Диван угловой Лофт Оскар серый велюр раскладной 200x90"),
+                 product("b", 100, "Угловой диван Лофт Оскар серый велюр раскладной новинка 200x90")]
+    matcher = ProductMatcher()
+    matcher.sync(products)
+
+    assert [m["link"] for m in matcher.matches("https://b.test/100")] == ["https://a.test/100"]
+
+
+def links_of_groups(matcher):
+    return sorted(sorted(p["link"] for p in group["products"]) for group in matcher.groups())
+
+
+def test_incremental_sync_agrees_with_fresh_build():
+    products = [product(site, i, "Кресло Бержер бархат") for site in ("a", "b") for i in range(10)]
+    matcher = ProductMatcher()
+    matcher.sync(products, version=1)
+
+    # Уходят все опорные товары сайта b
+    remaining = [p for p in products if p["link"] not in {f"https://b.test/{i}" for i in range(5)}]
+    matcher.sync(remaining, version=2)
+    fresh = ProductMatcher()
+    fresh.sync(remaining)
+
+    assert links_of_groups(matcher) == links_of_groups(fresh)
+    assert len(matcher.groups()[0]["products"]) == 15
+    for p in remaining:
+        assert matcher.matches(p["link"]) == fresh.matches(p["link"])
+
+
+def test_new_anchor_links_to_existing_products():
+    # Товары сайта b уже проиндексированы; первый товар сайта a — опорный и связан со всеми
+    products = [product("b", i, "Кресло Бержер бархат") for i in range(10)]
+    matcher = ProductMatcher()
+    matcher.sync(products, version=1)
+    products.append(product("a", 0, "Кресло Бержер бархат"))
+    matcher.sync(products, version=2)
+    fresh = ProductMatcher()
+    fresh.sync(products)
+
+    assert links_of_groups(matcher) == links_of_groups(fresh)
+    for p in products:
+        assert matcher.matches(p["link"]) == fresh.matches(p["link"])
+
+
+def test_dimensions_veto_only_when_given_on_both_sides():
+    sized = matching.title_features("Диван Бостон угловой 200x90")
+    plain = matching.title_features("Диван Бостон угловой")
+    assert matching.features_match(sized, plain)
+    assert not matching.features_match(sized, matching.title_features("Диван Бостон угловой 180x90"))
+
+    matcher = ProductMatcher()
+    matcher.sync([product("a", 1, "Диван Бостон угловой 200x90"), product("b", 1, "Диван Бостон угловой")])
+    assert [m["link"] for m in matcher.matches("https://a.test/1")] == ["https://b.test/1"]
+
+
+def test_model_code_on_one_side_vetoes():
+    with_code = matching.title_features("Стул Бюрократ CH-797AXSN офисный")
+    without_code = matching.title_features("Стул Бюрократ офисный")
+    assert not matching.features_match(with_code, without_code)
@@ -0,0 +1,43 @@
+import pytest
+
+from store import ProductTable, read_snapshot, write_snapshot
+
+
+def product(link, price, site_name="A"):
+    return {"title": f"Товар {link}", "price": price, "link": link, "site_name": site_name, "category": "Диваны"}
+
+
+def prices(table):
+    return [p.get("price") for p in table.to_dicts()]
+
+
+def test_mixed_prices_keep_their_types():
+    products = [product("a", 5), product("b", 7.5), product("c", None), product("d", "по запросу")]
+    table = ProductTable.from_products(products)
+
+    assert table.to_dicts() == products
+    assert [type(p) for p in prices(table)[:2]] == [int, float]
+    assert type(table.row(0)["price"]) is int
+    assert table.priced().tolist() == [5.0, 7.5]
+
+
+def test_concat_of_int_and_float_partitions_keeps_int_prices():
+    ints = ProductTable.from_products([product("a", 5), product("b", 6)])
+    floats = ProductTable.from_products([product("c", 7.5, "B")])
+    table = ProductTable.concat([ints, floats])
+
+    assert table.price.dtype.kind == "f"
+    assert prices(table) == [5, 6, 7.5]
+    assert [type(p) for p in prices(table)] == [int, int, float]
+
+
+def test_snapshot_round_trip_keeps_int_prices(tmp_path):
+    pytest.importorskip("msgpack")
+    products = [product("a", 5), product("b", 7.5), product("c", 1000000)]
+    filename = str(tmp_path / "products.msgpack")
+
+    assert write_snapshot(ProductTable.from_products(products), filename, "v1")
+    table = read_snapshot(filename, "v1")
+
+    assert table.to_dicts() == products
+    assert [type(p) for p in prices(table)] == [int, float, int]
@@ -0,0 +1,203 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from parser import akram_mebel, fetcher, woo_api
+
+
+def api_product(i, price="1299900", minor_unit=2):
+    return {
+        "name": f"Стул &amp; {i}",
+        "permalink": f"https://shop.test/product/{i}/",
+        "prices": {"price": price, "currency_minor_unit": minor_unit},
+        "images": [{"thumbnail": f"https://shop.test/{i}-thumb.jpg", "src": f"https://shop.test/{i}.jpg"}]
+    }
+
+
+HTML_PAGE = """
+<ul>
+  <li class="product">
+    <a class="woocommerce-LoopProduct-link" href="https://shop.test/product/html-1/">
+      <img src="https://shop.test/html-1.jpg">
+      <h2 class="woocommerce-loop-product__title">Качели 1</h2>
+    </a>
+    <span class="woocommerce-Price-amount"><bdi>1 200,00&nbsp;c.</bdi></span>
+  </li>
+</ul>
+"""
+
+
+class StoreStub(BaseHTTPRequestHandler):
+    """Магазин WooCommerce: Store API по категориям и HTML-страницы каталога"""
+
+    # category -> страницы товаров Store API
+    pages = {}
+    requests = []
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.requests.append((url.path, query))
+        if url.path == woo_api.STORE_API_PATH:
+            pages = self.pages.get(query.get("category"))
+            if pages is None:
+                return self.reply(404, {"code": "rest_no_route"})
+            page = int(query.get("page", 1))
+            if page > len(pages):
+                return self.reply(400, {"code": "rest_post_invalid_page_number"})
+            return self.reply(200, pages[page - 1], {"X-WP-TotalPages": str(len(pages))})
+        if url.path == "/pc/kacheli/page/1/":
+            return self.reply(200, HTML_PAGE, content_type="text/html; charset=utf-8")
+        return self.reply(404, "not found", content_type="text/html")
+
+    def reply(self, status, body, headers=None, content_type="application/json"):
+        data = (json.dumps(body) if content_type == "application/json" else body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def store(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StoreStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StoreStub.pages = {}
+    StoreStub.requests = []
+    # Без ограничения частоты: тестовый сервер локальный
+    monkeypatch.setitem(fetcher._limiters, "127.0.0.1", fetcher.HostLimiter(rate=1000, max_rate=1000))
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_pagination_follows_total_pages(store, monkeypatch):
+    monkeypatch.setattr(woo_api, "PER_PAGE", 2)
+    StoreStub.pages["stulya"] = [[api_product(1), api_product(2)], [api_product(3), api_product(4)], [api_product(5), api_product(6)]]
+    seen = []
+
+    items = woo_api.parse_category(f"{store}/pc/stulya/", "akram-mebel", on_page=lambda page, items: seen.append(page))
+
+    assert [item["link"] for item in items] == [f"https://shop.test/product/{i}/" for i in range(1, 7)]
+    assert seen == [1, 2, 3]
+    # Полные страницы, но X-WP-TotalPages=3: четвёртую страницу не запрашиваем
+    assert [q["page"] for path, q in StoreStub.requests] == ["1", "2", "3"]
+
+
+def test_resume_from_start_page(store, monkeypatch):
+    monkeypatch.setattr(woo_api, "PER_PAGE", 1)
+    StoreStub.pages["stulya"] = [[api_product(1)], [api_product(2)]]
+
+    items = woo_api.parse_category(f"{store}/pc/stulya/", "akram-mebel", start_page=2)
+
+    assert [item["link"] for item in items] == ["https://shop.test/product/2/"]
+
+
+def test_item_mapping_and_minor_units(store):
+    StoreStub.pages["stulya"] = [[
+        api_product(1, price="1299900", minor_unit=2),
+        api_product(2, price="4500", minor_unit=0),
+        api_product(3, price="", minor_unit=2)
+    ]]
+
+    items = woo_api.parse_category(f"{store}/pc/stulya/", "akram-mebel")
+
+    assert [item["price"] for item in items] == [12999, 4500]
+    assert items[0] == {
+        "title": "Стул & 1",
+        "price": 12999,
+        "link": "https://shop.test/product/1/",
+        "image": "https://shop.test/1-thumb.jpg",
+        "category_url": f"{store}/pc/stulya/",
+        "site": "akram-mebel"
+    }
+
+
+def test_api_unavailable_falls_back_to_html(store):
+    # Для категории kacheli Store API отвечает 404 — парсер переходит на HTML
+    items = akram_mebel.parse_category(f"{store}/pc/kacheli/")
+
+    assert items == [{
+        "title": "Качели 1",
+        "price": 1200,
+        "link": "https://shop.test/product/html-1/",
+        "image": "https://shop.test/html-1.jpg",
+        "category_url": f"{store}/pc/kacheli/",
+        "site": "akram-mebel"
+    }]
+    paths = [path for path, q in StoreStub.requests]
+    assert paths[0] == woo_api.STORE_API_PATH
+    assert "/pc/kacheli/page/1/" in paths
+
+
+def test_empty_api_category_falls_back_to_html(store):
+    StoreStub.pages["kacheli"] = [[]]
+
+    items = akram_mebel.parse_category(f"{store}/pc/kacheli/")
+
+    assert [item["title"] for item in items] == ["Качели 1"]
+
+
+def test_server_error_keeps_collected_items(store, monkeypatch):
+    monkeypatch.setattr(woo_api, "PER_PAGE", 1)
+    monkeypatch.setattr(fetcher, "MAX_RETRIES", 0)
+    StoreStub.pages["stulya"] = [[api_product(1)], [api_product(2)], [api_product(3)]]
+    original = StoreStub.do_GET
+
+    def failing_page_two(handler):
+        if "page=2" in handler.path:
+            return handler.reply(500, {"code": "internal"})
+        return original(handler)
+
+    monkeypatch.setattr(StoreStub, "do_GET", failing_page_two)
+    with pytest.raises(fetcher.CategoryIncomplete) as e:
+        woo_api.parse_category(f"{store}/pc/stulya/", "akram-mebel")
+    assert [item["link"] for item in e.value.items] == ["https://shop.test/product/1/"]
+
+
+def test_pages_are_tagged_with_source(store):
+    StoreStub.pages["stulya"] = [[api_product(1)]]
+    seen = []
+
+    akram_mebel.parse_category(f"{store}/pc/stulya/", on_page=lambda page, items, source: seen.append((page, source)))
+    akram_mebel.parse_category(f"{store}/pc/kacheli/", on_page=lambda page, items, source: seen.append((page, source)))
+
+    assert seen == [(1, "api"), (1, "html")]
+
+
+def test_html_checkpoint_is_resumed_through_html(store):
+    # Страницы HTML 1–5 уже в чекпоинте; API отдал бы другие товары по номеру 6
+    StoreStub.pages["stulya"] = [[api_product(i) for i in range(100)], [api_product(i) for i in range(100, 150)]]
+
+    items = akram_mebel.parse_category(f"{store}/pc/stulya/", start_page=6, source="html")
+
+    assert items == []
+    assert [path for path, q in StoreStub.requests] == ["/pc/stulya/page/6/"]
+
+
+def test_api_checkpoint_is_resumed_through_api(store, monkeypatch):
+    monkeypatch.setattr(woo_api, "PER_PAGE", 1)
+    StoreStub.pages["stulya"] = [[api_product(1)], [api_product(2)]]
+
+    items = akram_mebel.parse_category(f"{store}/pc/stulya/", start_page=2, source="api")
+
+    assert [item["link"] for item in items] == ["https://shop.test/product/2/"]
+
+
+@pytest.mark.parametrize("category, source", [("stulya", None), ("kacheli", "api")])
+def test_checkpoint_that_cannot_be_resumed_restarts(store, category, source):
+    # Без пометки источника номер страницы ничего не значит; API-чекпоинт без API не продолжить
+    StoreStub.pages["stulya"] = [[api_product(1)]]
+
+    with pytest.raises(fetcher.ResumeUnavailable):
+        akram_mebel.parse_category(f"{store}/pc/{category}/", start_page=3, source=source)
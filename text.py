@@ -0,0 +1,73 @@
+import re
+
+# Таджикские буквы сводим к русским аналогам, ё — к е
+FOLD_TABLE = str.maketrans({
+    "ё": "е",
+    "ӣ": "и",
+    "ӯ": "у",
+    "ҳ": "х",
+    "қ": "к",
+    "ғ": "г",
+    "ҷ": "ч"
+})
+
+TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+# Размеры: 200x90, 160 х 200, 2000*900*450 (латинская x, кириллическая х, ×, *)
+DIMENSIONS_RE = re.compile(r"(\d{2,4})\s*[xх×*]\s*(\d{2,4})(?:\s*[xх×*]\s*(\d{2,4}))?")
+
+# Окончания для лёгкого стемминга, от длинных к коротким
+RUSSIAN_ENDINGS = sorted([
+    "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее",
+    "ые", "ие", "ый", "ий", "ой", "ей", "ов", "ев", "ах", "ях", "ом", "ем", "ам",
+    "ям", "ую", "юю", "ы", "и", "а", "я", "о", "е", "у", "ю", "ь"
+], key=len, reverse=True)
+MIN_STEM = 3
+
+
+def fold(value):
+    """Нижний регистр, ё→е, таджикские буквы → русские"""
+    return (value or "").lower().translate(FOLD_TABLE)
+
+
+def stem(word):
+    """Лёгкий стемминг: отрезаем окончание, если остаётся не меньше MIN_STEM букв"""
+    if word.isdigit():
+        return word
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(value):
+    """Слова заголовка после fold (без стемминга)"""
+    return TOKEN_RE.findall(fold(value))
+
+
+def dimensions(value):
+    """Размеры из заголовка в виде строк '200x90' / '200x90x45'"""
+    result = []
+    for match in DIMENSIONS_RE.finditer(fold(value)):
+        result.append("x".join(part for part in match.groups() if part))
+    return result
+
+
+def is_model_code(token):
+    """Артикул/модель: токен с цифрами (0005, b12, 1200m)"""
+    return any(ch.isdigit() for ch in token) and len(token) >= 2
+
+
+def terms(value):
+    """
+    Термы для поиска: основы слов и артикулы в порядке заголовка, затем размеры.
+    Однобуквенные слова («и», «с») пропускаются.
+    """
+    folded = fold(value)
+    result = []
+    for token in TOKEN_RE.findall(DIMENSIONS_RE.sub(" ", folded)):
+        if is_model_code(token) or token.isdigit():
+            result.append(token)
+        elif len(token) >= 2:
+            result.append(stem(token))
+    result.extend("x".join(part for part in m.groups() if part) for m in DIMENSIONS_RE.finditer(folded))
+    return result